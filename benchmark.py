@@ -0,0 +1,661 @@
+"""
+The `benchmark.py` script measures the migration functions on synthetic Benchling exports, so that the speed of a change can be checked before running a production migration.
+The migrator scenarios generate synthetic sources (files and folders, a multi-sheet workbook, Benchling entries with a huge table, GenBank files), migrate them against a FakeLabiiServer with latency, each in a process of its own, and report the items/s, MB/s and peak RSS of each migrator.
+Usage: python benchmark.py [transform parsers gb_lookup files excel benchling plasmids] [--scale 0.1] [--output bench.json] [--compare bench.json]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import datetime
+import random
+import string
+import tempfile
+import glob
+import argparse
+import subprocess
+import multiprocessing
+import openpyxl
+from bs4 import BeautifulSoup
+import migrate_benchling_entries as benchling
+from file_index import FileNameIndex
+from fake_labii import FakeLabiiServer, FILE_TABLE_SID
+from labii_client import AdaptiveClient
+from labii_upload import ChunkedUploadLabiiObject
+from migration_journal import MigrationJournal
+from migration_plan import build_plan
+from directory_scan import scan_sources
+from migrate_file_as_entry import open_labii, migrate_files_in_pool, migrate_files_in_pipeline, parse_arguments as parse_files_arguments
+from migrate_excel_sheet_as_entry import upload_sheet_as_labii_entry, sheet_timestamp
+from labii_records import iterate_records
+from migrate_benchling_plasminds import migrate_plasmids, find_gb_key_by_name
+try:
+	import resource
+except ImportError: # not available on windows
+	resource = None
+
+class FakeLabii:
+	""" stand in for LabiiObject, return a file record without calling the api """
+
+	def __init__(self):
+		self.uploads = 0
+
+	def upload(self, file_path, workspaces):#pylint: disable=unused-argument
+		""" return a file record based on the file path """
+		self.uploads += 1
+		sid = hashlib.md5(file_path.encode("utf-8")).hexdigest()[:20]
+		return {
+			"sid": sid,
+			"uid": f"FI{self.uploads}",
+			"name": os.path.basename(file_path),
+			"version": {"sid": f"v{sid[:19]}"}
+		}
+
+def generate_benchling_entry(folder, name, days=10, items=30, tables=1, rows=1000, columns=8):
+	"""
+		write a synthetic benchling entry and its attachments to the folder, return the path of the html file
+		- days, number of day separators
+		- items, number of text, code and file items per day
+		- tables, number of tables per day
+		- rows, number of rows per table, 3 of every 4 rows are empty
+	"""
+	file_path = os.path.join(folder, f"etr_{name}.html")
+	parts = ["<html><head><style>.mediocre-item { color: red; }</style></head><body>"]
+	date = datetime.date(2023, 1, 2)
+	for day in range(days):
+		current = date + datetime.timedelta(days=day)
+		parts.append(f'<div class="daySeparator"><span class="daySeparator-date">{current.strftime("%A, %m/%d/%Y")}</span></div>')
+		for item in range(items):
+			kind = item % 3
+			if kind == 0:
+				parts.append(f'<div class="mediocre-item is-text"><div class="note-text"> Day {day} note {item} &amp; result &lt;ok&gt; </div></div>')
+			elif kind == 1:
+				parts.append(f'<div class="mediocre-item is-code"><pre>for i in range({item}):\n\tprint(i)</pre></div>')
+			else:
+				file_name = f"data {item % 5}.csv"
+				parts.append(f'<div class="mediocre-item is-file"><div class="note-itemName"> {file_name} </div><style>.x {{}}</style></div>')
+		# items inside items, read after the transform of their content
+		parts.append(f'<div class="mediocre-item is-text"> Moved from <div class="daySeparator"><span class="daySeparator-date">{current.strftime("%A, %m/%d/%Y")}</span></div></div>')
+		parts.append('<div class="mediocre-item is-code"><pre>x = 1</pre><div class="mediocre-item is-text">   quoted note   </div></div>')
+		for table in range(tables):
+			parts.append('<div class="mediocre-item is-table"><div class="mediocre-tableEditable-fillerTableWrapper"><table><tr><td>filler</td></tr></table></div><table><tbody>')
+			header = "".join(f'<td><div class="mediocre-tableEditable-axisCell-labelWrapper"><span>C{column}</span><span>C{column}</span></div></td>' for column in range(columns))
+			parts.append(f"<tr>{header}</tr>")
+			for row in range(rows):
+				if row % 4 == 0:
+					cells = "".join(f"<td>{table}-{row}-{column}</td>" for column in range(columns - 1))
+				else:
+					cells = "".join("<td> </td>" for column in range(columns - 1))
+				parts.append(f"<tr><td>{row + 1}</td>{cells}</tr>")
+			parts.append("</tbody></table></div>")
+	parts.append("</body></html>")
+	with open(file_path, "w", encoding="utf-8") as file:
+		file.write("".join(parts))
+	# write the attachments, using the naming of update_file
+	for index in range(5):
+		file_name = f"data {index}.csv"
+		copies = sum(1 for item in range(items) if item % 3 == 2 and item % 5 == index) * days
+		for copy in range(1, copies + 1):
+			attachment = file_path.replace(".html", f" {file_name}" if copy == 1 else f" data {index} {copy}.csv")
+			with open(attachment, "w", encoding="utf-8") as file:
+				file.write(f"a,b\n{index},{copy}\n")
+	return file_path
+
+# the transforms of migrate_benchling_entries.py before the transform engine, kept as they were to check the output of the engine
+def update_day_separator(soup):
+	""" update the day separator with labii day """
+	# Find all <div> tags with class "daySeparator"
+	day_separator_divs = soup.find_all('div', class_='daySeparator')
+	# Define the replacement HTML
+	replacement_html = '<div class="labii-day"><span class="labii-day-label">{date}</span></div>'
+	# Loop through the found <div> tags and replace them
+	for day_div in day_separator_divs:
+		date_span = day_div.find('span', class_='daySeparator-date')
+		if date_span:
+			date = date_span.text.strip()
+			parsed_date = datetime.datetime.strptime(date, "%A, %m/%d/%Y")
+			formatted_date = parsed_date.strftime("%A, %Y-%m-%d")
+			# Create the replacement HTML with the modified date
+			replacement = replacement_html.format(date=formatted_date)
+			# Replace the current <div> with the replacement HTML
+			day_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
+	return soup
+
+def update_text_item(soup):
+	""" update the text item with p """
+	# Find all text <div>
+	text_divs = soup.find_all('div', class_='mediocre-item is-text')
+	# Define the replacement HTML
+	replacement_html = '<p>{text}</p>'
+	# Loop through the found <div> tags and replace them
+	for text_div in text_divs:
+		text = text_div.text.strip()
+		# Create the replacement HTML with the modified date
+		replacement = replacement_html.format(text=text)
+		# Replace the current <div> with the replacement HTML
+		text_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
+	return soup
+
+def update_code_item(soup):
+	""" update the text item with p """
+	# Find all text <div>
+	text_divs = soup.find_all('div', class_='mediocre-item is-code')
+	# Define the replacement HTML
+	replacement_html = '<pre data-language="Plain text" spellcheck="false" xpath="1"><code class="language-plaintext">{text}</code></pre>'
+	# Loop through the found <div> tags and replace them
+	for text_div in text_divs:
+		text = text_div.text.strip()
+		# Create the replacement HTML with the modified date
+		replacement = replacement_html.format(text=text)
+		# Replace the current <div> with the replacement HTML
+		text_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
+	return soup
+
+def update_file(soup, labii, current_file, settings):
+	""" update the file with labii file """
+	# Find all <div> tags with class "daySeparator"
+	file_divs = soup.find_all('div', class_='mediocre-item')
+	# Define the replacement HTML
+	replacement_html = '<section class="labii-file" sid="{file_sid}" name="{file_name}" version="{version_sid}" should_hide_preview="false"></section>'
+	# Loop through the found <div> tags and replace them
+	name_index = {} # incase the same name used multiple times
+	for file_div in file_divs:
+		name_div = file_div.find('div', class_='note-itemName')
+		if name_div:
+			file_name = name_div.text.strip()
+			# update name index
+			if not file_name in name_index:
+				name_index[file_name] = 1
+			else:
+				name_index[file_name] += 1
+			# upload file
+			file_path = current_file.replace(".html", f" {file_name}")
+			name_parts = os.path.splitext(file_name)
+			if name_index[file_name] > 1:
+				file_path = current_file.replace(".html", f" {name_parts[0]} {name_index[file_name]}{name_parts[1]}")
+			if os.path.exists(file_path):
+				file_record = labii.upload(file_path, [{"sid": settings["labii_project_sid"]}])
+				# Create the replacement HTML with the modified date
+				replacement = replacement_html.format(file_sid=file_record['sid'], file_name=f"{file_record['uid']}: {file_record['name']}", version_sid=file_record['version']['sid'])
+				# Replace the current <div> with the replacement HTML
+				file_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
+			else:
+				print(f"Error: File ({file_path}) not exists!")
+				sys.exit()
+	return soup
+
+def update_td_content(soup):
+	""" benchling table headers disable the same value twice, use this function to only keep one version """
+	# Find all <td> tags
+	td_tags = soup.find_all('td')
+	# Loop through the <td> tags
+	for td in td_tags:#pylint: disable=invalid-name
+		# find the label wrapper
+		wrapper_div = td.find('div', class_='mediocre-tableEditable-axisCell-labelWrapper')
+		if wrapper_div:
+			# Find the first element inside the <td> tag
+			first_element = wrapper_div.find(True, recursive=False)
+			if first_element:
+				# Replace the inner HTML of the <td> tag with the text from the first element
+				td.string = first_element.get_text()
+	return soup
+
+def remove_style_tags(soup):
+	""" remove the inline style tags """
+	style_tags = soup.find_all('style')
+	for style_tag in style_tags:
+		style_tag.extract()
+	return soup
+
+def remove_table_wrapper_div(soup):
+	""" for each table, benchling comes with a table wrapper """
+	wrappers = soup.find_all('div', class_='mediocre-tableEditable-fillerTableWrapper')
+	for tag in wrappers:
+		tag.extract()
+	return soup
+
+def remove_empty_table_tr(soup):
+	""" some of table contains a lot of empty rows, these need to be removed to save space """
+	rows = soup.find_all('tr')
+	total_rows = len(rows)
+	if total_rows > 500:# only delete big tables
+		for row in rows:
+			should_delete = True
+			cells = row.find_all('td')[1:]
+			for cell in cells:
+				if any(cell.stripped_strings):
+					should_delete = False
+					break
+			if should_delete:
+				row.extract()
+		rows = soup.find_all('tr')
+		deleted_rows = total_rows - len(rows)
+		if deleted_rows > 0:
+			print(f"Deleted rows {deleted_rows}")
+	return soup
+
+def transform_with_chain(soup, labii, current_file, settings):
+	"""
+		the transforms of the baseline called one after another, as before the transform engine
+		- the baseline removes the empty rows of every table once the document has more than 500 rows, the engine those of the tables with more than 500 rows and their trailing empty columns: the same rows for generate_benchling_entry, each table has 1000 rows and no empty column by default
+	"""
+	soup = update_day_separator(soup)
+	soup = update_text_item(soup)
+	soup = update_code_item(soup)
+	soup = update_file(soup, labii, current_file, settings)
+	soup = update_td_content(soup)
+	soup = remove_style_tags(soup)
+	soup = remove_table_wrapper_div(soup)
+	soup = remove_empty_table_tr(soup)
+	return str(soup.find('body'))
+
+def transform_with_engine(soup, labii, current_file, settings):
+	""" the single pass transform engine """
+	soup = benchling.transform_entry(soup, labii, current_file, settings)
+	return str(soup.find('body'))
+
+def bench_html_transform(entries=2, **kwargs):
+	""" compare the transform chain with the transform engine on synthetic entries, the output must be identical """
+	settings = {"labii_project_sid": "benchmark"}
+	timings = {"parse": 0, "chain": 0, "engine": 0}
+	total_size = 0
+	with tempfile.TemporaryDirectory() as folder:
+		for index in range(entries):
+			current_file = generate_benchling_entry(folder, str(index), **kwargs)
+			with open(current_file, 'r', encoding='utf-8') as file:
+				html_content = file.read()
+			total_size += len(html_content)
+			results = {}
+			for name, transform in [("chain", transform_with_chain), ("engine", transform_with_engine)]:
+				start = time.perf_counter()
+				soup = BeautifulSoup(html_content, 'html.parser')
+				timings["parse"] += (time.perf_counter() - start) / 2
+				start = time.perf_counter()
+				results[name] = transform(soup, FakeLabii(), current_file, settings)
+				timings[name] += time.perf_counter() - start
+			if results["chain"] != results["engine"]:
+				raise RuntimeError(f"Error: the transform engine output is different for {current_file}!")
+	print(f"HTML transform, {entries} entries, {total_size / 1024 / 1024:.1f} MB")
+	for name, seconds in timings.items():
+		print(f"{name}: {seconds:.2f}s ({total_size / 1024 / 1024 / seconds:.2f} MB/s)")
+	print(f"transform speedup: {timings['chain'] / timings['engine']:.2f}x")
+	return timings
+
+def bench_parsers(entries=2, **kwargs):
+	""" compare the parsers and the stream transform on synthetic entries, the output must be identical """
+	timings = {}
+	total_size = 0
+	with tempfile.TemporaryDirectory() as folder:
+		files = [generate_benchling_entry(folder, str(index), **kwargs) for index in range(entries)]
+		total_size = sum(os.path.getsize(current_file) for current_file in files)
+		differences = benchling.check_parser_conformance(files)
+		if len(differences) > 0:
+			raise RuntimeError(f"Error: the output of {differences} is different!")
+		variants = [(parser, {"parser": parser}) for parser in benchling.PARSERS] + [("stream", {"stream_threshold": 0})]
+		for name, kwargs_entry in variants:
+			start = time.perf_counter()
+			for current_file in files:
+				benchling.prepare_entry(current_file, **kwargs_entry)
+			timings[name] = time.perf_counter() - start
+	print(f"Parsers, {entries} entries, {total_size / 1024 / 1024:.1f} MB, same output")
+	for name, seconds in timings.items():
+		print(f"{name}: {seconds:.2f}s ({total_size / 1024 / 1024 / seconds:.2f} MB/s)")
+	return timings
+
+def bench_plan(entries=2, **kwargs):
+	"""
+		compare the attachments found by the migration plan with the files of the transform, they must be identical
+		- fails if the plan does not report an attachment removed from the folder
+	"""
+	with tempfile.TemporaryDirectory() as folder:
+		files = [generate_benchling_entry(folder, str(index), **kwargs) for index in range(entries)]
+		total_size = sum(os.path.getsize(current_file) for current_file in files)
+		start = time.perf_counter()
+		plan = build_plan("benchling", folder)
+		plan_time = time.perf_counter() - start
+		start = time.perf_counter()
+		expected = [benchling.prepare_entry(current_file)[1] for current_file in files]
+		transform_time = time.perf_counter() - start
+		planned = [[file["path"] for file in entry["files"]] for entry in plan["entries"]]
+		if planned != expected or plan["totals"]["missing"] > 0:
+			raise RuntimeError("Error: the attachments of the plan are different from the files of the transform!")
+		removed = expected[0][-1]
+		os.remove(removed)
+		if build_plan("benchling", folder)["entries"][0]["missing"] != [removed]:
+			raise RuntimeError(f"Error: the plan did not find that {removed} is missing!")
+	print(f"Plan, {entries} entries, {total_size / 1024 / 1024:.1f} MB, {plan['totals']['files']} files, same files as the transform")
+	print(f"plan: {plan_time:.2f}s ({total_size / 1024 / 1024 / plan_time:.2f} MB/s)")
+	print(f"transform: {transform_time:.2f}s ({total_size / 1024 / 1024 / transform_time:.2f} MB/s)")
+	return {"plan": plan_time, "transform": transform_time}
+
+def genbank_record(name, length, generator):
+	""" return the text of a GenBank record of a random sequence of length bp """
+	sequence = "".join(generator.choice("acgt") for _ in range(length))
+	lines = [
+		f"LOCUS       {name:<16} {length} bp    DNA     circular SYN 02-JAN-2023",
+		f"DEFINITION  {name} synthetic plasmid.",
+		"FEATURES             Location/Qualifiers",
+		f"     source          1..{length}",
+		"ORIGIN"
+	]
+	for start in range(0, length, 60):
+		blocks = " ".join(sequence[position:position + 10] for position in range(start, min(start + 60, length), 10))
+		lines.append(f"{start + 1:>9} {blocks}")
+	lines.append("//")
+	return "\n".join(lines) + "\n"
+
+def generate_gb_folder(folder, files=20000, seed=0, length=0):
+	"""
+		write *.gb files named like the benchling exports, return the list of (plasmid name, seq id)
+		- length, the bp of the sequence of each file, 0 to write empty files
+	"""
+	generator = random.Random(seed)
+	plasmids = []
+	for index in range(files):
+		name = f"pLAB{index:05d}"
+		seqid = "seq_" + "".join(generator.choice(string.ascii_letters + string.digits) for _ in range(8))
+		with open(os.path.join(folder, f"{name}-{seqid}.gb"), "w", encoding="utf-8") as file:
+			if length > 0:
+				file.write(genbank_record(name, length, generator))
+		plasmids.append((name, seqid))
+	return plasmids
+
+def generate_workbook(folder, name, sheets=10, rows=1000, columns=10, seed=0):
+	""" write a workbook with sheets named with a mmddyy date, each with a header and rows of numbers, text and empty cells, return its path """
+	generator = random.Random(seed)
+	file_path = os.path.join(folder, f"{name}.xlsx")
+	workbook = openpyxl.Workbook(write_only=True)
+	date = datetime.date(2023, 1, 2)
+	for index in range(sheets):
+		sheet = workbook.create_sheet(f"Run {index} {(date + datetime.timedelta(days=index)).strftime('%m%d%y')}")
+		sheet.append([f"C{column}" for column in range(columns)])
+		for row in range(rows):
+			sheet.append([row if column == 0 else generator.random() if column % 3 == 1 else f"sample {row}-{column}" if column % 3 == 2 else None for column in range(columns)])
+	workbook.save(file_path)
+	return file_path
+
+def generate_file_tree(folder, files=100, folders=10, files_per_folder=3, size=64 * 1024, seed=0):
+	""" write the sources of migrate_file_as_entry: files of size bytes, and folders of files_per_folder files """
+	generator = random.Random(seed)
+	for index in range(files):
+		with open(os.path.join(folder, f"file {index}.dat"), "wb") as file:
+			file.write(generator.randbytes(size))
+	for index in range(folders):
+		os.makedirs(os.path.join(folder, f"folder {index}"))
+		for item in range(files_per_folder):
+			with open(os.path.join(folder, f"folder {index}", f"file {item}.dat"), "wb") as file:
+				file.write(generator.randbytes(size))
+
+def bench_gb_lookup(plasmids=20000, files=20000, sample=200):
+	"""
+		compare glob with FileNameIndex to find the *.gb file of each plasmid, by name and by seq id
+		- glob is timed on a sample of the lookups and extrapolated to all plasmids
+	"""
+	with tempfile.TemporaryDirectory() as folder:
+		names = generate_gb_folder(folder, files)
+		keys = [names[index % files][index % 2] for index in range(plasmids)]
+		start = time.perf_counter()
+		index = FileNameIndex(folder, ".gb")
+		build = time.perf_counter() - start
+		start = time.perf_counter()
+		results = [index.find(key) for key in keys]
+		lookup = time.perf_counter() - start
+		sample_keys = keys[::max(1, len(keys) // sample)]
+		start = time.perf_counter()
+		for position, key in enumerate(sample_keys):
+			files_glob = sorted(glob.glob(f"{folder}/*{key}*.gb"))
+			if files_glob != results[position * max(1, len(keys) // sample)]:
+				raise RuntimeError(f"Error: FileNameIndex result is different from glob for {key}!")
+		glob_time = (time.perf_counter() - start) / len(sample_keys) * len(keys)
+	print(f"*.gb lookup, {plasmids} plasmids, {files} files")
+	print(f"glob: {glob_time:.2f}s (extrapolated from {len(sample_keys)} lookups)")
+	print(f"index: {build + lookup:.2f}s ({build:.2f}s to build, {lookup:.2f}s to look up)")
+	print(f"speedup: {glob_time / (build + lookup):.0f}x")
+	return {"glob": glob_time, "index": build + lookup}
+
+# the entry points -> the heavy modules they must not import at startup, only on the code paths that need them
+STARTUP_ENTRY_POINTS = {
+	"manage": ["labii_sdk_core", "requests", "pandas", "openpyxl", "bs4", "lxml", "html5lib", "numpy"],
+	"migrate_file_as_entry": ["pandas", "openpyxl", "bs4", "lxml", "html5lib", "numpy"],
+	"migrate_excel_sheet_as_entry": ["pandas", "openpyxl", "bs4", "lxml", "html5lib", "numpy"],
+	"migrate_benchling_entries": ["pandas", "openpyxl", "bs4", "lxml", "html5lib", "numpy"],
+	"migrate_benchling_plasminds": ["pandas", "openpyxl", "bs4", "lxml", "html5lib", "numpy"],
+	"migration_runner": ["pandas", "openpyxl", "bs4", "lxml", "html5lib", "numpy"],
+	"migration_plan": ["pandas", "openpyxl", "bs4", "lxml", "html5lib", "numpy"]
+}
+
+# seconds, the most an entry point can take to import, about twice the slowest one (migrate_benchling_entries, 0.17s)
+STARTUP_BUDGET = 0.4
+
+def import_times(module):
+	""" return {module: cumulative seconds} of the modules imported by `import module` in a new interpreter, from python -X importtime """
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+	times = {}
+	for line in result.stderr.splitlines():
+		fields = line[len("import time:"):].split("|")
+		if line.startswith("import time:") and len(fields) == 3 and fields[1].strip().isdigit():
+			times[fields[2].strip()] = int(fields[1]) / 1000000
+	return times
+
+def bench_startup(runs=3, budget=STARTUP_BUDGET):
+	"""
+		measure the import time of the entry points, the best of runs new interpreters
+		- fails if an entry point imports one of its heavy modules (STARTUP_ENTRY_POINTS) at startup, or takes more than budget seconds
+	"""
+	timings = {}
+	print(f"Startup, best of {runs} imports")
+	for module, heavy_modules in STARTUP_ENTRY_POINTS.items():
+		runs_times = [import_times(module) for _ in range(runs)]
+		imported = [name for name in heavy_modules if any(name in times for times in runs_times)]
+		if len(imported) > 0:
+			raise RuntimeError(f"Error: {module} imports {', '.join(imported)} at startup!")
+		timings[module] = min(times[module] for times in runs_times)
+		print(f"{module}: {timings[module] * 1000:.0f}ms")
+		if budget is not None and timings[module] > budget:
+			raise RuntimeError(f"Error: {module} takes {timings[module]:.2f}s to import, more than {budget:.2f}s!")
+	return timings
+
+PLASMID_TABLE_SID = "benchplasmid0a40xtbl"
+BENCH_SETTINGS = {
+	"labii_project_sid": "benchproject0a40xprj",
+	"labii_table_entry_sid": "benchentry0a40xtable",
+	"labii_table_file_sid": FILE_TABLE_SID
+}
+
+def folder_size(folder):
+	""" return the total size of the files of the folder and its subfolders """
+	return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(folder) for name in names)
+
+def peak_rss_mb():
+	""" return the peak resident memory of this process in MB, None if not available """
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# bytes on macOS, KB elsewhere
+	return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def generate_files_scenario(folder, scale):
+	""" write the sources of the files scenario, return the number of entries expected """
+	files, folders = max(1, int(200 * scale)), max(1, int(20 * scale))
+	generate_file_tree(folder, files=files, folders=folders)
+	return files + folders
+
+def run_files_scenario(labii, server, folder, settings, journal, options):#pylint: disable=unused-argument
+	""" migrate_file_as_entry, each file and folder as an entry, with the thread pool, or the staged pipeline with --pipeline """
+	labii.get_file_table()
+	if options.pipeline:
+		migrate_files_in_pipeline(labii, scan_sources(folder), settings, journal, parse_files_arguments(["--pipeline"]))
+	else:
+		migrate_files_in_pool(labii, scan_sources(folder), settings, options.workers, journal)
+
+def generate_excel_scenario(folder, scale):
+	""" write the workbook of the excel scenario, return the number of entries expected """
+	sheets = max(1, int(20 * scale))
+	generate_workbook(folder, "workbook", sheets=sheets, rows=2000, columns=10)
+	return sheets
+
+def run_excel_scenario(labii, server, folder, settings, journal, options):#pylint: disable=unused-argument
+	""" migrate_excel_sheet_as_entry --stream, each sheet as an entry """
+	file_path = os.path.join(folder, "workbook.xlsx")
+	workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+	for sheet_name in workbook.sheetnames:
+		file_name = os.path.basename(file_path).replace(".xlsx", f" - {sheet_name}.xlsx")
+		upload_sheet_as_labii_entry(labii, workbook[sheet_name], file_name, sheet_timestamp(sheet_name, file_path), settings, journal=journal, journal_key=f"{file_path}#{sheet_name}")
+	workbook.close()
+
+def generate_benchling_scenario(folder, scale):
+	""" write the entries of the benchling scenario, one of them with a huge table, return the number of entries expected """
+	entries = max(1, int(20 * scale))
+	generate_benchling_entry(folder, "huge", days=1, items=3, tables=1, rows=max(1000, int(20000 * scale)))
+	for index in range(entries - 1):
+		generate_benchling_entry(folder, str(index), days=5, items=30, tables=1, rows=1000)
+	return entries
+
+def run_benchling_scenario(labii, server, folder, settings, journal, options):#pylint: disable=unused-argument
+	""" migrate_benchling_entries, parse and transform the entries in --processes processes, upload their files and create the entries, in the staged pipeline with --pipeline """
+	files = sorted(glob.glob(f"{folder}/*.html"))
+	if options.pipeline:
+		benchling.migrate_entries_in_pipeline(labii, files, settings, journal, benchling.parse_arguments(["--pipeline", "--processes", str(options.processes)]))
+	else:
+		benchling.migrate_entries_in_processes(labii, files, settings, options.processes, journal)
+
+def generate_plasmids_scenario(folder, scale):
+	""" write the *.gb files of the plasmids scenario, return the number of plasmids expected """
+	plasmids = max(1, int(500 * scale))
+	generate_gb_folder(folder, files=plasmids, length=5000)
+	return plasmids
+
+def run_plasmids_scenario(labii, server, folder, settings, journal, options):#pylint: disable=unused-argument
+	""" migrate_benchling_plasminds by name, the plasmids are created in the fake server with a files section """
+	for file_name in sorted(os.listdir(folder)):
+		name = file_name.split("-")[0]
+		server.add_record(PLASMID_TABLE_SID, {"name": name, "projects": [{"sid": settings["labii_project_sid"]}], "section_set": [{"sid": f"SEC{name}", "name": "Files"}]})
+	gb_index = FileNameIndex(folder, ".gb")
+	plasmids = iterate_records(labii.Record, serializer="detail", query=f"table__sid={PLASMID_TABLE_SID}")
+	migrate_plasmids(labii, plasmids, gb_index, find_gb_key_by_name, settings, journal=journal)
+
+MICRO_BENCHMARKS = ["startup", "transform", "parsers", "plan", "gb_lookup"]
+SCENARIOS = {
+	"files": (generate_files_scenario, run_files_scenario),
+	"excel": (generate_excel_scenario, run_excel_scenario),
+	"benchling": (generate_benchling_scenario, run_benchling_scenario),
+	"plasmids": (generate_plasmids_scenario, run_plasmids_scenario)
+}
+
+def run_scenario(name, folder, options, results):
+	"""
+		run the migrator of the scenario on the sources of the folder against a FakeLabiiServer, in a process of its own so that its peak memory is its own
+		- the measures are put in the results queue
+	"""
+	if not options.verbose:
+		# the migrators print each item
+		devnull = os.open(os.devnull, os.O_WRONLY)
+		os.dup2(devnull, sys.stdout.fileno())
+	try:
+		with FakeLabiiServer(latency=options.latency) as server, MigrationJournal(os.path.join(folder, "journal.sqlite")) as journal:
+			settings = dict(BENCH_SETTINGS, labii_base_url=server.base_url, labii_organization_sid=server.organization__sid)
+			client = AdaptiveClient(max_concurrency=options.max_concurrency)
+			labii = open_labii(settings, client)
+			labii.api.login(email="bench@labii.com", password="bench")
+			labii = ChunkedUploadLabiiObject(labii)
+			start = time.perf_counter()
+			SCENARIOS[name][1](labii, server, os.path.join(folder, "source"), settings, journal, options)
+			seconds = time.perf_counter() - start
+			sys.stdout.flush()
+			results.put({"items": len(journal.done), "errors": [error for _, error in journal.errors[:5]], "seconds": seconds, "peak_rss_mb": peak_rss_mb(), "requests": client.stats["requests"]})
+	except Exception as error:#pylint: disable=broad-exception-caught
+		results.put({"error": f"{type(error).__name__}: {error}"})
+
+def bench_migrator(name, options):
+	""" generate the sources of the scenario, migrate them in a process against a FakeLabiiServer, return the measures; fails if an item is not migrated """
+	context = multiprocessing.get_context("spawn")
+	with tempfile.TemporaryDirectory() as folder:
+		source = os.path.join(folder, "source")
+		os.makedirs(source)
+		expected = SCENARIOS[name][0](source, options.scale)
+		size = folder_size(source)
+		results = context.Queue()
+		process = context.Process(target=run_scenario, args=(name, folder, options, results))
+		process.start()
+		result = results.get()
+		process.join()
+	if "error" in result:
+		raise RuntimeError(f"Error: the {name} scenario failed: {result['error']}!")
+	if result["items"] != expected or len(result["errors"]) > 0:
+		raise RuntimeError(f"Error: the {name} scenario migrated {result['items']} of {expected} items: {result['errors']}!")
+	result.update({
+		"bytes": size,
+		"items_per_second": result["items"] / result["seconds"],
+		"mb_per_second": size / 1024 / 1024 / result["seconds"]
+	})
+	peak = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.0f} MB"
+	print(f"{name}: {result['items']} items, {size / 1024 / 1024:.1f} MB in {result['seconds']:.2f}s, {result['items_per_second']:.1f} items/s, {result['mb_per_second']:.2f} MB/s, peak RSS {peak}, {result['requests']} requests")
+	return result
+
+def compare_results(results, baseline, tolerance=0.1):
+	""" print the change of items/s of each scenario against the baseline results, return the scenarios slower by more than tolerance """
+	regressions = []
+	for name, result in results.items():
+		if not name in baseline:
+			continue
+		change = result["items_per_second"] / baseline[name]["items_per_second"] - 1
+		slower = change < -tolerance
+		print(f"{name}: {change * 100:+.1f}% items/s{' REGRESSION' if slower else ''}")
+		if slower:
+			regressions.append(name)
+	return regressions
+
+def parse_arguments(argv=None):
+	""" return the command line arguments """
+	parser = argparse.ArgumentParser(description="Measure the migration functions and the migrators on synthetic exports.")
+	parser.add_argument("scenarios", nargs="*", help=f"the benchmarks to run, default all: {', '.join(MICRO_BENCHMARKS + list(SCENARIOS))}")
+	parser.add_argument("--scale", type=float, default=1.0, help="multiply the size of the generated data, for example 0.1 for a quick check, default 1")
+	parser.add_argument("--latency", type=float, default=0.01, help="seconds the fake Labii server waits before answering each request, default 0.01")
+	parser.add_argument("--workers", type=int, default=4, help="number of threads of the files scenario, default 4")
+	parser.add_argument("--processes", type=int, default=1, help="number of processes of the benchling scenario, default 1")
+	parser.add_argument("--pipeline", action="store_true", help="run the files and benchling scenarios in the staged pipeline of the migrators, with their default workers")
+	parser.add_argument("--max-concurrency", type=int, default=16, help="maximum concurrent api requests, default 16")
+	parser.add_argument("--output", default=None, help="write the measures of the migrators to this JSON file")
+	parser.add_argument("--compare", default=None, help="compare the items/s of the migrators with a JSON file written by --output, exit with 1 if a migrator is slower by more than --tolerance")
+	parser.add_argument("--tolerance", type=float, default=0.1, help="the part of the items/s a migrator can lose before it is a regression, default 0.1")
+	parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET, help=f"the most seconds an entry point can take to import, default {STARTUP_BUDGET}")
+	parser.add_argument("--verbose", action="store_true", help="print the output of the migrators")
+	args = parser.parse_args(argv)
+	unknown = [name for name in args.scenarios if not name in MICRO_BENCHMARKS + list(SCENARIOS)]
+	if len(unknown) > 0:
+		parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+	return args
+
+def main(argv=None):
+	""" run the benchmarks, return the measures of the migrators """
+	args = parse_arguments(argv)
+	scenarios = args.scenarios or MICRO_BENCHMARKS + list(SCENARIOS)
+	if "startup" in scenarios:
+		bench_startup(budget=args.startup_budget)
+	if "transform" in scenarios:
+		bench_html_transform(entries=max(1, int(2 * args.scale)))
+	if "parsers" in scenarios:
+		bench_parsers(entries=max(1, int(2 * args.scale)))
+	if "plan" in scenarios:
+		bench_plan(entries=max(1, int(2 * args.scale)))
+	if "gb_lookup" in scenarios:
+		bench_gb_lookup(plasmids=max(100, int(20000 * args.scale)), files=max(100, int(20000 * args.scale)))
+	results = {}
+	for name in SCENARIOS:
+		if name in scenarios:
+			results[name] = bench_migrator(name, args)
+	if args.output is not None and len(results) > 0:
+		with open(args.output, "w", encoding="utf-8") as file:
+			json.dump(results, file, indent=2)
+		print(f"Measures written to {args.output}")
+	if args.compare is not None:
+		with open(args.compare, "r", encoding="utf-8") as file:
+			regressions = compare_results(results, json.load(file), args.tolerance)
+		if len(regressions) > 0:
+			print(f"Error: {', '.join(regressions)} slower than {args.compare}!")
+			sys.exit(1)
+	return results
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,173 @@
+"""
+The `directory_scan.py` module lists large source trees with `os.scandir` instead of `glob` and `os.walk`, for network filesystems where listing and stat calls are the bottleneck.
+The folders are scanned in a pool of threads and the results are yielded as they are found, with the stat data of their `DirEntry`, so that a migration can start uploading before the scan finishes.
+Usage:
+	for source in scan_sources(folder, workers=8):
+		print(source.path, source.attachments)
+"""
+import os
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from migration_metrics import metrics
+
+ScanEntry = collections.namedtuple("ScanEntry", ["path", "name", "size", "mtime_ns"])
+SourceItem = collections.namedtuple("SourceItem", ["path", "attachments", "mtime_ns", "size"])
+_DONE = object()
+
+def visible_entries(folder):
+	""" return the DirEntry of the folder without the hidden ones, the same entries as glob(f"{folder}/*") """
+	with os.scandir(folder) as entries:
+		return [entry for entry in entries if not entry.name.startswith(".")]
+
+def entry_stat(entry):
+	""" return the stat of the DirEntry, the stat of the link itself for a broken link """
+	try:
+		return entry.stat()
+	except FileNotFoundError:
+		return entry.stat(follow_symlinks=False)
+
+def folder_stat(path):
+	"""
+		return (latest mtime in ns, total size, files) of a folder and its content, from the stat data of os.scandir
+		- files, the sorted paths of the visible files directly in the folder
+	"""
+	mtime, size, files = os.stat(path).st_mtime_ns, 0, []
+	folders = [path]
+	while len(folders) > 0:
+		current = folders.pop()
+		with os.scandir(current) as entries:
+			for entry in entries:
+				stat = entry_stat(entry)
+				mtime = max(mtime, stat.st_mtime_ns)
+				if entry.is_dir():
+					folders.append(entry.path)
+				else:
+					size += stat.st_size
+					if current == path and not entry.name.startswith("."):
+						files.append(entry.path)
+	return mtime, size, sorted(files)
+
+class ParallelScanner:
+	"""
+		Scan folders in a pool of threads and stream the results
+		- scan(task), called in the pool, return (results, subtasks); the results are yielded and the subtasks are scanned as well
+		- workers, the number of folders scanned at the same time
+		- queue_size, the most results waiting to be consumed, the scan waits when the consumer is slower
+		The results are yielded in the order they are found. A folder that cannot be read is printed and skipped.
+	"""
+
+	def __init__(self, scan, workers=8, queue_size=10000):
+		self.scan = scan
+		self.workers = workers
+		self.queue_size = queue_size
+
+	def run(self, tasks):
+		""" scan the tasks and their subtasks, yield the results as they are found """
+		results = queue.Queue(self.queue_size)
+		stop = threading.Event()
+		lock = threading.Lock()
+		pending = [0]
+		executor = ThreadPoolExecutor(max_workers=self.workers)
+
+		def put(item):
+			# the consumer may stop before the end of the scan
+			while not stop.is_set():
+				try:
+					results.put(item, timeout=0.1)
+					return True
+				except queue.Full:
+					continue
+			return False
+
+		def submit(task):
+			if stop.is_set():
+				return
+			with lock:
+				pending[0] += 1
+			try:
+				executor.submit(run_task, task)
+			except RuntimeError:
+				# the executor is shut down
+				finish()
+
+		def finish():
+			with lock:
+				pending[0] -= 1
+				done = pending[0] == 0
+			if done:
+				put(_DONE)
+
+		def run_task(task):
+			try:
+				try:
+					items, subtasks = self.scan(task)
+				except OSError as error:
+					print(f"Error: cannot scan {task}: {error}")
+					items, subtasks = [], []
+				# the subtasks are submitted before this task is finished, so that pending is 0 only at the end
+				for subtask in subtasks:
+					submit(subtask)
+				for item in items:
+					if not put(item):
+						return
+			finally:
+				finish()
+
+		with lock:
+			pending[0] += 1
+		try:
+			for task in tasks:
+				submit(task)
+			finish()
+			while True:
+				metrics.gauge("queue.scan", results.qsize())
+				item = results.get()
+				if item is _DONE:
+					break
+				yield item
+		finally:
+			stop.set()
+			executor.shutdown(wait=True, cancel_futures=True)
+
+def scan_tree(folder, suffix="", workers=8, queue_size=10000):
+	"""
+		yield the ScanEntry of the files of the folder and its subfolders with the suffix, as they are found
+		- the same files as os.walk: the hidden files and folders are included, the links to folders are not followed
+	"""
+	def scan(path):
+		files, folders = [], []
+		with os.scandir(path) as entries:
+			for entry in entries:
+				if entry.is_dir():
+					if not entry.is_symlink():
+						folders.append(entry.path)
+				elif entry.name.endswith(suffix):
+					stat = entry_stat(entry)
+					files.append(ScanEntry(entry.path, entry.name, stat.st_size, stat.st_mtime_ns))
+		return files, folders
+	yield from ParallelScanner(scan, workers, queue_size).run([folder])
+
+def scan_sources(folder, workers=8, queue_size=1000):
+	"""
+		yield the SourceItem of each file and folder of the folder, the sources of migrate_file_as_entry, as they are found
+		- a file is a source with itself as the only attachment
+		- a folder is a source with the files directly in it as the attachments, the same files as glob(f"{folder}/*"), sorted
+		- the mtime and size are the fingerprint of the source, see migration_journal.source_fingerprint
+		The files are yielded while the folders are scanned in the pool.
+	"""
+	def scan(task):
+		path, is_source = task
+		if is_source:
+			mtime, size, files = folder_stat(path)
+			return [SourceItem(path, files, mtime, size)], []
+		items, folders = [], []
+		for entry in visible_entries(path):
+			if entry.is_dir():
+				folders.append((entry.path, True))
+			else:
+				stat = entry_stat(entry)
+				items.append(SourceItem(entry.path, [entry.path], stat.st_mtime_ns, stat.st_size))
+		return items, folders
+	yield from ParallelScanner(scan, workers, queue_size).run([(folder, False)])
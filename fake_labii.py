@@ -0,0 +1,304 @@
+"""
+The `fake_labii.py` module runs a local fake Labii api server, so that the migration scripts can be exercised and measured without a Labii organization.
+It implements the endpoints used by the scripts: login, the file table, creating/listing/retrieving/modifying records, modifying sections and the file upload of self hosted servers.
+Usage:
+	with FakeLabiiServer(latency=0.05) as server:
+		labii = LabiiObject(organization__sid=server.organization__sid, base_url=server.base_url, email="x", password="x")
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FILE_TABLE_SID = "58ad0a40xfff57bglqvAF"
+COLUMN_SIZE_SID = "fakecolumnsize0a40x"
+COLUMN_PATH_SID = "fakecolumnpath0a40x"
+
+class FakeLabiiHandler(BaseHTTPRequestHandler):
+	""" request handler of FakeLabiiServer """
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, format, *args):#pylint: disable=redefined-builtin
+		""" do not log each request """
+
+	def send_json(self, status, data, headers=None):
+		""" send the json response """
+		body = json.dumps(data).encode("utf-8")
+		self.send_response(status)
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		try:
+			self.end_headers()
+			self.wfile.write(body)
+		except (BrokenPipeError, ConnectionResetError):
+			# the client gave up on the request, for example after its timeout
+			pass
+
+	def read_body(self):
+		""" return the request body """
+		length = int(self.headers.get("Content-Length", 0))
+		return self.rfile.read(length) if length > 0 else b""
+
+	def handle_method(self, method):
+		""" pass the request to the server """
+		body = self.read_body()
+		self.send_json(*self.server.fake.handle(method, self.path, body, self.headers))
+
+	def do_GET(self):#pylint: disable=invalid-name
+		""" GET """
+		self.handle_method("GET")
+
+	def do_POST(self):#pylint: disable=invalid-name
+		""" POST """
+		self.handle_method("POST")
+
+	def do_PATCH(self):#pylint: disable=invalid-name
+		""" PATCH """
+		self.handle_method("PATCH")
+
+	def do_PUT(self):#pylint: disable=invalid-name
+		""" PUT """
+		self.handle_method("PUT")
+
+	def do_DELETE(self):#pylint: disable=invalid-name
+		""" DELETE """
+		self.handle_method("DELETE")
+
+class FakeLabiiServer:
+	"""
+		A fake Labii api server running in a thread
+		- latency, seconds to wait before answering each request
+		- organization__sid, the organization of the urls
+		- bulk, accept a list of records to create (POST) or of sections to modify (PATCH) on the list urls
+		- chunked, accept the file uploads in chunks, PUT with Content-Range, answered with 308 and the Range received until the last chunk
+		- failure_rate, the part of the file uploads answered with 503, half of them after the content is received
+		- capacity, the requests received while this number of requests are handled are answered with 429 and Retry-After: retry_after, None for no limit
+		- stats, number of requests per endpoint, uploaded bytes and the highest number of requests handled at the same time
+	"""
+
+	def __init__(self, latency=0.0, organization__sid="TWZ30a40x24bcV16afkpu", host="127.0.0.1", port=0, bulk=False, chunked=True, failure_rate=0.0, seed=0, capacity=None, retry_after=None):
+		self.latency = latency
+		self.bulk = bulk
+		self.chunked = chunked
+		self.failure_rate = failure_rate
+		self.capacity = capacity
+		self.retry_after = retry_after
+		self.random = random.Random(seed)
+		self.chunks = {} # file record sid -> (bytes received, sha256 of the bytes received)
+		self.organization__sid = organization__sid
+		self.records = {} # sid -> record
+		self.sections = {} # sid -> section data
+		self.uploads = {} # file record sid -> bytes
+		self.stats = {"requests": {}, "uploaded_bytes": 0, "concurrency": 0, "max_concurrency": 0, "failures": 0, "throttled": 0}
+		self.lock = threading.Lock()
+		self.counter = 0
+		self.httpd = ThreadingHTTPServer((host, port), FakeLabiiHandler)
+		self.httpd.daemon_threads = True
+		self.httpd.fake = self
+		self.thread = None
+
+	@property
+	def base_url(self):
+		""" the base url of the server """
+		host, port = self.httpd.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def start(self):
+		""" start serving in a thread """
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		""" stop the server """
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def next_sid(self, prefix):
+		""" return a new sid """
+		with self.lock:
+			self.counter += 1
+			return f"{prefix}{self.counter:016d}", self.counter
+
+	def add_record(self, table_sid, data):
+		""" create a record in the table, return the record """
+		sid, number = self.next_sid("ROW")
+		record = dict(data)
+		record.update({
+			"sid": sid,
+			"uid": f"R{number}",
+			"name": data.get("name", ""),
+			"table": {"sid": table_sid},
+			"projects": data.get("projects", data.get("workspaces", [])),
+			"version": {"sid": f"VER{number:016d}"},
+			"column_set": data.get("column_set", []),
+			"section_set": data.get("section_set", [])
+		})
+		with self.lock:
+			self.records[sid] = record
+		return record
+
+	def count_request(self, name):
+		""" count the request of the endpoint """
+		with self.lock:
+			self.stats["requests"][name] = self.stats["requests"].get(name, 0) + 1
+
+	def handle(self, method, path, body, headers):
+		""" return the (status, data) of a request """
+		with self.lock:
+			if self.capacity is not None and self.stats["concurrency"] >= self.capacity:
+				self.stats["throttled"] += 1
+				return 429, {"detail": "Request was throttled."}, (None if self.retry_after is None else {"Retry-After": str(self.retry_after)})
+			self.stats["concurrency"] += 1
+			self.stats["max_concurrency"] = max(self.stats["max_concurrency"], self.stats["concurrency"])
+		try:
+			if self.latency > 0:
+				time.sleep(self.latency)
+			response = self.route(method, path, body, headers)
+			return response if len(response) == 3 else (response[0], response[1], None)
+		finally:
+			with self.lock:
+				self.stats["concurrency"] -= 1
+
+	def route(self, method, path, body, headers):
+		""" find the endpoint of the request """
+		url = urllib.parse.urlsplit(path)
+		query = dict(urllib.parse.parse_qsl(url.query))
+		if url.path == "/accounts/auth/":
+			self.count_request("login")
+			return 200, {"token": "fake-token", "email": "fake@labii.com"}
+		if url.path == "/accounts/checktoken/":
+			return 200, {"detail": "Valid token."}
+		if re.match(r"^/tables/table/list/", url.path):
+			self.count_request("table_list")
+			return 200, {"count": 1, "results": [{
+				"sid": FILE_TABLE_SID,
+				"name_system": "file",
+				"columns": [
+					{"sid": COLUMN_SIZE_SID, "widget": {"sid": "KNQT0a40x5fMRW27bgl"}},
+					{"sid": COLUMN_PATH_SID, "widget": {"sid": "JMPS0a40x5eLQV16afk"}}
+				]
+			}]}
+		match = re.match(r"^/tables/row/upload/(\w+)/$", url.path)
+		if match and method == "POST":
+			self.count_request("upload")
+			failure = self.inject_failure()
+			if failure == "before":
+				return 503, {"detail": "Service unavailable."}
+			with self.lock:
+				self.uploads[match.group(1)] = len(body)
+				self.stats["uploaded_bytes"] += len(body)
+			if failure == "after":
+				return 503, {"detail": "Service unavailable."}
+			return 200, {}
+		if match and method == "PUT":
+			if not self.chunked:
+				return 405, {"detail": "Method not allowed."}
+			return self.upload_chunk(match.group(1), body, headers)
+		if re.match(r"^/tables/row/list/", url.path):
+			data = json.loads(body or b"{}") if method in ("POST", "PATCH") else None
+			if isinstance(data, list):
+				if not self.bulk or method != "POST":
+					return 400, {"detail": "Expected a dictionary of items."}
+				self.count_request("record_bulk_create")
+				return 201, [self.add_record(query.get("table__sid", ""), item) if isinstance(item, dict) and "name" in item else {"detail": "The name is required."} for item in data]
+			if method == "POST":
+				self.count_request("record_create")
+				record = self.add_record(query.get("table__sid", ""), data)
+				if query.get("presigned_post") == "true":
+					record = dict(record)
+					record["presigned_post"] = {
+						"url": f"{self.base_url}/tables/row/upload/{record['sid']}/",
+						"fields": {"key": f"files/{record['sid']}/{record['name']}"}
+					}
+				return 201, record
+			self.count_request("record_list")
+			return 200, self.list_records(query)
+		match = re.match(r"^/tables/row/detail/(\w+)/$", url.path)
+		if match:
+			record = self.records.get(match.group(1))
+			if record is None:
+				return 404, {"detail": "Not found."}
+			if method == "PATCH":
+				self.count_request("record_modify")
+				with self.lock:
+					record.update(json.loads(body or b"{}"))
+			else:
+				self.count_request("record_retrieve")
+			return 200, record
+		if re.match(r"^/tables/section/list/", url.path) and method == "PATCH":
+			data = json.loads(body or b"{}")
+			if not self.bulk or not isinstance(data, list):
+				return 400, {"detail": "Expected a dictionary of items."}
+			self.count_request("section_bulk_modify")
+			responses = []
+			for item in data:
+				if not isinstance(item, dict) or not item.get("sid"):
+					responses.append({"detail": "Not found."})
+					continue
+				with self.lock:
+					self.sections[item["sid"]] = {key: value for key, value in item.items() if key != "sid"}
+				responses.append({"sid": item["sid"]})
+			return 200, responses
+		match = re.match(r"^/tables/section/detail/(\w+)/$", url.path)
+		if match and method == "PATCH":
+			self.count_request("section_modify")
+			with self.lock:
+				self.sections[match.group(1)] = json.loads(body or b"{}")
+			return 200, {"sid": match.group(1)}
+		return 404, {"detail": f"Not found: {method} {url.path}"}
+
+	def inject_failure(self):
+		""" return None, or "before" or "after" the content is received for a failed upload request """
+		with self.lock:
+			value = self.random.random()
+			if value >= self.failure_rate:
+				return None
+			self.stats["failures"] += 1
+			return "before" if value < self.failure_rate / 2 else "after"
+
+	def upload_chunk(self, sid, body, headers):
+		""" receive a chunk of a file, Content-Range: bytes start-end/total, or bytes */total to ask the bytes received """
+		self.count_request("upload_chunk")
+		match = re.match(r"^bytes (?:(\d+)-(\d+)|\*)/(\d+)$", headers.get("Content-Range", ""))
+		if match is None:
+			return 400, {"detail": "Content-Range is required."}
+		total = int(match.group(3))
+		failure = self.inject_failure() if match.group(1) is not None else None
+		if failure == "before":
+			return 503, {"detail": "Service unavailable."}
+		with self.lock:
+			received, sha256 = self.chunks.get(sid, (0, hashlib.sha256()))
+			if match.group(1) is not None and int(match.group(1)) == received and len(body) == int(match.group(2)) - received + 1:
+				sha256.update(body)
+				received += len(body)
+				self.stats["uploaded_bytes"] += len(body)
+			self.chunks[sid] = (received, sha256)
+			if received == total:
+				self.uploads[sid] = total
+		if failure == "after":
+			return 503, {"detail": "Service unavailable."}
+		if received == total:
+			return 200, {"sid": sid, "size": total, "sha256": sha256.hexdigest()}
+		return 308, {}, ({"Range": f"bytes=0-{received - 1}"} if received > 0 else {})
+
+	def list_records(self, query):
+		""" return a page of records of the table """
+		page = int(query.get("page", 1))
+		page_size = int(query.get("page_size", 10))
+		with self.lock:
+			records = [record for record in self.records.values() if query.get("table__sid") in [None, record["table"]["sid"]]]
+		start = (page - 1) * page_size
+		return {"count": len(records), "results": records[start:start + page_size]}
@@ -0,0 +1,87 @@
+"""
+The `file_index.py` module builds an index of the file names of a folder once, so that files can be found by a part of their name without listing the folder for each lookup.
+`FileNameIndex(folder, ".gb").find(key)` returns the same files as `glob.glob(f"{folder}/*{key}*.gb")`, with the key matched literally.
+"""
+import os
+import re
+from directory_scan import scan_tree
+
+def trigrams(text):
+	""" return the set of 3 character substrings of the text """
+	return {text[index:index + 3] for index in range(len(text) - 2)}
+
+class FileNameIndex:
+	"""
+		Trigram index of the file names with the extension
+		- folder, the folder to index
+		- extension, only the files with the extension are indexed, the key is matched against the name without the extension
+		- recursive, index the files of the subfolders as well, the subfolders are listed in a pool of workers threads
+	"""
+
+	def __init__(self, folder, extension="", recursive=False, workers=8):
+		self.folder = folder
+		self.extension = extension
+		self.paths = []
+		self.stems = []
+		self.trigrams = {} # trigram -> [index of the stem]
+		if recursive:
+			for entry in scan_tree(folder, extension, workers=workers):
+				# the files of the hidden folders are indexed, not the hidden files, the same as glob on the folder of the copied files
+				if not entry.name.startswith("."):
+					self.add(entry.path, entry.name[:len(entry.name) - len(extension)])
+		else:
+			self.scan(folder)
+
+	def scan(self, folder):
+		""" add the files of the folder """
+		with os.scandir(folder) as entries:
+			for entry in entries:
+				if entry.name.startswith(".") or entry.is_dir():
+					continue
+				if entry.name.endswith(self.extension):
+					self.add(entry.path, entry.name[:len(entry.name) - len(self.extension)])
+
+	def add(self, path, stem):
+		""" add a file to the index """
+		index = len(self.stems)
+		self.paths.append(path)
+		self.stems.append(stem)
+		for trigram in trigrams(stem):
+			self.trigrams.setdefault(trigram, []).append(index)
+
+	def __len__(self):
+		return len(self.paths)
+
+	def find(self, key):
+		""" return the sorted paths of the files with the key in their name """
+		if len(key) < 3:
+			candidates = range(len(self.stems))
+		else:
+			postings = []
+			for trigram in trigrams(key):
+				if not trigram in self.trigrams:
+					return []
+				postings.append(self.trigrams[trigram])
+			# start from the rarest trigram, checking a few names is faster than intersecting long postings
+			postings.sort(key=len)
+			candidates = postings[0]
+			for posting in postings[1:]:
+				if len(candidates) <= 64:
+					break
+				candidates = set(candidates).intersection(posting)
+		return sorted(self.paths[index] for index in candidates if key in self.stems[index])
+
+	def resolve(self, key):
+		"""
+			return (path, matches) for the key
+			- path is the only match, or the only match where the key is a whole word of the name, None if not found or ambiguous
+			- matches are all the files with the key in their name
+		"""
+		matches = self.find(key)
+		if len(matches) == 1:
+			return matches[0], matches
+		pattern = re.compile(rf"(?<![A-Za-z0-9]){re.escape(key)}(?![A-Za-z0-9])")
+		whole_matches = [path for path in matches if pattern.search(os.path.basename(path)[:-len(self.extension) or None])]
+		if len(whole_matches) == 1:
+			return whole_matches[0], matches
+		return None, matches
@@ -0,0 +1,244 @@
+"""
+The `html_stream.py` module applies the rules of a `TransformEngine` to a large html document without building a soup of the whole document.
+The document is read in chunks with the SAX style `html.parser.HTMLParser`. Only the elements matching a rule are parsed into a small soup, one at a time, and transformed by the engine; the other tags are written as they are read.
+"""
+import html
+from html.parser import HTMLParser
+from html_transform import class_matches
+
+# the tags without end tag, same as bs4.builder.HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS
+VOID_TAGS = {
+	"area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr", "image", "img", "input", "isindex",
+	"keygen", "link", "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr"
+}
+RAW_TEXT_TAGS = {"script", "style"}
+
+def start_tag_html(text):
+	""" return the start tag as written by BeautifulSoup, for example <div class="a b"> for <div class='a  b'> """
+	from bs4 import BeautifulSoup#pylint: disable=import-outside-toplevel
+	soup = BeautifulSoup(text, 'html.parser')
+	tag = soup.contents[0]
+	if tag.name in VOID_TAGS:
+		return str(tag)
+	return str(tag)[:-len(f"</{tag.name}>")]
+
+class _AttributeView:
+	""" the attributes of a start tag, with the class split as in a soup, to be checked by class_matches """
+
+	def __init__(self, attrs):
+		self.attrs = {name: "" if value is None else value for name, value in attrs}
+		if "class" in self.attrs:
+			self.attrs["class"] = self.attrs["class"].split()
+
+	def get(self, name, default=None):
+		""" return the value of the attribute """
+		return self.attrs.get(name, default)
+
+class StreamTransform(HTMLParser):
+	"""
+		Streaming transform of the root element of a document with the rules of a TransformEngine
+		- engine, the TransformEngine, its finalizers are not called
+		- context, the context of the rules, context["soup"] is the soup of the current element
+		- serialize(soup, context), return the output part of a transformed element, str(soup) by default
+		- root, only the root element and its content are written, "None" if the document has no root
+		- skip_rules, the elements whose first matching rule is one of these rules are dropped without being parsed
+		- split_tags, an element containing one of these tags is not parsed as a whole, its children are handled one at a time instead and its own rules are not applied
+		- whole_tags, the elements always parsed as a whole, even if they contain a split tag
+		context["stream"] is set to the StreamTransform, for example to call open_element in serialize.
+		The output is the same as the soup transform for well formed documents.
+	"""
+
+	def __init__(self, engine, context, serialize=None, root="body", skip_rules=(), split_tags=("table",), whole_tags=("tr",)):
+		super().__init__(convert_charrefs=True)
+		self.engine = engine
+		self.context = context
+		self.serialize = serialize if serialize is not None else lambda soup, context: str(soup)
+		self.root = root
+		self.skip_rules = skip_rules
+		self.split_tags = set(split_tags)
+		self.whole_tags = set(whole_tags)
+		self.parts = []
+		self.stack = [] # the open tags written as they are read
+		self.stack_ids = [] # the number of each open tag, in the order they are opened
+		self.opened = 0
+		self.unit = None # the tokens of the element being buffered
+		self.unit_stack = []
+		self.skip_stack = []
+		self.root_seen = False
+		self.root_closed = False
+		self.context["stream"] = self
+
+	def open_element(self, tag):
+		""" return the number of the innermost open tag with the name written as read, None if there is none """
+		for name, number in zip(reversed(self.stack), reversed(self.stack_ids)):
+			if name == tag:
+				return number
+		return None
+
+	def push(self, tag):
+		""" add a tag written as read to the open tags """
+		self.opened += 1
+		self.stack.append(tag)
+		self.stack_ids.append(self.opened)
+
+	def pop(self):
+		""" remove the innermost open tag, return its name """
+		self.stack_ids.pop()
+		return self.stack.pop()
+
+	def transform(self, file, chunk_size=1024 * 1024):
+		""" transform the content of an open text file, return the list of output parts """
+		for chunk in iter(lambda: file.read(chunk_size), ""):
+			self.feed(chunk)
+		self.close()
+		return self.parts
+
+	# HTMLParser callbacks, converted to tokens
+	def handle_starttag(self, tag, attrs):
+		self.process(("start", tag, attrs, self.get_starttag_text()))
+
+	def handle_startendtag(self, tag, attrs):
+		self.process(("startend", tag, attrs, self.get_starttag_text()))
+
+	def handle_endtag(self, tag):
+		self.process(("end", tag, None, f"</{tag}>"))
+
+	def handle_data(self, data):
+		stack = self.unit_stack if self.unit is not None else self.stack
+		raw = len(stack) > 0 and stack[-1] in RAW_TEXT_TAGS
+		self.process(("data", None, None, data if raw else html.escape(data, quote=False)))
+
+	def handle_comment(self, data):
+		self.process(("data", None, None, f"<!--{data}-->"))
+
+	def handle_decl(self, decl):
+		self.process(("data", None, None, f"<!{decl}>"))
+
+	def handle_pi(self, data):
+		self.process(("data", None, None, f"<?{data}>"))
+
+	def close(self):
+		super().close()
+		if self.unit is not None:
+			self.end_unit()
+		if self.root_seen and not self.root_closed:
+			while len(self.stack) > 0:
+				self.parts.append(f"</{self.pop()}>")
+		if not self.root_seen:
+			self.parts.append("None")
+
+	# tokens
+	def process(self, token):
+		""" handle a token of the document """
+		kind, tag, attrs, text = token
+		if self.root_closed:
+			return
+		if not self.root_seen:
+			if kind in ("start", "startend") and tag == self.root:
+				self.root_seen = True
+				self.parts.append(start_tag_html(text))
+				if kind == "startend":
+					self.parts.append(f"</{tag}>")
+					self.root_closed = True
+				else:
+					self.push(tag)
+			return
+		if len(self.skip_stack) > 0:
+			self.process_skipped(token)
+		elif self.unit is not None:
+			self.process_unit(token)
+		else:
+			self.process_passthrough(token)
+
+	def matching_rules(self, tag, attrs):
+		""" return the rules of the engine matching the start tag """
+		view = _AttributeView(attrs)
+		return [rule for class_, rule, _ in self.engine.rules.get(tag, []) if class_matches(view, class_)]
+
+	def process_passthrough(self, token):
+		""" handle a token outside of the buffered elements """
+		kind, tag, attrs, text = token
+		if kind in ("start", "startend"):
+			rules = self.matching_rules(tag, attrs)
+			if len(rules) > 0 and rules[0] in self.skip_rules:
+				if kind == "start" and not tag in VOID_TAGS:
+					self.skip_stack.append(tag)
+			elif len(rules) > 0:
+				self.unit = [token]
+				self.unit_stack = [] if kind == "startend" or tag in VOID_TAGS else [tag]
+				if len(self.unit_stack) == 0:
+					self.end_unit()
+			else:
+				self.parts.append(start_tag_html(text))
+				if kind == "startend" and not tag in VOID_TAGS:
+					self.parts.append(f"</{tag}>")
+				elif kind == "start" and not tag in VOID_TAGS:
+					self.push(tag)
+		elif kind == "end":
+			if tag in self.stack:
+				while True:
+					name = self.pop()
+					self.parts.append(f"</{name}>")
+					if name == tag:
+						break
+				if len(self.stack) == 0:
+					self.root_closed = True
+		else:
+			self.parts.append(text)
+
+	def process_skipped(self, token):
+		""" handle a token of a dropped element """
+		kind, tag, _, _ = token
+		if kind == "start" and not tag in VOID_TAGS:
+			self.skip_stack.append(tag)
+		elif kind == "end" and tag in self.skip_stack:
+			while self.skip_stack.pop() != tag:
+				pass
+		elif kind == "end" and tag in self.stack:
+			# the end of an enclosing tag closes the dropped element
+			self.skip_stack = []
+			self.process(token)
+
+	def process_unit(self, token):
+		""" handle a token of a buffered element """
+		kind, tag, _, _ = token
+		if kind in ("start", "startend") and tag in self.split_tags and not self.unit[0][1] in self.whole_tags:
+			self.split_unit()
+			self.process(token)
+			return
+		if kind == "start" and not tag in VOID_TAGS:
+			self.unit.append(token)
+			self.unit_stack.append(tag)
+		elif kind == "end" and tag in self.unit_stack:
+			self.unit.append(token)
+			while self.unit_stack.pop() != tag:
+				pass
+			if len(self.unit_stack) == 0:
+				self.end_unit()
+		elif kind == "end" and tag in self.stack:
+			# the end of an enclosing tag closes the element
+			self.end_unit()
+			self.process(token)
+		elif kind != "end":
+			self.unit.append(token)
+
+	def end_unit(self):
+		""" parse and transform the buffered element """
+		from bs4 import BeautifulSoup#pylint: disable=import-outside-toplevel
+		soup = BeautifulSoup("".join(token[3] for token in self.unit), 'html.parser')
+		self.unit = None
+		self.unit_stack = []
+		self.engine.run(soup, self.context, finalize=False)
+		self.parts.append(self.serialize(soup, self.context))
+
+	def split_unit(self):
+		""" write the start tag of the buffered element and handle its content again, one child at a time """
+		tokens = self.unit
+		self.unit = None
+		self.unit_stack = []
+		kind, tag, _, text = tokens[0]
+		self.parts.append(start_tag_html(text))
+		if kind == "start":
+			self.push(tag)
+		for token in tokens[1:]:
+			self.process(token)
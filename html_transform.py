@@ -0,0 +1,130 @@
+"""
+The `html_transform.py` module provides a small rule engine to transform a parsed html document in a single pass. Rules are registered for a tag name and, optionally, a class; the engine walks the tree once and hands every tag to the rules registered for it, instead of calling `find_all` over the whole document once per transform.
+"""
+import time
+from migration_metrics import metrics
+
+def class_matches(tag, class_):
+	""" return True if the tag matches class_, using the same rule as find_all(class_=...) """
+	if class_ is None:
+		return True
+	values = tag.get("class")
+	if values is None:
+		return False
+	if isinstance(values, str):
+		return values == class_ or class_ in values.split()
+	return class_ in values or " ".join(values) == class_
+
+def find_descendant(tag, name, class_=None):
+	""" return the first descendant with the tag name and class, same as tag.find(name, class_=class_) without building a filter for each call """
+	for descendant in tag.descendants:
+		if descendant.name == name and class_matches(descendant, class_):
+			return descendant
+	return None
+
+class TransformEngine:
+	"""
+		Single pass html transform engine
+		- register(tag, class_, descendants_first), decorator to add a rule for a tag name and class
+		- register_finalizer(), decorator to add a function called once after the walk
+		- run(soup, context, finalize), visit the tree once and apply the rules, context["soup"] is set to the soup
+		When the metrics are enabled, or context["rule_seconds"] is a dict, the seconds spent in each rule and finalizer are added to context["rule_seconds"].
+
+		A rule is called as rule(tag, context). It may leave the tag in place, change its content, replace it or extract it.
+		The walk continues from whatever takes the place of the tag, so the replacement content is visited as well, the same as it would be seen by a later find_all.
+		A rule that reads the content of its tag is registered with descendants_first: the rules registered before it are applied to the descendants of the tag first, so that it reads the same content as when each rule is applied to the whole document in the order of registration.
+	"""
+
+	def __init__(self):
+		self.rules = {} # tag name -> [(class_, rule, order)]
+		self.descendants_first = set() # order of the rules registered with descendants_first
+		self.count = 0
+		self.finalizers = []
+
+	def register(self, tag, class_=None, descendants_first=False):
+		""" decorator to register a rule for the tag name and class """
+		def decorator(rule):
+			self.add_rule(tag, rule, class_, descendants_first)
+			return rule
+		return decorator
+
+	def add_rule(self, tag, rule, class_=None, descendants_first=False):
+		""" register a rule for the tag name and class, the rules of the same tag are applied in the order of registration """
+		self.rules.setdefault(tag, []).append((class_, rule, self.count))
+		if descendants_first:
+			self.descendants_first.add(self.count)
+		self.count += 1
+
+	def register_finalizer(self, finalizer):
+		""" register a function called as finalizer(soup, context) after the walk """
+		self.finalizers.append(finalizer)
+		return finalizer
+
+	def apply(self, tag, context, rule_seconds=None, limit=None):
+		"""
+			apply the rules of one tag, stop once the tag is removed from the tree, add the seconds of each rule to rule_seconds if provided
+			- limit, only apply the rules registered before this order
+		"""
+		for class_, rule, order in self.rules.get(tag.name, []):
+			if tag.parent is None or (limit is not None and order >= limit):
+				break
+			if class_matches(tag, class_):
+				if order in self.descendants_first:
+					self.walk(tag, context, rule_seconds, order)
+				if rule_seconds is None:
+					rule(tag, context)
+				else:
+					start = time.perf_counter()
+					rule(tag, context)
+					rule_seconds[rule.__name__] = rule_seconds.get(rule.__name__, 0.0) + time.perf_counter() - start
+
+	def walk(self, root, context, rule_seconds=None, limit=None):
+		""" visit each descendant tag of the root once and apply the rules registered before limit, all rules if None """
+		node = root.contents[0] if len(root.contents) > 0 else None
+		while node is not None:
+			descend = False
+			# only the tags have a name, the strings have None
+			if node.name is not None:
+				parent = node.parent
+				previous_sibling = node.previous_sibling
+				next_sibling = node.next_sibling
+				self.apply(node, context, rule_seconds, limit)
+				if node.parent is None:
+					# the tag is replaced or extracted, continue from what takes its place
+					if previous_sibling is not None and previous_sibling.parent is parent:
+						replacement = previous_sibling.next_sibling
+					else:
+						replacement = parent.contents[0] if len(parent.contents) > 0 else None
+					if replacement is not None and replacement is not next_sibling:
+						node = replacement
+						continue
+					node = next_sibling
+					if node is not None:
+						continue
+					node = parent
+				else:
+					descend = True
+			# move to the next node
+			if descend and len(node.contents) > 0:
+				node = node.contents[0]
+				continue
+			while node is not None and node is not root and node.next_sibling is None:
+				node = node.parent
+			node = None if node is None or node is root else node.next_sibling
+
+	def run(self, soup, context=None, finalize=True):
+		""" visit each tag of the soup once and apply the registered rules, then call the finalizers if finalize """
+		if context is None:
+			context = {}
+		context["soup"] = soup
+		if metrics.enabled:
+			context.setdefault("rule_seconds", {})
+		rule_seconds = context.get("rule_seconds")
+		self.walk(soup, context, rule_seconds)
+		if finalize:
+			for finalizer in self.finalizers:
+				start = time.perf_counter()
+				finalizer(soup, context)
+				if rule_seconds is not None:
+					rule_seconds[finalizer.__name__] = rule_seconds.get(finalizer.__name__, 0.0) + time.perf_counter() - start
+		return soup
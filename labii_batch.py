@@ -0,0 +1,219 @@
+"""
+The `labii_batch.py` module groups the record creates and the section modifies of a migration into batches, so that the items are not sent one round trip at a time.
+A batch is sent to the bulk endpoint of the resource (the list url, with a list of items as the body) when the server supports it, and as single requests sent concurrently when it does not.
+Whether the server supports it is found out with the first batch; once the bulk endpoint worked, a failed bulk request is not sent again as single requests, as some of its items may be created already.
+Usage:
+	with BatchWriter(labii.Record, "create", query=f"table__sid={table_sid}") as writer:
+		writer.add(file_path, data, callback=lambda source, response: print(source, response))
+	print(writer.errors) # [(source, response)] of the items that failed
+"""
+import json
+import time
+import contextlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from migration_metrics import metrics
+
+# the answers of a server without a bulk endpoint: the list url does not exist, does not accept the method, or rejects a list as the body before creating anything
+BULK_UNSUPPORTED_STATUS_CODES = {400, 404, 405}
+
+def is_success(response):
+	""" return True if the response is an object of the api """
+	return isinstance(response, dict) and "sid" in response
+
+def send_json(api, method, url, data):
+	""" send the data to the url of the api, through its AdaptiveClient if it has one, return (status code, json of the response or its text) """
+	full_url = f"{api.base_url}{url}"
+	body = json.dumps(data, separators=(',',':'))
+	headers = api.get_headers(True)
+	if hasattr(api, "client"):
+		response = api.client.request(method, full_url, data=body, headers=headers)
+	else:
+		response = requests.request(method, full_url, data=body, headers=headers, timeout=300)
+	try:
+		return response.status_code, json.loads(response.text)
+	except ValueError:
+		return response.status_code, response.text
+
+class BatchWriter:
+	"""
+		Collect the creates or modifies of a Labii resource and send them in batches
+		- resource, a LabiiObject resource, for example labii.Record or labii.Section
+		- method, "create" or "modify"
+		- query, the query of the requests, for example table__sid=xxx for the creates
+		- batch_size, a batch is sent once it has this number of items
+		- max_delay, seconds, a batch is sent once its first item waited this long
+		- workers, the number of batches sent at the same time, and of concurrent single requests when the server has no bulk endpoint
+		- bulk, None to find out with the first batch if the server has a bulk endpoint, True or False to decide
+		Each item is added with its source, for example the file it comes from, and callback(source, response) is called once the response is known.
+		A full batch is sent by a thread of the writer, add does not wait for the response.
+		The items that failed are kept in errors as (source, response). Safe to share between threads.
+	"""
+
+	def __init__(self, resource, method="create", query="", batch_size=50, max_delay=2.0, workers=8, bulk=None):
+		if not method in ("create", "modify"):
+			raise ValueError(f"Error: unknown method {method}!")
+		self.resource = resource
+		self.method = method
+		self.query = query
+		self.batch_size = batch_size
+		self.max_delay = max_delay
+		self.bulk = bulk
+		self.errors = []
+		self.stats = {"items": 0, "batches": 0, "bulk_requests": 0, "single_requests": 0}
+		self.items = [] # (source, sid, data, callback, future)
+		self.first_added = None
+		self.lock = threading.Lock()
+		self.send_lock = threading.Lock()
+		self.condition = threading.Condition(self.lock)
+		self.executor = ThreadPoolExecutor(max_workers=workers) # the batches
+		self.single_executor = ThreadPoolExecutor(max_workers=workers) # the single requests of a batch
+		self.closed = False
+		self.timer = threading.Thread(target=self.flush_on_time, daemon=True)
+		self.timer.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def add(self, source, data, sid=None, callback=None):
+		"""
+			add a create, or a modify of the object sid, return the Future of the response
+			- the batch is handed to a thread of the writer if it is full
+		"""
+		if self.method == "modify" and sid is None:
+			raise ValueError("Error: the sid of the object to modify is required!")
+		future = Future()
+		with self.lock:
+			if self.closed:
+				raise RuntimeError("Error: the batch writer is closed!")
+			self.items.append((source, sid, data, callback, future))
+			if self.first_added is None:
+				self.first_added = time.monotonic()
+				self.condition.notify()
+			metrics.gauge(f"queue.batch_{self.method}", len(self.items))
+			batch = None
+			if len(self.items) >= self.batch_size:
+				batch = self.items
+				self.items = []
+				self.first_added = None
+		if batch is not None:
+			self.executor.submit(self.send, batch)
+		return future
+
+	def flush(self):
+		""" send the items collected so far """
+		with self.lock:
+			items = self.items
+			self.items = []
+			self.first_added = None
+		if len(items) > 0:
+			self.send(items)
+
+	def flush_on_time(self):
+		""" send the batch once its first item waited max_delay, run in a thread """
+		with self.lock:
+			while not self.closed:
+				if self.first_added is None:
+					self.condition.wait()
+					continue
+				remaining = self.first_added + self.max_delay - time.monotonic()
+				if remaining > 0:
+					self.condition.wait(remaining)
+					continue
+				self.lock.release()
+				try:
+					self.flush()
+				finally:
+					self.lock.acquire()
+
+	def close(self):
+		""" send the remaining items and wait for all the responses """
+		with self.lock:
+			self.closed = True
+			self.condition.notify()
+		self.timer.join()
+		self.flush()
+		self.executor.shutdown(wait=True)
+		self.single_executor.shutdown(wait=True)
+
+	def send(self, items):
+		""" send a batch, with the bulk endpoint if the server supports it """
+		with metrics.timer(f"batch.{self.method}"):
+			self.send_batch(items)
+
+	def send_batch(self, items):
+		""" send a batch and call the callbacks of its items """
+		with self.lock:
+			self.stats["items"] += len(items)
+			self.stats["batches"] += 1
+		try:
+			responses = None
+			# one bulk request at a time until it is known if the server supports it
+			with self.send_lock if self.bulk is None else contextlib.nullcontext():
+				if self.bulk is not False:
+					responses = self.send_bulk(items)
+					if responses is None:
+						self.bulk = False
+						print(f"Bulk {self.method}: not supported, sending single requests")
+			if responses is None:
+				responses = self.send_single(items)
+		except Exception as error:#pylint: disable=broad-exception-caught
+			# for example a connection error, all the items of the batch failed
+			responses = [f"Error: {error}"] * len(items)
+		for (source, _, _, callback, future), response in zip(items, responses):
+			if not is_success(response):
+				with self.lock:
+					self.errors.append((source, response))
+			if callback is not None:
+				try:
+					callback(source, response)
+				except Exception as error:#pylint: disable=broad-exception-caught
+					future.set_exception(error)
+					continue
+			future.set_result(response)
+
+	def send_bulk(self, items):
+		"""
+			send the items in one request, return the responses in the order of the items
+			- None if the server has no bulk endpoint, only while it is not known, see BULK_UNSUPPORTED_STATUS_CODES
+			- an error for each item if the request failed otherwise, the items are not sent again as some of them may be created
+		"""
+		api = self.resource.instance.api
+		url = api.get_list_url(self.resource.app, self.resource.model, serializer="detail", query=self.query)
+		with self.lock:
+			self.stats["bulk_requests"] += 1
+		if self.method == "create":
+			status, responses = send_json(api, "POST", url, [data for _, _, data, _, _ in items])
+		else:
+			status, responses = send_json(api, "PATCH", url, [dict(data, sid=sid) for _, sid, data, _, _ in items])
+		if status in (200, 201) and isinstance(responses, list) and len(responses) == len(items):
+			if self.bulk is None:
+				self.bulk = True
+				print(f"Bulk {self.method}: supported")
+			return responses
+		if self.bulk is None and status in BULK_UNSUPPORTED_STATUS_CODES:
+			return None
+		print(f"Error: bulk {self.method} of {len(items)} items failed: {status} - {responses}")
+		return [f"Error: bulk {self.method} failed ({status})"] * len(items)
+
+	def send_single(self, items):
+		""" send one request per item, concurrently, return the responses in the order of the items """
+		def send_item(item):
+			_, sid, data, _, _ = item
+			try:
+				if self.method == "create":
+					return self.resource.create(data, query=self.query)
+				return self.resource.modify(sid, data, query=self.query)
+			except Exception as error:#pylint: disable=broad-exception-caught
+				return f"Error: {error}"
+		with self.lock:
+			self.stats["single_requests"] += len(items)
+		return list(self.single_executor.map(send_item, items))
+
+	def report(self):
+		""" return the summary of the batches """
+		return f"Batch {self.method}: {self.stats['items']} items in {self.stats['batches']} batches, {self.stats['bulk_requests']} bulk and {self.stats['single_requests']} single requests, {len(self.errors)} failed"
@@ -0,0 +1,287 @@
+"""
+The `labii_client.py` module sends the api requests of a migration through a shared client that adapts to the Labii server, so that a throttled or overloaded server slows the migration down instead of failing it.
+- a token bucket caps the rate of the requests
+- an AIMD limit caps the concurrent requests: it grows by one after each window of fast successful requests, and is halved when the server throttles (429), fails (5xx) or slows down
+- the throttled and failed requests are sent again after a jittered exponential backoff, or after the Retry-After of the server; a POST only when it did not reach the server, so that a record is not created twice
+Usage:
+	client = AdaptiveClient(rate=20, max_concurrency=16)
+	labii = LabiiObject(organization__sid=organization__sid, base_url=base_url, api=AdaptiveAPIObject(client, base_url=base_url, organization__sid=organization__sid))
+	print(client.report())
+"""
+import json
+import time
+import random
+import threading
+import contextlib
+import requests
+from labii_sdk.api_client import APIObject
+from migration_metrics import metrics
+
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+THROTTLE_STATUS_CODES = {429, 503}
+# the methods that may have done their work on the server before it failed, sending them again could create twice
+NON_IDEMPOTENT_METHODS = {"POST"}
+
+def is_retryable(method, response):
+	"""
+		return True if the failed request can be sent again
+		- a POST only if the server did not process it: a connection that was not made, a 429, or a 503 with a Retry-After
+		- the other methods after a connection error, a timeout or one of RETRY_STATUS_CODES
+	"""
+	if method.upper() in NON_IDEMPOTENT_METHODS:
+		if isinstance(response, Exception):
+			return isinstance(response, (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout))
+		return response.status_code == 429 or (response.status_code == 503 and retry_after_seconds(response) is not None)
+	return isinstance(response, Exception) or response.status_code in RETRY_STATUS_CODES
+
+def backoff_delay(attempt, backoff=0.5, max_backoff=30.0, retry_after=None, rng=random):
+	"""
+		return the seconds to wait before sending a request again, "full jitter": a random delay up to backoff * 2 ** attempt, capped at max_backoff
+		- retry_after, the Retry-After of the server in seconds, the delay is at least retry_after
+	"""
+	delay = rng.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+	if retry_after is not None:
+		delay = max(delay, retry_after)
+	return delay
+
+def retry_after_seconds(response):
+	""" return the Retry-After of the response in seconds, None if not provided or an http date """
+	try:
+		return max(0.0, float(response.headers.get("Retry-After", "")))
+	except (ValueError, AttributeError):
+		return None
+
+class TokenBucket:
+	"""
+		Cap the rate of the requests
+		- rate, tokens added per second, None for no cap
+		- burst, the most tokens kept, the number of requests that can be sent at once after a pause
+	"""
+
+	def __init__(self, rate=None, burst=None):
+		self.rate = rate if rate else None
+		self.burst = burst if burst is not None else max(1.0, self.rate or 1.0)
+		self.tokens = self.burst
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		""" wait for a token, return the seconds waited """
+		if self.rate is None:
+			return 0.0
+		waited = 0.0
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return waited
+				delay = (1 - self.tokens) / self.rate
+			time.sleep(delay)
+			waited += delay
+
+class AIMDLimiter:
+	"""
+		Adaptive limit of the concurrent requests, additive increase and multiplicative decrease
+		- initial, minimum and maximum, the limit of the concurrent requests
+		- latency_target, seconds, a successful request slower than this counts as a sign of overload, None to use latency_factor x the fastest request seen
+		- error_threshold, the limit is decreased when the recent error rate (5xx and connection errors) is above it; a throttled request (429) always decreases it
+		The limit grows by 1 / limit for each fast success, so by one for each window of limit requests, and is multiplied by decrease when the server is overloaded.
+		Only one decrease is made per window: the requests started before the last decrease do not decrease it again.
+	"""
+
+	def __init__(self, initial=4, minimum=1, maximum=32, latency_target=None, latency_factor=3.0, error_threshold=0.1, decrease=0.5):
+		self.limit = float(initial)
+		self.minimum = minimum
+		self.maximum = maximum
+		self.latency_target = latency_target
+		self.latency_factor = latency_factor
+		self.error_threshold = error_threshold
+		self.decrease = decrease
+		self.fastest = None
+		self.error_rate = 0.0
+		self.in_flight = 0
+		self.last_decrease = 0.0
+		self.condition = threading.Condition()
+
+	@contextlib.contextmanager
+	def slot(self):
+		""" wait for the number of concurrent requests to be below the limit, yield the start time of the request """
+		with self.condition:
+			while self.in_flight >= int(self.limit):
+				self.condition.wait()
+			self.in_flight += 1
+			metrics.gauge("api.in_flight", self.in_flight)
+		try:
+			yield time.monotonic()
+		finally:
+			with self.condition:
+				self.in_flight -= 1
+				self.condition.notify()
+
+	def target(self):
+		""" return the latency above which a request is slow, None until a request succeeded """
+		if self.latency_target is not None:
+			return self.latency_target
+		if self.fastest is None:
+			return None
+		return max(self.latency_factor * self.fastest, 0.05)
+
+	def record(self, started, latency, outcome):
+		""" update the limit with the outcome of a request, "success", "throttled" or "error" """
+		with self.condition:
+			error = outcome != "success"
+			self.error_rate = 0.9 * self.error_rate + (0.1 if error else 0.0)
+			if outcome == "success":
+				self.fastest = latency if self.fastest is None else min(self.fastest, latency)
+			target = self.target()
+			overloaded = outcome == "throttled" or (outcome == "error" and self.error_rate > self.error_threshold) or (outcome == "success" and target is not None and latency > target)
+			if overloaded:
+				if started >= self.last_decrease:
+					self.limit = max(self.minimum, self.limit * self.decrease)
+					self.last_decrease = time.monotonic()
+			elif outcome == "success":
+				self.limit = min(self.maximum, self.limit + 1 / self.limit)
+				self.condition.notify_all()
+
+class AdaptiveClient:
+	"""
+		Send the http requests of the migration with a TokenBucket, an AIMDLimiter and retries
+		- rate and burst, the TokenBucket, None for no rate cap
+		- initial_concurrency and max_concurrency, the AIMDLimiter
+		- retries, the number of times a throttled or failed request is sent again, see is_retryable
+		- backoff and max_backoff, seconds, see backoff_delay
+		- timeout, seconds, the timeout of each request
+		Safe to share between threads, one client for the whole migration.
+	"""
+
+	def __init__(self, rate=None, burst=None, initial_concurrency=4, max_concurrency=32, retries=5, backoff=0.5, max_backoff=30.0, timeout=300, latency_target=None, session=None):
+		self.bucket = TokenBucket(rate, burst)
+		self.limiter = AIMDLimiter(initial=min(initial_concurrency, max_concurrency), maximum=max_concurrency, latency_target=latency_target)
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.timeout = timeout
+		self.session = session if session is not None else requests.Session()
+		self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency))
+		self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency))
+		self.random = random.Random()
+		self.lock = threading.Lock()
+		self.stats = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0, "failed": 0, "rate_wait": 0.0, "backoff_wait": 0.0}
+
+	def count(self, name, value=1):
+		""" add value to the statistic """
+		with self.lock:
+			self.stats[name] += value
+
+	def request(self, method, url, retries=None, transfer=False, **kwargs):
+		"""
+			send the request, return the response; the last response, or the last connection error raised, once the retries are used
+			- retries, overrides the retries of the client, 0 when the caller sends the request again itself
+			- transfer, the request sends the content of a file: it takes a slot of the limit, but its latency is the time of the transfer, so a success does not change the limit
+		"""
+		retries = self.retries if retries is None else retries
+		attempt = 0
+		start = time.perf_counter()
+		data = kwargs.get("data")
+		metrics.count("api.bytes_sent", len(data) if data is not None and not isinstance(data, dict) and hasattr(data, "__len__") else 0)
+		while True:
+			self.count("rate_wait", self.bucket.acquire())
+			with self.limiter.slot() as started:
+				self.count("requests")
+				try:
+					response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+				except requests.exceptions.RequestException as error:
+					response = error
+				latency = time.monotonic() - started
+			if isinstance(response, Exception):
+				outcome = "error"
+			elif response.status_code in THROTTLE_STATUS_CODES:
+				outcome = "throttled"
+			elif response.status_code in RETRY_STATUS_CODES:
+				outcome = "error"
+			else:
+				outcome = "success"
+			if not (transfer and outcome == "success"):
+				self.limiter.record(started, latency, outcome)
+			if outcome == "success":
+				metrics.observe(f"api.{method.lower()}", time.perf_counter() - start)
+				metrics.gauge("api.concurrency_limit", self.limiter.limit)
+				return response
+			self.count("throttled" if outcome == "throttled" else "errors")
+			metrics.count(f"api.{outcome}")
+			if attempt >= retries or not is_retryable(method, response):
+				self.count("failed")
+				metrics.count("api.failed")
+				if isinstance(response, Exception):
+					raise response
+				return response
+			delay = backoff_delay(attempt, self.backoff, self.max_backoff, None if isinstance(response, Exception) else retry_after_seconds(response), self.random)
+			self.count("retries")
+			metrics.count("api.retries")
+			self.count("backoff_wait", delay)
+			time.sleep(delay)
+			attempt += 1
+
+	def report(self):
+		""" return the summary of the requests """
+		return f"Api requests: {self.stats['requests']} sent, {self.stats['retries']} retries ({self.stats['throttled']} throttled, {self.stats['errors']} errors), {self.stats['failed']} failed, concurrency limit {int(self.limiter.limit)}, waited {self.stats['rate_wait']:.1f}s for the rate and {self.stats['backoff_wait']:.1f}s in backoff"
+
+class AdaptiveAPIObject(APIObject):
+	""" APIObject sending its requests through an AdaptiveClient, use as LabiiObject(..., api=AdaptiveAPIObject(client, ...)), returns the same values as APIObject """
+
+	def __init__(self, client, **kwargs):
+		super().__init__(**kwargs)
+		self.client = client
+
+	def send(self, method, url, data=None, is_authorized=True, success=(200, 201)):
+		""" send the request, return the json of the response, or its text if it failed """
+		body = None if data is None else json.dumps(data, separators=(',',':'))
+		response = self.client.request(method, f"{self.base_url}{url}", data=body, headers=self.get_headers(is_authorized))
+		if not response.status_code in success:
+			print(f"Error: {response.status_code} - {response.text}")
+			return response.text
+		try:
+			return json.loads(response.text)
+		except ValueError:
+			print(response.text)
+			return response.text
+
+	def post(self, url, data, is_authorized=True):
+		""" POST through the client """
+		return self.send("POST", url, data, is_authorized=is_authorized)
+
+	def patch(self, url, data, is_authorized=True):
+		""" PATCH through the client """
+		return self.send("PATCH", url, data, is_authorized=is_authorized)
+
+	def delete(self, url, is_authorized=True):
+		""" DELETE through the client """
+		return self.send("DELETE", url, is_authorized=is_authorized, success=(200, 204))
+
+	def get(self, url, all_pages=False, is_authorized=True):
+		""" GET through the client, with all_pages the results of all the pages are returned, as APIObject.get """
+		if all_pages is False:
+			return self.send("GET", url, is_authorized=is_authorized, success=(200,))
+		# remove the page and page_size of the url
+		path, _, query = url.partition("?")
+		query = [item for item in query.split("&") if item != "" and not item.startswith("page=") and not item.startswith("page_size=")]
+		url = path if len(query) == 0 else f"{path}?{'&'.join(query)}"
+		separator = "&" if "?" in url else "?"
+		page = 1
+		data = self.send("GET", f"{url}{separator}page={page}&page_size=10", is_authorized=is_authorized, success=(200,))
+		if not isinstance(data, dict):
+			return data
+		results = data["results"]
+		print(f"Total records: {data['count']}")
+		while len(results) < data["count"]:
+			page += 1
+			print(f"Downloading page {page}...")
+			page_data = self.send("GET", f"{url}{separator}page={page}&page_size=10", is_authorized=is_authorized, success=(200,))
+			if not isinstance(page_data, dict):
+				return page_data
+			results = results + page_data["results"]
+		data["results"] = results
+		return data
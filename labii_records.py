@@ -0,0 +1,85 @@
+"""
+The `labii_records.py` module provides helpers to read Labii records: a generator that fetches the pages of a list lazily, so that the work can start after the first page and only one page is kept in memory.
+SectionIndex and CellIndex find a section or a cell of the records at the position found for the first record of the table.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+def iterate_records(resource, page_size=50, serializer="list", query="", level="organization", prefetch=True):
+	"""
+		yield the records of resource.list one by one, fetching the pages when needed
+		- resource, a LabiiObject resource, for example labii.Record
+		- prefetch, fetch the next page in a thread while the current page is processed
+	"""
+	def fetch(page):
+		response = resource.list(page=page, page_size=page_size, all_pages=False, level=level, serializer=serializer, query=query)
+		if not isinstance(response, dict) or not "results" in response:
+			raise RuntimeError(f"Error: failed to list page {page} ({response})")
+		return response
+	executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+	try:
+		page = 1
+		response = fetch(page)
+		count = response.get("count", 0)
+		print(f"Total records: {count}")
+		fetched = 0
+		while len(response["results"]) > 0:
+			fetched += len(response["results"])
+			has_next = fetched < count and response.get("next", True) is not None
+			next_page = None
+			if has_next and executor is not None:
+				next_page = executor.submit(fetch, page + 1)
+			results = response["results"]
+			response = None
+			yield from results
+			if not has_next:
+				break
+			page += 1
+			response = next_page.result() if next_page is not None else fetch(page)
+	finally:
+		if executor is not None:
+			executor.shutdown(wait=False, cancel_futures=True)
+
+class SectionIndex:
+	"""
+		Find the section with a name in the section_set of the records
+		The position of the section is found once per table, the records of the same table are then checked at that position only, with a full scan if the position does not match.
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.positions = {} # table sid -> position in section_set
+
+	def find(self, record):
+		""" return the section of the record, None if the record has no section with the name """
+		section_set = record.get("section_set", [])
+		table_sid = (record.get("table") or {}).get("sid")
+		position = self.positions.get(table_sid)
+		if position is not None and position < len(section_set) and section_set[position]["name"] == self.name:
+			return section_set[position]
+		for position, section in enumerate(section_set):
+			if section["name"] == self.name:
+				self.positions[table_sid] = position
+				return section
+		return None
+
+class CellIndex:
+	"""
+		Find the cell of a column in the column_set of the records
+		The position of the cell of each column is found once per table, the records of the same table are then checked at that position only, with a full scan if the position does not match, as SectionIndex.
+	"""
+
+	def __init__(self):
+		self.positions = {} # (table sid, column sid) -> position in column_set
+
+	def find(self, record, column_sid):
+		""" return the cell of the column in the record, None if the record has no cell of the column """
+		column_set = record.get("column_set", [])
+		key = ((record.get("table") or {}).get("sid"), column_sid)
+		position = self.positions.get(key)
+		if position is not None and position < len(column_set) and column_set[position]["column"]["sid"] == column_sid:
+			return column_set[position]
+		for position, cell in enumerate(column_set):
+			if cell["column"]["sid"] == column_sid:
+				self.positions[key] = position
+				return cell
+		return None
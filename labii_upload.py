@@ -0,0 +1,324 @@
+"""
+The `labii_upload.py` module uploads files to the Labii files table without a file on disk, following the same steps as `LabiiObject.upload`: create the file record with a presigned post, then post the content.
+It also uploads large files with bounded memory: the file is read in chunks and streamed, and the chunks that failed are sent again without starting over.
+The requests sent to the Labii server go through the AdaptiveClient of the api when it has one, so that the uploads share the concurrency limit and the rate of the migration; the presigned posts of S3 do not load the Labii server and are sent directly.
+"""
+import os
+import time
+import mmap
+import uuid
+import urllib.parse
+import requests
+from labii_client import RETRY_STATUS_CODES, backoff_delay, retry_after_seconds
+from migration_metrics import metrics
+
+WIDGET_FILE_SIZE_SID = "KNQT0a40x5fMRW27bgl"
+WIDGET_FILE_PATH_SID = "JMPS0a40x5eLQV16afk"
+
+def fileobj_size(fileobj):
+	""" return the size of a seekable file object, keep its position """
+	position = fileobj.tell()
+	fileobj.seek(0, os.SEEK_END)
+	size = fileobj.tell()
+	fileobj.seek(position)
+	return size
+
+def create_file_record(labii, file_name, file_size, workspaces):
+	""" create the record of the files table, return the record with the presigned post and the sid of the path column """
+	if labii.table_file is None:
+		labii.get_file_table()
+	data = {
+		"workspaces": workspaces,
+		"name": file_name
+	}
+	column_path_sid = ""
+	for column in labii.table_file["columns"]:
+		# file size
+		if column["widget"]["sid"] == WIDGET_FILE_SIZE_SID:
+			data[column["sid"]] = file_size
+		# file path
+		if column["widget"]["sid"] == WIDGET_FILE_PATH_SID:
+			data[column["sid"]] = file_name
+			column_path_sid = column["sid"]
+	file_record = labii.Record.create(
+		data,
+		query=f"table__sid={labii.table_file['sid']}&presigned_post=true"
+	)
+	return file_record, column_path_sid
+
+def send_file_request(labii, method, url, retries=0, **kwargs):
+	"""
+		send a request of the upload, return the response
+		- through the AdaptiveClient of the api if the url is on the Labii server, sent again up to retries times; 0 by default, the callers send the request again with send_with_retry, which rewinds the file
+		- directly otherwise, as the presigned posts of S3
+	"""
+	client = getattr(labii.api, "client", None)
+	if client is not None and urllib.parse.urlsplit(url).netloc == urllib.parse.urlsplit(labii.api.base_url).netloc:
+		return client.request(method, url, retries=retries, transfer=True, **kwargs)
+	return requests.request(method, url, timeout=300, **kwargs)
+
+def send_fileobj(labii, fileobj, file_name, workspaces, retries=5, backoff=0.5):
+	"""
+		create the file record and post the content of the file object, return the file record, see upload_fileobj
+		- the post is sent again from the start of the file after the transient failures, up to retries times
+		- return None if the content was not uploaded, so that the file record is not cached or recorded
+	"""
+	print(f"Uploading {file_name}...")
+	file_record, column_path_sid = create_file_record(labii, file_name, fileobj_size(fileobj), workspaces)
+	if not isinstance(file_record, dict) or not "presigned_post" in file_record:
+		return None
+	url = file_record["presigned_post"]["url"]
+	data = file_record["presigned_post"]["fields"]
+	if "amazonaws.com" in url:
+		headers = {}
+	elif "/row/upload/" in url:
+		headers = labii.api.get_headers(True)
+		headers["Content-Type"] = "multipart/form-data"
+	else:
+		return None
+	def send():
+		fileobj.seek(0)
+		return send_file_request(labii, "POST", url, data=data, files={'file': (file_name, fileobj)}, headers=headers)
+	response = send_with_retry(send, retries, backoff, {"retries": 0, "resumed": 0})
+	if isinstance(response, Exception) or response.status_code >= 300:
+		print(f"Error: failed to upload {file_name} ({response})")
+		return None
+	# update version id
+	if "x-amz-version-id" in response.headers:
+		data = {}
+		data[column_path_sid] = f"{file_record['presigned_post']['fields']['key'].split('?')[0]}?versionId={response.headers['x-amz-version-id']}"
+		return labii.Record.modify(
+			file_record["sid"],
+			data
+		)
+	return file_record
+
+def upload_fileobj(labii, fileobj, file_name, workspaces):
+	"""
+		Upload the content of a file object as a file of the files table, return the file record
+		Args:
+			- fileobj, a seekable binary file object, for example io.BytesIO
+			- file_name, the name of the file
+			- workspaces, list of workspaces in the format of [{"sid": "workspace__sid"}]
+	"""
+	metrics.count("upload.files")
+	metrics.count("upload.bytes", fileobj_size(fileobj))
+	return send_fileobj(labii, fileobj, file_name, workspaces)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+class FileChunks:
+	"""
+		Read a file in chunks of a fixed size, from a memory map of the file or into a reused buffer
+		- use_mmap, map the file into memory instead of reading it into a buffer, the pages are loaded by the os when a chunk is read
+		At most one chunk is held in memory at a time.
+	"""
+
+	def __init__(self, file_path, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=True):
+		self.file_path = file_path
+		self.chunk_size = chunk_size
+		self.size = os.path.getsize(file_path)
+		self.file = open(file_path, "rb")#pylint: disable=consider-using-with
+		self.map = None
+		self.buffer = None
+		if use_mmap and self.size > 0:
+			self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			self.buffer = bytearray(chunk_size)
+
+	def close(self):
+		""" close the file """
+		if self.map is not None:
+			self.map.close()
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __len__(self):
+		return self.size
+
+	def read(self, offset, size=None):
+		""" return the bytes of the chunk starting at offset """
+		size = min(self.chunk_size if size is None else size, self.size - offset)
+		if self.map is not None:
+			return self.map[offset:offset + size]
+		self.file.seek(offset)
+		view = memoryview(self.buffer)[:size]
+		read = self.file.readinto(view)
+		return bytes(view[:read])
+
+	def __iter__(self):
+		for offset in range(0, self.size, self.chunk_size):
+			yield self.read(offset)
+
+class MultipartBody:
+	"""
+		multipart/form-data body of the fields and the file, streamed from FileChunks instead of being built in memory
+		- the length is known, so that requests sends a Content-Length header, as required by the presigned posts
+		- can be iterated again to send the body again
+	"""
+
+	def __init__(self, fields, file_name, chunks):
+		self.boundary = uuid.uuid4().hex
+		self.chunks = chunks
+		parts = []
+		for name, value in fields.items():
+			parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+		parts.append(f'--{self.boundary}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\nContent-Type: application/octet-stream\r\n\r\n')
+		self.head = "".join(parts).encode("utf-8")
+		self.tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+	@property
+	def content_type(self):
+		""" the Content-Type header of the body """
+		return f"multipart/form-data; boundary={self.boundary}"
+
+	def __len__(self):
+		return len(self.head) + len(self.chunks) + len(self.tail)
+
+	def __iter__(self):
+		yield self.head
+		yield from self.chunks
+		yield self.tail
+
+def is_retryable(response):
+	""" return True if the request failed and may succeed if sent again """
+	return isinstance(response, Exception) or response.status_code in RETRY_STATUS_CODES
+
+def send_with_retry(send, retries, backoff, stats):
+	""" return the response of send(), called again after the transient failures with a jittered backoff, the last response or error after the retries """
+	for attempt in range(retries + 1):
+		try:
+			response = send()
+		except requests.exceptions.RequestException as error:
+			response = error
+		if not is_retryable(response) or attempt == retries:
+			return response
+		stats["retries"] += 1
+		metrics.count("upload.retries")
+		time.sleep(backoff_delay(attempt, backoff, retry_after=None if isinstance(response, Exception) else retry_after_seconds(response)))
+	return response
+
+def received_offset(response):
+	""" return the number of bytes received by the server from the Range header of a 308 response """
+	value = response.headers.get("Range", "")
+	if not value.startswith("bytes=0-"):
+		return 0
+	return int(value[len("bytes=0-"):]) + 1
+
+def put_chunks(labii, url, chunks, headers, retries, backoff, stats):
+	"""
+		send the file in chunks with PUT and Content-Range: bytes start-end/total, the server answers 308 with the Range received until the last chunk
+		- a chunk that failed is sent again; if the server state is unknown, it is asked with Content-Range: bytes */total and the upload resumes from there
+		- only a 200 or 201 to the last chunk finishes the upload, a success to an earlier chunk means the server ignored the Content-Range
+		- the upload stops after retries answers that do not advance the Range
+		return the last response, None if the server does not support the chunks
+	"""
+	total = len(chunks)
+	offset = 0
+	stalled = 0
+	while True:
+		chunk = chunks.read(offset)
+		chunk_headers = dict(headers)
+		chunk_headers["Content-Range"] = f"bytes {offset}-{offset + len(chunk) - 1}/{total}"
+		response = send_with_retry(lambda chunk=chunk, chunk_headers=chunk_headers: send_file_request(labii, "PUT", url, data=chunk, headers=chunk_headers, allow_redirects=False), retries, backoff, stats)
+		if isinstance(response, Exception) or is_retryable(response):
+			# the chunk may have been received before the failure, ask the server where to resume
+			status_headers = dict(headers)
+			status_headers["Content-Range"] = f"bytes */{total}"
+			status = send_with_retry(lambda: send_file_request(labii, "PUT", url, data=b"", headers=status_headers, allow_redirects=False), retries, backoff, stats)
+			if isinstance(status, Exception) or not status.status_code in (200, 201, 308):
+				return response
+			if status.status_code != 308:
+				return status
+			response = status
+			stats["resumed"] += 1
+		elif response.status_code != 308:
+			if response.status_code in (200, 201) and offset + len(chunk) == total:
+				return response
+			if offset == 0 or response.status_code < 300:
+				# the server does not support the chunks, or kept a part of the file only
+				return None
+			return response
+		received = received_offset(response)
+		if received >= total:
+			# all the bytes are received but the upload is not finished
+			return response
+		if received <= offset:
+			stalled += 1
+			if stalled > retries:
+				print(f"Error: the upload does not advance past byte {offset}")
+				return response
+		else:
+			stalled = 0
+		offset = received
+
+def upload_large_file(labii, file_path, workspaces, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=True, retries=5, backoff=0.5):
+	"""
+		Upload a large file as a file of the files table with bounded memory, return the file record
+		- the file is read in chunks of chunk_size from a memory map of the file, or into a buffer if not use_mmap
+		- self hosted servers (/row/upload/) receive the file in resumable chunks, only the failed chunks are sent again
+		- the presigned posts of S3, and the servers without chunks, receive one streamed multipart post, sent again after the transient failures
+		- the throughput and the retries are printed
+	"""
+	file_name = os.path.basename(file_path)
+	stats = {"retries": 0, "resumed": 0}
+	start = time.perf_counter()
+	with FileChunks(file_path, chunk_size=chunk_size, use_mmap=use_mmap) as chunks:
+		print(f"Uploading {file_name} in chunks of {chunk_size / 1024 / 1024:.0f} MB...")
+		file_record, column_path_sid = create_file_record(labii, file_name, len(chunks), workspaces)
+		if not isinstance(file_record, dict) or not "presigned_post" in file_record:
+			return None
+		url = file_record["presigned_post"]["url"]
+		data = file_record["presigned_post"]["fields"]
+		headers = {} if "amazonaws.com" in url else labii.api.get_headers(True)
+		response = None
+		if "/row/upload/" in url and len(chunks) > 0:
+			chunk_headers = dict(headers)
+			chunk_headers["Content-Type"] = "application/octet-stream"
+			response = put_chunks(labii, url, chunks, chunk_headers, retries, backoff, stats)
+		if response is None:
+			body = MultipartBody(data, file_name, chunks)
+			post_headers = dict(headers)
+			post_headers["Content-Type"] = body.content_type
+			response = send_with_retry(lambda: send_file_request(labii, "POST", url, data=body, headers=post_headers), retries, backoff, stats)
+		seconds = time.perf_counter() - start
+		if isinstance(response, Exception) or response.status_code >= 300:
+			print(f"Error: failed to upload {file_name} ({response})")
+			return None
+		print(f"Uploaded {file_name}: {len(chunks) / 1024 / 1024:.1f} MB in {seconds:.1f}s ({len(chunks) / 1024 / 1024 / max(seconds, 1e-9):.1f} MB/s), {stats['retries']} retries, {stats['resumed']} resumed")
+	# update version id
+	if "x-amz-version-id" in response.headers:
+		data = {}
+		data[column_path_sid] = f"{file_record['presigned_post']['fields']['key'].split('?')[0]}?versionId={response.headers['x-amz-version-id']}"
+		return labii.Record.modify(
+			file_record["sid"],
+			data
+		)
+	return file_record
+
+class ChunkedUploadLabiiObject:
+	""" LabiiObject uploading the files larger than threshold bytes with upload_large_file, and the others as upload_fileobj instead of LabiiObject.upload, so that all the uploads go through the api client; all other attributes are the ones of the LabiiObject """
+
+	def __init__(self, labii, threshold=256 * 1024 * 1024, chunk_size=DEFAULT_CHUNK_SIZE):
+		self.labii = labii
+		self.threshold = threshold
+		self.chunk_size = chunk_size
+
+	def __getattr__(self, name):
+		return getattr(self.labii, name)
+
+	def upload(self, file_path, workspaces):
+		""" upload the file, in chunks if it is larger than threshold, return the file record """
+		size = os.path.getsize(file_path)
+		metrics.count("upload.files")
+		metrics.count("upload.bytes", size)
+		with metrics.timer("upload"):
+			if size > self.threshold:
+				return upload_large_file(self.labii, file_path, workspaces, chunk_size=self.chunk_size)
+			with open(file_path, "rb") as fileobj:
+				return send_fileobj(self.labii, fileobj, os.path.basename(file_path), workspaces)
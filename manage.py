@@ -1,17 +1,36 @@
 """ core manage function """
-import sys
 import os
-from labii_sdk_core.sdk import print_red, print_blue, print_green, prepare_usage, merge_requests
-from labii_sdk_core.whl import install_whl
+import sys
+import importlib
+
+# the commands of the migration, the module of a command is only imported when it is run
+COMMANDS = {
+	"files": ("migrate_file_as_entry", "[options], import each file or folder as a Labii entry"),
+	"excel": ("migrate_excel_sheet_as_entry", "[options], import each sheet of an excel file as a Labii entry"),
+	"benchling": ("migrate_benchling_entries", "[options], import Benchling entries as Labii entries"),
+	"plasmids": ("migrate_benchling_plasminds", "[options], upload the *.gb files exported from Benchling to the Labii plasmids"),
+	"migrate": ("migration_runner", "--config jobs.yaml [--check], run the migration jobs of the config file without prompts"),
+	"plan": ("migration_plan", "files|benchling FOLDER [--output plan.json] [options], check the attachments and estimate the duration of a migration without uploading"),
+	"bench": ("benchmark", "[benchmarks] [options], measure the migrators on synthetic exports against a fake Labii server")
+}
 
 def main():
 	""" main handle function """
+	# the commands of the migration do not need the sdk core
+	if len(sys.argv) >= 2 and sys.argv[1] in COMMANDS:
+		importlib.import_module(COMMANDS[sys.argv[1]][0]).main(sys.argv[2:])
+		return
+	from labii_sdk_core.sdk import print_red, print_blue, print_green, prepare_usage, merge_requests#pylint: disable=import-outside-toplevel
+	from labii_sdk_core.whl import install_whl#pylint: disable=import-outside-toplevel
+
 	# update here for name of the function
 	actions = []
 
 	# update here for arguments
 	usage = prepare_usage(actions)
-	usage = f"{usage}\ntest, the test job"
+	for command, (_, description) in COMMANDS.items():
+		usage = f"{usage}\n{command} {description}"
+	usage = f"{usage}\nuse --help after a command for its options\ntest, run the tests of the tests folder, then all the benchmarks on small data, they fail if a migrator, a transform or the startup time is broken"
 
 	if len(sys.argv) < 2:
 		print_blue(usage)
@@ -27,7 +46,13 @@ def main():
 	elif action == "install_whl":
 		install_whl("labii_sdk_core")
 	elif action == "test":
-		os.system("python -m unittest tests")
+		import unittest#pylint: disable=import-outside-toplevel
+		root = os.path.dirname(os.path.abspath(__file__))
+		result = unittest.TextTestRunner(verbosity=2).run(unittest.defaultTestLoader.discover(os.path.join(root, "tests"), top_level_dir=root))
+		if not result.wasSuccessful():
+			print_red("Error: the tests failed!")
+			sys.exit(1)
+		importlib.import_module("benchmark").main(["--scale", "0.1"])
 	else:
 		print_red(f"Error: Action ({action}) is not recognizable!")
 		print(usage)
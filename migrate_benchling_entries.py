@@ -1,95 +1,459 @@
 """
 The `migrate_benchling_entries.py` function serves as a script to facilitate the seamless migration of data from Benchling to Labii. Specifically, it is designed to import Benchling entries, which encompass various forms of scientific data and documentation, into Labii's entry system.
+bs4, and with it the lxml and html5lib parsers, is imported by the code that reads the entries, so that the script starts quickly.
 """
 import os
-import shlex
+import re
 import glob
-import sys
+import time
+import hashlib
+import functools
 import datetime
-from bs4 import BeautifulSoup
-from labii_sdk.sdk import LabiiObject
-from migrate_file_as_entry import collect_labii_settings
+import argparse
+import requests
+from concurrent.futures import ProcessPoolExecutor
+from html_transform import TransformEngine, find_descendant
+from html_stream import StreamTransform
+from table_pruning import MIN_ROWS, row_cells, has_spans, empty_cells, empty_matrix, plan_pruning, table_stats, prune_tables
+from migration_journal import MigrationJournal, file_sha256
+from migration_pool import ordered_map
+from migration_pipeline import Pipeline, Stage
+from migration_plan import entry_file_path, load_plan, ready_entries
+from migration_metrics import metrics, profiler
+from migrate_file_as_entry import collect_labii_settings, format_response, request_error, add_common_arguments, open_upload_cache, open_batch_writer, close_batch_writer, open_client, open_labii, open_metrics, close_metrics, add_pipeline_arguments
+
+PARSERS = ["html.parser", "lxml", "html5lib"]
+DEFAULT_PARSER = "html.parser"
+transform_engine = TransformEngine()
+PENDING_FILE_PATTERN = re.compile(r'<section class="labii-file-pending" data-pending="(\d+)"></section>')
+
+def new_fragment(context, html, name, attrs, text=""):
+	"""
+		return the nodes to replace a benchling item with
+		- the tag is built directly when the values are plain text, otherwise the html is parsed as before
+	"""
+	values = [text] + list(attrs.values())
+	if any(("<" in value or "&" in value or '"' in value) for value in values):
+		from bs4 import BeautifulSoup#pylint: disable=import-outside-toplevel
+		return BeautifulSoup(html, 'html.parser')
+	tag = context["soup"].new_tag(name, attrs=attrs)
+	if text != "":
+		tag.string = text
+	return tag
+
+@transform_engine.register('div', 'daySeparator')
+def replace_day_separator(day_div, context):
+	""" replace one day separator with labii day """
+	date_span = day_div.find('span', class_='daySeparator-date')
+	if date_span:
+		date = date_span.text.strip()
+		parsed_date = datetime.datetime.strptime(date, "%A, %m/%d/%Y")
+		formatted_date = parsed_date.strftime("%A, %Y-%m-%d")
+		# Create the replacement, same as <div class="labii-day"><span class="labii-day-label">{date}</span></div>
+		replacement = context["soup"].new_tag('div', attrs={"class": "labii-day"})
+		label = context["soup"].new_tag('span', attrs={"class": "labii-day-label"})
+		label.string = formatted_date
+		replacement.append(label)
+		# Replace the current <div> with the replacement HTML
+		day_div.replace_with(replacement)
+
+@transform_engine.register('div', 'mediocre-item is-text', descendants_first=True)
+def replace_text_item(text_div, context):
+	""" replace one text item with p """
+	# Define the replacement HTML
+	replacement_html = '<p>{text}</p>'
+	text = text_div.text.strip()
+	# Create the replacement HTML with the modified date
+	replacement = new_fragment(context, replacement_html.format(text=text), 'p', {}, text)
+	# Replace the current <div> with the replacement HTML
+	text_div.replace_with(replacement)
+
+@transform_engine.register('div', 'mediocre-item is-code', descendants_first=True)
+def replace_code_item(text_div, context):
+	""" replace one code item with pre """
+	# Define the replacement HTML
+	replacement_html = '<pre data-language="Plain text" spellcheck="false" xpath="1"><code class="language-plaintext">{text}</code></pre>'
+	text = text_div.text.strip()
+	# Create the replacement HTML with the modified date
+	replacement = new_fragment(context, replacement_html.format(text=text), 'code', {"class": "language-plaintext"}, text)
+	if replacement.name == 'code':
+		pre = context["soup"].new_tag('pre', attrs={"data-language": "Plain text", "spellcheck": "false", "xpath": "1"})
+		pre.append(replacement)
+		replacement = pre
+	# Replace the current <div> with the replacement HTML
+	text_div.replace_with(replacement)
+
+def upload_entry_file(labii, file_path, settings, journal=None, journal_key=None):
+	""" upload a file of an entry, skip the upload if it is in the journal, return the file record, raise RuntimeError if the upload failed """
+	workspaces = [{"sid": settings["labii_project_sid"]}]
+	try:
+		if journal is None:
+			file_record = labii.upload(file_path, workspaces)
+		else:
+			file_record = journal.upload(labii, journal_key, file_path, workspaces)
+	except requests.exceptions.RequestException as error:
+		file_record = request_error(error)
+	if not isinstance(file_record, dict) or not "sid" in file_record:
+		raise RuntimeError(f"Error: File ({file_path}) not uploaded: {file_record}")
+	return file_record
+
+def file_section(context, file_record):
+	""" return the labii file of the file record """
+	# Define the replacement HTML
+	replacement_html = '<section class="labii-file" sid="{file_sid}" name="{file_name}" version="{version_sid}" should_hide_preview="false"></section>'
+	attrs = {
+		"class": "labii-file",
+		"sid": file_record['sid'],
+		"name": f"{file_record['uid']}: {file_record['name']}",
+		"version": file_record['version']['sid'],
+		"should_hide_preview": "false"
+	}
+	return new_fragment(context, replacement_html.format(file_sid=attrs["sid"], file_name=attrs["name"], version_sid=attrs["version"]), 'section', attrs)
+
+@transform_engine.register('div', 'mediocre-item', descendants_first=True)
+def replace_file_item(file_div, context):
+	"""
+		upload the file of one file item and replace it with labii file
+		- context requires labii, current_file, settings and name_index
+		- the upload is skipped if the file is in context["journal"] for context["journal_key"]
+		- if context["pending_files"] is a list, the file is not uploaded but added to the list and replaced with a placeholder
+	"""
+	name_index = context["name_index"] # incase the same name used multiple times
+	current_file = context["current_file"]
+	name_div = file_div.find('div', class_='note-itemName')
+	if name_div:
+		file_name = name_div.text.strip()
+		# upload file, " {name} {n}{ext}" for the n-th file with the same name
+		file_path = entry_file_path(current_file, file_name, name_index)
+		if os.path.exists(file_path):
+			if context.get("pending_files") is not None:
+				# upload later with resolve_pending_files, the placeholder has no text like the labii file
+				replacement = context["soup"].new_tag('section', attrs={"class": "labii-file-pending", "data-pending": str(len(context["pending_files"]))})
+				context["pending_files"].append(file_path)
+			else:
+				file_record = upload_entry_file(context["labii"], file_path, context["settings"], context.get("journal"), context.get("journal_key"))
+				replacement = file_section(context, file_record)
+			# Replace the current <div> with the replacement HTML
+			file_div.replace_with(replacement)
+		else:
+			raise FileNotFoundError(f"Error: File ({file_path}) not exists!")
+
+@transform_engine.register('td', descendants_first=True)
+def replace_td_content(td, context):#pylint: disable=invalid-name,unused-argument
+	""" keep only the first version of a benchling table header cell """
+	# find the label wrapper
+	wrapper_div = find_descendant(td, 'div', 'mediocre-tableEditable-axisCell-labelWrapper')
+	if wrapper_div:
+		# Find the first element inside the <td> tag
+		first_element = wrapper_div.find(True, recursive=False)
+		if first_element:
+			# Replace the inner HTML of the <td> tag with the text from the first element
+			td.string = first_element.get_text()
+
+@transform_engine.register('style')
+@transform_engine.register('div', 'mediocre-tableEditable-fillerTableWrapper')
+def extract_tag(tag, context):#pylint: disable=unused-argument
+	""" remove the tag from the document """
+	tag.extract()
+
+@transform_engine.register('tr')
+def collect_table_row(row, context):
+	""" collect the rows for remove_empty_rows """
+	context.setdefault("rows", []).append(row)
+
+def print_table_stats(stats):
+	""" print one line of the statistics of the pruned tables of an entry, if a table was pruned or skipped for its merged cells """
+	pruned = [table for table in stats if table["deleted_rows"] > 0 or table["deleted_columns"] > 0]
+	skipped = [table for table in stats if table["spans"] and table["rows"] > MIN_ROWS]
+	if len(pruned) == 0 and len(skipped) == 0:
+		return
+	deleted_rows = sum(table["deleted_rows"] for table in pruned)
+	deleted_columns = sum(table["deleted_columns"] for table in pruned)
+	skipped_text = f", {len(skipped)} tables with merged cells not pruned" if len(skipped) > 0 else ""
+	print(f"Pruned {len(pruned)}/{len(stats)} tables: deleted {deleted_rows}/{sum(table['rows'] for table in pruned)} rows, {deleted_columns} columns{skipped_text}")
+
+def remove_empty_rows(rows):
+	"""
+		remove the rows that only have an empty label cell and the trailing empty columns of the tables with more than 500 rows
+		return the statistics of each table, see prune_tables
+	"""
+	stats = prune_tables(rows)
+	print_table_stats(stats)
+	return stats
+
+@transform_engine.register_finalizer
+def remove_collected_empty_rows(soup, context):#pylint: disable=unused-argument
+	""" remove the empty rows collected during the walk """
+	context["table_stats"] = remove_empty_rows(context.get("rows", []))
+
+def entry_context(labii, current_file, settings, journal=None):
+	""" return the context of the transform rules for an entry """
+	return {
+		"labii": labii,
+		"current_file": current_file,
+		"settings": settings,
+		"name_index": {},
+		"journal": journal,
+		"journal_key": os.path.abspath(current_file)
+	}
+
+def transform_entry(soup, labii, current_file, settings, journal=None):
+	"""
+		apply all benchling to labii transforms in a single pass, same result as the update_* and remove_* chain
+		- journal, a MigrationJournal to skip the files already uploaded for current_file
+	"""
+	return transform_engine.run(soup, entry_context(labii, current_file, settings, journal))
+
+def serialize_streamed_element(soup, context):
+	"""
+		return the output of an element transformed by stream_entry
+		- the tables inside the element are pruned
+		- a row of a table outside the element is returned as (table, empty cells, [(column, html)], merged cells), to be pruned once the rows of the whole table are read
+	"""
+	rows = context.pop("rows", [])
+	row = soup.contents[0] if len(soup.contents) == 1 else None
+	if row is None or len(rows) == 0 or rows[0] is not row:
+		context["table_stats"].extend(prune_tables(rows))
+		return str(soup)
+	context["table_stats"].extend(prune_tables(rows[1:]))
+	cells = row_cells(row)
+	columns = {id(cell): column for column, cell in enumerate(cells)}
+	children = [(columns.get(id(child)), str(child)) for child in row.contents]
+	row_html = str(row)
+	inner_size = sum(len(child_html) for _, child_html in children)
+	start = row_html[:len(row_html) - inner_size - len("</tr>")]
+	pieces = [(None, start)] + children + [(None, "</tr>")]
+	return (context["stream"].open_element('table'), empty_cells(cells), pieces, has_spans(cells))
+
+def stream_entry(current_file, context, chunk_size=1024 * 1024):
+	"""
+		transform an entry without a soup of the whole entry, return the body html
+		- the file is read in chunks, and only the elements matching a rule are parsed, one at a time
+		- same result as transform_entry for well formed entries
+	"""
+	context["table_stats"] = []
+	stream = StreamTransform(transform_engine, context, serialize=serialize_streamed_element, skip_rules=(extract_tag,))
+	with open(current_file, 'r', encoding='utf-8') as file:
+		parts = stream.transform(file, chunk_size)
+	# prune the tables once all their rows are read, same as remove_empty_rows
+	tables = {}
+	for index, part in enumerate(parts):
+		if isinstance(part, tuple):
+			tables.setdefault(part[0], []).append(index)
+	for indexes in tables.values():
+		empty = empty_matrix([parts[index][1] for index in indexes])
+		spans = any(parts[index][3] for index in indexes)
+		delete, keep = plan_pruning(empty, spans=spans)
+		for index, deleted in zip(indexes, delete):
+			pieces = [] if deleted else parts[index][2]
+			parts[index] = "".join(piece for column, piece in pieces if column is None or column < keep)
+		context["table_stats"].append(table_stats(empty, delete, keep, spans))
+	print_table_stats(context["table_stats"])
+	return "".join(parts)
+
+def read_entry(current_file, context, parser=DEFAULT_PARSER, stream_threshold=None, html_content=None):
+	"""
+		read and transform an entry, return the body html
+		- parser, the BeautifulSoup parser of the entry, one of PARSERS
+		- stream_threshold, the entries larger than this number of bytes are transformed with stream_entry
+		- html_content, the content of the entry already read, the file is not read again
+		- the seconds of each stage, parse, transform (and transform.<rule> for each rule), serialize or stream, are added to context["stage_seconds"] if the metrics are enabled or the dict is in the context
+	"""
+	measure = metrics.enabled or "stage_seconds" in context
+	if measure:
+		stage_seconds = context.setdefault("stage_seconds", {})
+		context["rule_seconds"] = {}
+	size = os.path.getsize(current_file)
+	metrics.count("source.bytes", size)
+	start = time.perf_counter()
+	if html_content is None and stream_threshold is not None and size > stream_threshold:
+		body_html = stream_entry(current_file, context)
+		if measure:
+			stage_seconds["stream"] = time.perf_counter() - start
+	else:
+		if html_content is None:
+			with open(current_file, 'r', encoding='utf-8') as file:
+				html_content = file.read()
+		from bs4 import BeautifulSoup#pylint: disable=import-outside-toplevel
+		soup = BeautifulSoup(html_content, parser)
+		parsed = time.perf_counter()
+		soup = transform_engine.run(soup, context)
+		transformed = time.perf_counter()
+		body_html = str(soup.find('body'))
+		if measure:
+			stage_seconds["parse"] = parsed - start
+			stage_seconds["transform"] = transformed - parsed
+			stage_seconds["serialize"] = time.perf_counter() - transformed
+	if measure:
+		for name, seconds in context.pop("rule_seconds").items():
+			stage_seconds[f"transform.{name}"] = seconds
+	return body_html
+
+def decode_entry(content):
+	""" return the text of the bytes of an entry, same as reading the file in text mode """
+	return content.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+def prepare_entry(current_file, parser=DEFAULT_PARSER, stream_threshold=None, stage_seconds=None, content=None):
+	"""
+		read, parse and transform an entry without uploading its files, can run in a worker process
+		return (body_html, pending_files, sha256), the files are placeholders in body_html to be replaced with resolve_pending_files
+		- stage_seconds, a dict to add the seconds of the stages to, see read_entry
+		- content, the bytes of the entry already read, the file is not read again
+	"""
+	context = {
+		"current_file": current_file,
+		"name_index": {},
+		"pending_files": []
+	}
+	if stage_seconds is not None:
+		context["stage_seconds"] = stage_seconds
+	if content is not None:
+		body_html = read_entry(current_file, context, parser, stream_threshold, html_content=decode_entry(content))
+		return body_html, context["pending_files"], hashlib.sha256(content).hexdigest()
+	body_html = read_entry(current_file, context, parser, stream_threshold)
+	return body_html, context["pending_files"], file_sha256(current_file)
+
+def prepare_entry_or_error(current_file, measure=False, **kwargs):
+	"""
+		return (prepare_entry(current_file, **kwargs), None, stage_seconds), or (None, error, stage_seconds) if a file of the entry is missing, so that a pool keeps going
+		- measure, return the seconds of the stages, the metrics of a worker process are not the ones of the main process
+	"""
+	stage_seconds = {} if measure else None
+	try:
+		return prepare_entry(current_file, stage_seconds=stage_seconds, **kwargs), None, stage_seconds
+	except FileNotFoundError as error:
+		return None, str(error), stage_seconds
+
+def check_parser_conformance(files, parsers=None, stream=True):
+	"""
+		transform the entries with each parser, and with stream_entry, without uploading their files
+		return the list of (file, parser or "stream") whose body html is different from the one of the first parser
+	"""
+	parsers = PARSERS if parsers is None else parsers
+	variants = [(parser, {"parser": parser}) for parser in parsers[1:]]
+	if stream:
+		variants.append(("stream", {"parser": parsers[0], "stream_threshold": 0}))
+	differences = []
+	for current_file in files:
+		expected = prepare_entry(current_file, parser=parsers[0])[0]
+		for name, kwargs in variants:
+			if prepare_entry(current_file, **kwargs)[0] != expected:
+				differences.append((current_file, name))
+	return differences
+
+def resolve_pending_files(labii, body_html, pending_files, settings, journal=None, journal_key=None):
+	""" upload the pending files of prepare_entry, return body_html with the placeholders replaced with the labii files """
+	from bs4 import BeautifulSoup#pylint: disable=import-outside-toplevel
+	context = {"soup": BeautifulSoup("", 'html.parser')}
+	sections = []
+	for file_path in pending_files:
+		file_record = upload_entry_file(labii, file_path, settings, journal, journal_key)
+		sections.append(str(file_section(context, file_record)))
+	return PENDING_FILE_PATTERN.sub(lambda match: sections[int(match.group(1))], body_html)
+
+def create_benchling_entry(labii, current_file, body_html, settings, journal=None, writer=None):
+	"""
+		create the labii entry of the benchling entry, record it in the journal and print it, return the response
+		- writer, a BatchWriter of the entries, the entry is created with its batch and the Future of the response is returned
+		- the entry already in the journal, for an entry changed since it was migrated, is updated instead
+	"""
+	entry_name = os.path.splitext(os.path.basename(current_file))[0]
+	data = {
+		"name": entry_name,
+		"projects": [{"sid": settings["labii_project_sid"]}],
+		"data": body_html
+	}
+	entry = None if journal is None else journal.get(os.path.abspath(current_file), "entry")
+	if writer is not None and entry is None:
+		def created(source, response):
+			if journal is not None:
+				journal.record_entry(os.path.abspath(source), response)
+			print(f"{os.path.basename(source)}: {format_response(response)}")
+		return writer.add(current_file, data, callback=created)
+	try:
+		if entry is not None:
+			with metrics.timer("modify"):
+				response = labii.Record.modify(entry["sid"], data)
+		else:
+			with metrics.timer("create"):
+				response = labii.Record.create(data, query=f"table__sid={settings['labii_table_entry_sid']}")
+	except requests.exceptions.RequestException as error:
+		response = request_error(error)
+	if journal is not None:
+		journal.record_entry(os.path.abspath(current_file), response)
+	print(format_response(response))
+	return response
+
+def migrate_entries_in_processes(labii, files, settings, processes, journal, parser=DEFAULT_PARSER, stream_threshold=None, writer=None, delta=False):
+	"""
+		parse and transform the entries in a pool of processes, upload the files and create the entries in this process
+		- the entries are created in the order of files, or with their batch if writer, a BatchWriter, is provided
+		- delta, the entries changed since they were migrated are migrated again and their labii entry updated
+	"""
+	entries = [current_file for current_file in files if not "/migrated" in current_file and "etr_" in current_file]
+	if delta:
+		for current_file in entries:
+			journal.changed(os.path.abspath(current_file), current_file)
+	entries = [current_file for current_file in entries if not journal.is_done(os.path.abspath(current_file))]
+	print(f"Skipped {len(files) - len(entries)} files, already migrated or not an entry")
+	with ProcessPoolExecutor(max_workers=processes) as executor:
+		index = 1
+		for current_file, (prepared, error, stage_seconds) in ordered_map(functools.partial(prepare_entry_or_error, measure=metrics.enabled, parser=parser, stream_threshold=stream_threshold), entries, workers=processes, executor=executor):
+			print(f"{index}/{len(entries)} {os.path.basename(current_file)}...")
+			index += 1
+			if stage_seconds is not None:
+				metrics.observe_all(stage_seconds)
+			journal_key = os.path.abspath(current_file)
+			if prepared is None:
+				journal.record_error(journal_key, error)
+				print(error)
+				continue
+			body_html, pending_files, sha256 = prepared
+			if journal.get(journal_key, "hash") is None:
+				journal.record(journal_key, "hash", sha256)
+			try:
+				body_html = resolve_pending_files(labii, body_html, pending_files, settings, journal=journal, journal_key=journal_key)
+			except RuntimeError as error:
+				journal.record_error(journal_key, error)
+				print(error)
+				continue
+			create_benchling_entry(labii, current_file, body_html, settings, journal=journal, writer=writer)
 
 def update_day_separator(soup):
 	""" update the day separator with labii day """
 	# Find all <div> tags with class "daySeparator"
 	day_separator_divs = soup.find_all('div', class_='daySeparator')
-	# Define the replacement HTML
-	replacement_html = '<div class="labii-day"><span class="labii-day-label">{date}</span></div>'
 	# Loop through the found <div> tags and replace them
 	for day_div in day_separator_divs:
-		date_span = day_div.find('span', class_='daySeparator-date')
-		if date_span:
-			date = date_span.text.strip()
-			parsed_date = datetime.datetime.strptime(date, "%A, %m/%d/%Y")
-			formatted_date = parsed_date.strftime("%A, %Y-%m-%d")
-			# Create the replacement HTML with the modified date
-			replacement = replacement_html.format(date=formatted_date)
-			# Replace the current <div> with the replacement HTML
-			day_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
+		replace_day_separator(day_div, {"soup": soup})
 	return soup
 
 def update_text_item(soup):
 	""" update the text item with p """
 	# Find all text <div>
 	text_divs = soup.find_all('div', class_='mediocre-item is-text')
-	# Define the replacement HTML
-	replacement_html = '<p>{text}</p>'
 	# Loop through the found <div> tags and replace them
 	for text_div in text_divs:
-		text = text_div.text.strip()
-		# Create the replacement HTML with the modified date
-		replacement = replacement_html.format(text=text)
-		# Replace the current <div> with the replacement HTML
-		text_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
+		replace_text_item(text_div, {"soup": soup})
 	return soup
 
 def update_code_item(soup):
 	""" update the text item with p """
 	# Find all text <div>
 	text_divs = soup.find_all('div', class_='mediocre-item is-code')
-	# Define the replacement HTML
-	replacement_html = '<pre data-language="Plain text" spellcheck="false" xpath="1"><code class="language-plaintext">{text}</code></pre>'
 	# Loop through the found <div> tags and replace them
 	for text_div in text_divs:
-		text = text_div.text.strip()
-		# Create the replacement HTML with the modified date
-		replacement = replacement_html.format(text=text)
-		# Replace the current <div> with the replacement HTML
-		text_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
+		replace_code_item(text_div, {"soup": soup})
 	return soup
 
 def update_file(soup, labii, current_file, settings):
-	""" update the file with labii file """
-	# Find all <div> tags with class "daySeparator"
+	""" update the file with labii file, raise FileNotFoundError if a file is missing """
+	# Find all <div> tags with class "mediocre-item"
 	file_divs = soup.find_all('div', class_='mediocre-item')
-	# Define the replacement HTML
-	replacement_html = '<section class="labii-file" sid="{file_sid}" name="{file_name}" version="{version_sid}" should_hide_preview="false"></section>'
 	# Loop through the found <div> tags and replace them
-	name_index = {} # incase the same name used multiple times
+	context = {"soup": soup, "labii": labii, "current_file": current_file, "settings": settings, "name_index": {}}
 	for file_div in file_divs:
-		name_div = file_div.find('div', class_='note-itemName')
-		if name_div:
-			file_name = name_div.text.strip()
-			# update name index
-			if not file_name in name_index:
-				name_index[file_name] = 1
-			else:
-				name_index[file_name] += 1
-			# upload file
-			file_path = current_file.replace(".html", f" {file_name}")
-			name_parts = os.path.splitext(file_name)
-			if name_index[file_name] > 1:
-				file_path = current_file.replace(".html", f" {name_parts[0]} {name_index[file_name]}{name_parts[1]}")
-			if os.path.exists(file_path):
-				file_record = labii.upload(file_path, [{"sid": settings["labii_project_sid"]}])
-				# Create the replacement HTML with the modified date
-				replacement = replacement_html.format(file_sid=file_record['sid'], file_name=f"{file_record['uid']}: {file_record['name']}", version_sid=file_record['version']['sid'])
-				# Replace the current <div> with the replacement HTML
-				file_div.replace_with(BeautifulSoup(replacement, 'html.parser'))
-			else:
-				print(f"Error: File ({file_path}) not exists!")
-				sys.exit()
+		replace_file_item(file_div, context)
 	return soup
 
 def update_td_content(soup):
@@ -98,14 +462,7 @@ def update_td_content(soup):
 	td_tags = soup.find_all('td')
 	# Loop through the <td> tags
 	for td in td_tags:#pylint: disable=invalid-name
-		# find the label wrapper
-		wrapper_div = td.find('div', class_='mediocre-tableEditable-axisCell-labelWrapper')
-		if wrapper_div:
-			# Find the first element inside the <td> tag
-			first_element = wrapper_div.find(True, recursive=False)
-			if first_element:
-				# Replace the inner HTML of the <td> tag with the text from the first element
-				td.string = first_element.get_text()
+		replace_td_content(td, {"soup": soup})
 	return soup
 
 def remove_style_tags(soup):
@@ -124,99 +481,170 @@ def remove_table_wrapper_div(soup):
 
 def remove_empty_table_tr(soup):
 	""" some of table contains a lot of empty rows, these need to be removed to save space """
-	rows = soup.find_all('tr')
-	total_rows = len(rows)
-	if total_rows > 500:# only delete big tables
-		for row in rows:
-			should_delete = True
-			cells = row.find_all('td')[1:]
-			for cell in cells:
-				if any(cell.stripped_strings):
-					should_delete = False
-					break
-			if should_delete:
-				row.extract()
-		rows = soup.find_all('tr')
-		deleted_rows = total_rows - len(rows)
-		if deleted_rows > 0:
-			print(f"Deleted rows {deleted_rows}")
+	remove_empty_rows(soup.find_all('tr'))
 	return soup
 
-def main():
-	""" import benchling entry to labii entry """
-	# collect the settings
-	settings = collect_labii_settings()
-	settings["folder_path"] = input("Provide the full path of folder that contains the files to be uploaed. ")
-	debug = True
-	if debug:
-		settings["labii_base_url"] = "http://127.0.0.1:8000"
-		settings["labii_organization_sid"] = "TWZ30a40x24bcV16afkpu"
-		settings["labii_project_sid"] = "HKNQ0a40x271cJOTY49di"
-		settings["labii_table_entry_sid"] = "69be0a40xfff68chmrwBG"
-		settings["labii_table_file_sid"] = "58ad0a40xfff57bglqvAF"
-		settings["folder_path"] = "xxx"
-	settings["folder_path"] = settings["folder_path"].rstrip("/")
-	settings["folder_path_escape"] = shlex.quote(settings["folder_path"])
-	print(settings)
-	settings["confirm"] = input("Enter to confirm the provide settings is correct. ")
-	# init the labii sdk
-	labii = LabiiObject(
-		base_url=settings["labii_base_url"],
-		organization__sid=settings["labii_organization_sid"]
-	)
-	labii.api.login()
-	# collect the files
-	files = glob.glob(f"{settings['folder_path']}/*.html")
-	# create a migrated folder
-	if not os.path.isdir(f"{settings['folder_path']}/migrated/"):
-		os.system(f"mkdir -p {settings['folder_path_escape']}/migrated/")
-	# process the files
+def migrate_entries_in_pipeline(labii, files, settings, journal, args, writer=None):
+	"""
+		migrate the entries in a Pipeline: read (the bytes of the entry) -> transform (parse and transform) -> upload (its files) -> create (its entry, recorded in the journal)
+		- args, --read-workers, --upload-workers, --create-workers and --queue-size, see add_pipeline_arguments, --processes, the entries are transformed in a pool of this number of processes if more than 1, --parser, --stream-threshold in MB and --delta
+		- the entries larger than the stream threshold are not read ahead, they are streamed from the file by the transform stage
+		- writer, a BatchWriter of the entries
+		The entries are not created in the order of the files. The utilization of each stage is printed at the end.
+	"""
+	stream_threshold = int(args.stream_threshold * 1024 * 1024)
+	entries = [current_file for current_file in files if not "/migrated" in current_file and "etr_" in current_file]
+	if args.delta:
+		for current_file in entries:
+			journal.changed(os.path.abspath(current_file), current_file)
+	entries = [current_file for current_file in entries if not journal.is_done(os.path.abspath(current_file))]
+	print(f"Skipped {len(files) - len(entries)} files, already migrated or not an entry")
+	executor = ProcessPoolExecutor(max_workers=args.processes) if args.processes > 1 else None
+	transform = functools.partial(prepare_entry_or_error, measure=metrics.enabled, parser=args.parser, stream_threshold=stream_threshold)
+	def read_stage(item):
+		with metrics.timer("read"):
+			if os.path.getsize(item["path"]) <= stream_threshold:
+				with open(item["path"], "rb") as file:
+					item["content"] = file.read()
+		return item
+	def transform_stage(item):
+		content = item.pop("content", None)
+		if executor is not None:
+			prepared, error, stage_seconds = executor.submit(transform, item["path"], content=content).result()
+		else:
+			prepared, error, stage_seconds = transform(item["path"], content=content)
+		if stage_seconds is not None:
+			metrics.observe_all(stage_seconds)
+		if prepared is None:
+			journal.record_error(item["journal_key"], error)
+			print(error)
+			return None
+		item["body_html"], item["pending_files"], sha256 = prepared
+		if journal.get(item["journal_key"], "hash") is None:
+			journal.record(item["journal_key"], "hash", sha256)
+		return item
+	def upload_stage(item):
+		with metrics.timer("upload_files"):
+			item["body_html"] = resolve_pending_files(labii, item["body_html"], item.pop("pending_files"), settings, journal=journal, journal_key=item["journal_key"])
+		return item
+	def create_stage(item):
+		create_benchling_entry(labii, item["path"], item.pop("body_html"), settings, journal=journal, writer=writer)
+		return item
+	def failed(item, stage, error):
+		# the entry is retried by the next run, the files already uploaded are skipped
+		journal.record_error(item["journal_key"], f"Error: {stage}: {error}")
+		print(f"{os.path.basename(item['path'])}: Error: {stage}: {error}")
+	pipeline = Pipeline([
+		Stage("read", read_stage, args.read_workers),
+		Stage("transform", transform_stage, max(1, args.processes)),
+		Stage("upload", upload_stage, args.upload_workers),
+		Stage("create", create_stage, args.create_workers)
+	], queue_size=args.queue_size)
+	try:
+		pipeline.run(({"path": current_file, "journal_key": os.path.abspath(current_file)} for current_file in entries), on_error=failed)
+	finally:
+		if executor is not None:
+			executor.shutdown(wait=True)
+	print(pipeline.report())
+
+def parse_arguments(argv=None):
+	""" return the command line arguments, of argv if provided """
+	parser = argparse.ArgumentParser(description="Import Benchling entries as Labii entries.")
+	parser.add_argument("--parser", choices=PARSERS, default=DEFAULT_PARSER, help=f"the parser of the entries, default {DEFAULT_PARSER}, lxml is faster")
+	parser.add_argument("--stream-threshold", type=float, default=50, help="the entries larger than this size in MB are transformed in a stream instead of a full soup, default 50")
+	parser.add_argument("--check-parsers", action="store_true", help="check that all parsers and the stream give the same entries, without uploading, then exit")
+	parser.add_argument("--delta", action="store_true", help="only migrate the entries new or changed since the last run, the labii entries of the changed entries are updated")
+	parser.add_argument("--processes", type=int, default=1, help="number of processes to parse and transform the entries, the files are uploaded and the entries created by the main process, default 1")
+	parser.add_argument("--plan", default=None, help="migrate the entries of the plan written by migration_plan.py benchling, in its order, instead of listing the folder")
+	add_common_arguments(parser)
+	add_pipeline_arguments(parser)
+	return parser.parse_args(argv)
+
+def run_job(labii, settings, journal, args):
+	"""
+		migrate each benchling entry (etr_*.html) of settings["folder_path"] as a labii entry
+		- args, the arguments of parse_arguments, for example --processes, --parser and --delta
+		- the entries of --plan are migrated instead, in its order, the entries with a missing file are recorded as errors first
+		- used by main and by the jobs of migration_runner, with a labii object already logged in
+	"""
+	if args.plan:
+		files = [entry["path"] for entry in ready_entries(load_plan(args.plan, "benchling"), journal)]
+	else:
+		files = glob.glob(f"{settings['folder_path']}/*.html")
+	stream_threshold = int(args.stream_threshold * 1024 * 1024)
+	writer = open_batch_writer(labii.Record, "create", args, query=f"table__sid={settings['labii_table_entry_sid']}")
+	# process the files, the migrated files are recorded in the journal
+	if args.pipeline:
+		migrate_entries_in_pipeline(labii, files, settings, journal, args, writer=writer)
+		files = []
+	elif args.processes > 1:
+		migrate_entries_in_processes(labii, files, settings, args.processes, journal, parser=args.parser, stream_threshold=stream_threshold, writer=writer, delta=args.delta)
+		files = []
 	index = 1
 	for current_file in files:
 		print(f"{index}/{len(files)}...")
 		index += 1
 		if not "/migrated" in current_file and "etr_" in current_file:
 			file_name = os.path.basename(current_file)
+			journal_key = os.path.abspath(current_file)
+			if args.delta:
+				journal.changed(journal_key, current_file)
+			if journal.is_done(journal_key):
+				print(f"Skipped {file_name}, already migrated")
+				continue
 			print(f"Processing {file_name}...")
-			# read the content
-			with open(current_file, 'r', encoding='utf-8') as file:
-				html_content = file.read()
-			soup = BeautifulSoup(html_content, 'html.parser')
-			# update the date
-			soup = update_day_separator(soup)
-			# update the text
-			soup = update_text_item(soup)
-			# update the code
-			soup = update_code_item(soup)
-			# update the file
-			soup = update_file(soup, labii, current_file, settings)
-			# update the td content
-			soup = update_td_content(soup)
-			# rm the style tag
-			soup = remove_style_tags(soup)
-			# rm table wrappers
-			soup = remove_table_wrapper_div(soup)
-			# rm the empty table row
-			soup = remove_empty_table_tr(soup)
-			# create entry
-			body_tag = soup.find('body')
-			body_html = str(body_tag)
-			entry_name = os.path.splitext(file_name)[0]
-			# create entry
-			response = labii.Record.create(
-				{
-					"name": entry_name,
-					"projects": [{"sid": settings["labii_project_sid"]}],
-					"data": body_html
-				},
-				query=f"table__sid={settings['labii_table_entry_sid']}"
-			)
-			if "uid" in response:
-				print(f"{response['uid']}: {response['name']}")
-			else:
-				print(response)
-			current_file_escape = shlex.quote(current_file).replace(".html", "")
-			os.system(f'mv {current_file_escape}* {settings["folder_path"]}/migrated/')
+			journal.ensure_hash(journal_key, current_file)
+			# update the date, text, code, file, td content and remove style, table wrappers and empty rows
+			with profiler.profile(current_file), metrics.timer("item"):
+				context = entry_context(labii, current_file, settings, journal=journal)
+				try:
+					body_html = read_entry(current_file, context, args.parser, stream_threshold)
+				except (FileNotFoundError, RuntimeError) as error:
+					# the entry is retried by the next run, the files already uploaded are skipped
+					journal.record_error(journal_key, error)
+					print(error)
+					continue
+				finally:
+					metrics.observe_all(context.get("stage_seconds", {}))
+				# create entry
+				create_benchling_entry(labii, current_file, body_html, settings, journal=journal, writer=writer)
+	close_batch_writer(writer, journal)
+
+def main(argv=None):
+	""" import benchling entry to labii entry """
+	args = parse_arguments(argv)
+	open_metrics(args)
+	# collect the settings
+	settings = collect_labii_settings()
+	if args.plan:
+		settings["folder_path"] = load_plan(args.plan, "benchling")["folder"]
+	else:
+		settings["folder_path"] = input("Provide the full path of folder that contains the files to be uploaed. ")
+		settings["folder_path"] = settings["folder_path"].rstrip("/")
+	print(settings)
+	settings["confirm"] = input("Enter to confirm the provide settings is correct. ")
+	if args.check_parsers:
+		files = glob.glob(f"{settings['folder_path']}/*.html")
+		entries = [current_file for current_file in files if not "/migrated" in current_file and "etr_" in current_file]
+		differences = check_parser_conformance(entries)
+		for current_file, parser in differences:
+			print(f"Different: {os.path.basename(current_file)} ({parser})")
+		print(f"Checked {len(entries)} entries, {len(differences)} differences")
+		return
+	# init the labii sdk
+	client = open_client(args)
+	labii = open_labii(settings, client)
+	labii.api.login()
+	labii, cache = open_upload_cache(labii, args)
+	journal = MigrationJournal(args.journal)
+	run_job(labii, settings, journal, args)
+	journal.report_errors()
+	journal.close()
+	print(client.report())
+	close_metrics(args)
+	if cache is not None:
+		print(cache.report())
+		cache.close()
 
 if __name__ == "__main__":
 	main()
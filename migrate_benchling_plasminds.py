@@ -3,143 +3,248 @@ The "migrate_file_as_entry.py" function is a versatile data import utility desig
 """
 import os
 import shutil
-import glob
-from labii_sdk.sdk import LabiiObject
-from migrate_file_as_entry import collect_labii_settings
+import functools
+import argparse
+import requests
+from migration_journal import MigrationJournal
+from file_index import FileNameIndex
+from directory_scan import scan_tree
+from labii_records import iterate_records, CellIndex, SectionIndex
+from upload_cache import UploadCache, CachedLabiiObject
+from labii_batch import BatchWriter, is_success
+from labii_client import AdaptiveClient
+from labii_upload import ChunkedUploadLabiiObject
+from migration_metrics import metrics, profiler
+from migrate_file_as_entry import collect_labii_settings, request_error, add_common_arguments, open_batch_writer, close_batch_writer, open_client, open_labii, open_metrics, close_metrics
 
-def copy_gb_files(source_folder, destination_folder):
-	""" Utilize this function to gather all *.gb files within a designated folder, enabling their utilization by the "upload_gb_as_file_based_on_benchling_link" function. """
+def copy_gb_files(source_folder, destination_folder=None, mode="copy", workers=8):
+	"""
+		Utilize this function to gather all *.gb files within a designated folder, enabling their utilization by the "upload_gb_as_file_based_on_benchling_link" function. Return the FileNameIndex of the gathered files.
+		- mode, "copy" the files, "hardlink" them without copying their content (copied if the folders are on different devices), or "index" the files where they are without a destination folder
+		- the subfolders are scanned in a pool of workers threads, the files are gathered while the scan goes on
+	"""
+	if not mode in ("copy", "hardlink", "index"):
+		raise ValueError(f"Error: unknown mode {mode}!")
+	if mode == "index":
+		return FileNameIndex(source_folder, ".gb", recursive=True, workers=workers)
 	# Create the destination folder if it doesn't exist
 	if not os.path.exists(destination_folder):
 		os.makedirs(destination_folder)
-	# Walk through the source folder and its subfolders
-	for root, _, files in os.walk(source_folder):
-		for file in files:
-			if file.endswith(".gb"):
-				source_path = os.path.join(root, file)
-				destination_path = os.path.join(destination_folder, file)
-				shutil.copy2(source_path, destination_path)
-				print(f"Copied {source_path} to {destination_path}")
-
-def upload_gb_as_file_based_on_benchling_link():
-	""" Utilize this function for the purpose of uploading the *gb files that have been exported from Benchling onto your Labii plasmid record as a file. To enable its functionality, it is essential to possess a Benchling link column containing a text widget, along with a files section equipped with the Files widget. """
+	for entry in scan_tree(source_folder, ".gb", workers=workers):
+		destination_path = os.path.join(destination_folder, entry.name)
+		if mode == "hardlink":
+			try:
+				if os.path.exists(destination_path):
+					os.remove(destination_path)
+				os.link(entry.path, destination_path)
+				print(f"Linked {entry.path} to {destination_path}")
+				continue
+			except OSError:
+				pass
+		shutil.copy2(entry.path, destination_path)
+		print(f"Copied {entry.path} to {destination_path}")
+	return FileNameIndex(destination_folder, ".gb")
+
+def record_plasmid_done(journal, journal_key, plasmid, response):
+	""" record the plasmid as migrated if the files section is modified, else record the response as the error of the plasmid """
+	if journal is None:
+		return
+	if is_success(response):
+		journal.record(journal_key, "entry", {"sid": plasmid["sid"], "uid": plasmid["uid"], "name": plasmid["name"]})
+	else:
+		journal.record_error(journal_key, response)
+
+def plasmid_files_modified(journal, plasmid, log, message, journal_key, response):
+	""" callback of the BatchWriter of the files sections, record the plasmid and print the log once its files section is modified """
+	record_plasmid_done(journal, journal_key, plasmid, response)
+	if is_success(response):
+		print(f"{log} {message}")
+	else:
+		print(f"{log} FAILED: files section not modified ({response})")
+
+def modify_files_section(labii, writer, journal, journal_key, plasmid, section, file_record, log, message):
+	"""
+		set the file of the files section of the plasmid, return the log to print
+		- writer, a BatchWriter of the sections, the section is modified with its batch and the log is printed then, None is returned
+	"""
+	data = {"data": [{'file': {'sid': file_record["sid"], 'name': f'{file_record["uid"]}: {file_record["name"]}'}, 'should_hide_preview': False, 'should_hide_column_data': True}]}
+	if writer is not None:
+		writer.add(journal_key, data, sid=section["sid"], callback=functools.partial(plasmid_files_modified, journal, plasmid, log, message))
+		return None
+	with metrics.timer("modify"):
+		try:
+			response = labii.Section.modify(
+				section["sid"],
+				data
+			)
+		except requests.exceptions.RequestException as error:
+			response = request_error(error)
+	record_plasmid_done(journal, journal_key, plasmid, response)
+	if not is_success(response):
+		return f"{log} FAILED: files section not modified ({response})"
+	return f"{log} {message}"
+
+def upload_gb_file(labii, journal, journal_key, file_path, workspaces):
+	""" upload the *.gb file, skip the upload if it is in the journal, return the file record or the response of the failed upload """
+	try:
+		if journal is None:
+			file_record = labii.upload(file_path, workspaces)
+		else:
+			file_record = journal.upload(labii, journal_key, file_path, workspaces)
+	except requests.exceptions.RequestException as error:
+		file_record = request_error(error)
+	if not is_success(file_record) and journal is not None:
+		journal.record_error(journal_key, file_record)
+	return file_record
+
+def find_gb_key_by_name(plasmid, settings):#pylint: disable=unused-argument
+	""" return (key, error) to find the *.gb file of the plasmid, the key is the name of the plasmid """
+	return plasmid["name"], None
+
+# the position of the benchling link column is found once per table
+benchling_cells = CellIndex()
+
+def find_gb_key_by_benchling_link(plasmid, settings):
+	""" return (key, error) to find the *.gb file of the plasmid, the key is the seq id of the benchling link column, None with the error if not found """
+	cell_benchling = benchling_cells.find(plasmid, settings["labii_column_benchling_sid"])
+	if cell_benchling is None:
+		return None, f"FAILED: not found benchling column ({settings['labii_column_benchling_sid']})"
+	if not "benchling" in cell_benchling["data"]:# if the cell have the data
+		return None, "FAILED: not benchling link available"
+	seqid = cell_benchling["data"].split("seq_")[1].split("-")[0]
+	return f"seq_{seqid}", None
+
+def migrate_plasmids(labii, plasmids, gb_index, find_gb_key, settings, skip=(), journal=None, writer=None):
+	"""
+		upload the *.gb file of each plasmid and set it in the files section of the plasmid
+		- plasmids, the detail records of the plasmids, for example the stream of iterate_records
+		- find_gb_key(plasmid, settings), return (key, error), the key of the *.gb file of the plasmid in gb_index (FileNameIndex)
+		- skip, the uids of the plasmids not migrated
+		- the plasmids recorded in the journal are skipped, the files sections are modified with writer (BatchWriter) if provided
+	"""
+	# check each plasmid, the position of the files section is found once per table
+	files_section = SectionIndex("Files")
+	for plasmid in plasmids:
+		with profiler.profile(plasmid['uid']), metrics.timer("item"):
+			journal_key = f"plasmid:{plasmid['sid']}"
+			if journal is not None and journal.is_done(journal_key):
+				print(f"{plasmid['uid']}: {plasmid['name']} SKIPPED: already migrated")
+			elif not plasmid['uid'] in skip:
+				log = f"{plasmid['uid']}: {plasmid['name']}"
+				key, error = find_gb_key(plasmid, settings)
+				if key is None:
+					log = f"{log} {error}"
+				else:
+					gb_file, files = gb_index.resolve(key)
+					if gb_file is not None:
+						file_record = upload_gb_file(labii, journal, journal_key, gb_file, plasmid["projects"])
+						# find the files section
+						section = files_section.find(plasmid)
+						if not is_success(file_record):
+							log = f"{log} FAILED: not uploaded the *.gb file ({key}): {file_record}"
+						elif section is not None:
+							log = modify_files_section(labii, writer, journal, journal_key, plasmid, section, file_record, log, f"SUCCESS: uploaded {key}")
+					elif len(files) > 1:
+						log = f"{log} FAILED: ambiguous *.gb files ({key}): {', '.join(os.path.basename(file) for file in files)}"
+					else:
+						log = f"{log} FAILED: not found the *.gb file ({key})"
+				if log is not None:
+					print(log)
+
+GB_KEY_FINDERS = {"name": find_gb_key_by_name, "benchling_link": find_gb_key_by_benchling_link}
+
+def upload_gb_files_to_plasmids(labii, settings, journal=None, writer=None, match="name", skip=()):
+	"""
+		index the *.gb files of settings["folder_path_gb"] once, and upload the file of each plasmid of the table settings["labii_table_plasmid_sid"] to its files section
+		- match, how the *.gb file of a plasmid is found, "name" or "benchling_link" (the seq id of the settings["labii_column_benchling_sid"] column), see GB_KEY_FINDERS
+	"""
+	gb_index = FileNameIndex(settings["folder_path_gb"], ".gb")
+	print(f"Indexed {len(gb_index)} *.gb files")
+	# find all plasmids, the pages are fetched while the plasmids are processed
+	plasmids = iterate_records(
+		labii.Record,
+		serializer="detail",
+		query=f"table__sid={settings['labii_table_plasmid_sid']}"
+	)
+	migrate_plasmids(labii, plasmids, gb_index, GB_KEY_FINDERS[match], settings, skip=skip, journal=journal, writer=writer)
+
+def run_job(labii, settings, journal, args):
+	"""
+		upload the *.gb files to the plasmids, with the --match, --skip and batch arguments of parse_arguments
+		- used by the jobs of migration_runner, with a labii object already logged in
+	"""
+	writer = open_batch_writer(labii.Section, "modify", args)
+	upload_gb_files_to_plasmids(labii, settings, journal=journal, writer=writer, match=args.match, skip=args.skip or ())
+	close_batch_writer(writer, journal)
+
+def upload_gb_as_file_based_on_benchling_link(journal=None, upload_cache=None, batch_size=1, batch_delay=2.0, bulk=None, client=None, skip=None):
+	""" Utilize this function for the purpose of uploading the *gb files that have been exported from Benchling onto your Labii plasmid record as a file. To enable its functionality, it is essential to possess a Benchling link column containing a text widget, along with a files section equipped with the Files widget. The plasmids recorded in the journal (MigrationJournal) are skipped, and the files with the same content as a previous upload are reused from the upload_cache (UploadCache). The files sections are modified in batches of batch_size (BatchWriter) if batch_size > 1. The api requests are sent through the client (AdaptiveClient). The plasmids with their uid in skip are not migrated. """
 	settings = collect_labii_settings(skip=["labii_project_sid", "labii_table_entry_sid"])
 	settings["labii_table_plasmid_sid"] = input("What is your Labii plasmid table sid (Settings -> Tables -> Plasmid -> SID)? ")
 	settings["labii_column_benchling_sid"] = input("What is your Labii column benchling link sid (Settings -> Tables -> Plasmid -> Columns -> Benchling Link -> SID)? ")
 	settings["folder_path_gb"] = input("Provide the full path of folder that contains the *.gb files to be uploaed. ")
-	debug = True
-	if debug:
-		settings["labii_base_url"] = "http://127.0.0.1:8000"
-		settings["labii_organization_sid"] = "TWZ30a40x24bcV16afkpu"
-		settings["labii_project_sid"] = "HKNQ0a40x271cJOTY49di"
-		settings["labii_table_entry_sid"] = "69be0a40xfff68chmrwBG"
-		settings["labii_table_file_sid"] = "58ad0a40xfff57bglqvAF"
-		settings["folder_path"] = "xxx"
 	settings["folder_path_gb"] = settings["folder_path_gb"].rstrip("/")
 	print(settings)
 	settings["confirm"] = input("Enter to confirm the provide settings is correct. ")
 	# init the labii sdk
-	labii = LabiiObject(
-		base_url=settings["labii_base_url"],
-		organization__sid=settings["labii_organization_sid"]
-	)
+	labii = open_labii(settings, client if client is not None else AdaptiveClient())
 	labii.api.login()
-	# find all plasmids
-	plasmids = labii.Record.list(
-		all_pages=False,
-		serializer="detail",
-		query=f"table__sid={settings['labii_table_plasmid_sid']}"
-	)
-	# check each plasmid
-	should_break = False
-	for plasmid in plasmids["results"]:
-		if not plasmid['uid'] in ["PM1", "PM152", "PM150", "PM151"]:
-			cell_benchling = ""
-			log = f"{plasmid['uid']}: {plasmid['name']}"
-			for cell in plasmid["column_set"]:
-				if cell["column"]["sid"] == settings["labii_column_benchling_sid"]:
-					cell_benchling = cell.copy()
-					break
-			if cell_benchling != "":
-				if "benchling" in cell_benchling["data"]:# if the cell have the data
-					seqid = cell_benchling["data"].split("seq_")[1].split("-")[0]
-					seqid = f"seq_{seqid}"
-					files = glob.glob(f"{settings['folder_path_gb']}/*{seqid}*.gb")
-					if len(files) > 0:
-						file_record = labii.upload(files[0], plasmid["projects"])
-						# find the files section
-						for section in plasmid["section_set"]:
-							if section["name"] == "Files":
-								data = {"data": [{'file': {'sid': file_record["sid"], 'name': f'{file_record["uid"]}: {file_record["name"]}'}, 'should_hide_preview': False, 'should_hide_column_data': True}]}
-								labii.Section.modify(
-									section["sid"],
-									data
-								)
-								log = f"{log} SUCCESS: uploaded {seqid}"
-								should_break = True
-								break
-					else:
-						log = f"{log} FAILED: not found the *.gb file ({seqid})"
-				else:
-					log = f"{log} FAILED: not benchling link available"
-			else:
-				log = f"{log} FAILED: not found benchling column ({settings['labii_column_benchling_sid']})"
-			print(log)
+	labii = ChunkedUploadLabiiObject(labii)
+	if upload_cache is not None:
+		labii = CachedLabiiObject(labii, upload_cache)
+	writer = None if batch_size <= 1 else BatchWriter(labii.Section, "modify", batch_size=batch_size, max_delay=batch_delay, bulk=bulk)
+	upload_gb_files_to_plasmids(labii, settings, journal=journal, writer=writer, match="benchling_link", skip=skip if skip is not None else ["PM1", "PM152", "PM150", "PM151"])
+	close_batch_writer(writer, journal)
 
-def upload_gb_as_file_based_on_name():
-	""" Utilize this function for the purpose of uploading the *gb files that have been exported from Benchling onto your Labii plasmid record as a file. """
+def upload_gb_as_file_based_on_name(journal=None, upload_cache=None, batch_size=1, batch_delay=2.0, bulk=None, client=None, skip=None):
+	""" Utilize this function for the purpose of uploading the *gb files that have been exported from Benchling onto your Labii plasmid record as a file. The plasmids recorded in the journal (MigrationJournal) are skipped, and the files with the same content as a previous upload are reused from the upload_cache (UploadCache). The files sections are modified in batches of batch_size (BatchWriter) if batch_size > 1. The api requests are sent through the client (AdaptiveClient). The plasmids with their uid in skip are not migrated. """
 	settings = collect_labii_settings(skip=["labii_project_sid", "labii_table_entry_sid"])
 	settings["labii_table_plasmid_sid"] = input("What is your Labii plasmid table sid (Settings -> Tables -> Plasmid -> SID)? ")
 	settings["folder_path_gb"] = input("Provide the full path of folder that contains the *.gb files to be uploaed. ")
-	debug = True
-	if debug:
-		settings["labii_base_url"] = "http://127.0.0.1:8000"
-		settings["labii_organization_sid"] = "TWZ30a40x24bcV16afkpu"
-		settings["labii_project_sid"] = "HKNQ0a40x271cJOTY49di"
-		settings["labii_table_entry_sid"] = "69be0a40xfff68chmrwBG"
-		settings["labii_table_file_sid"] = "58ad0a40xfff57bglqvAF"
-		settings["folder_path"] = "xxx"
 	settings["folder_path_gb"] = settings["folder_path_gb"].rstrip("/")
 	print(settings)
 	settings["confirm"] = input("Enter to confirm the provide settings is correct. ")
 	# init the labii sdk
-	labii = LabiiObject(
-		base_url=settings["labii_base_url"],
-		organization__sid=settings["labii_organization_sid"]
-	)
+	labii = open_labii(settings, client if client is not None else AdaptiveClient())
 	labii.api.login()
-	# find all plasmids
-	plasmids = labii.Record.list(
-		all_pages=True,
-		serializer="detail",
-		query=f"table__sid={settings['labii_table_plasmid_sid']}"
-	)
-	# check each plasmid
-	should_break = False
-	for plasmid in plasmids["results"]:
-		if not plasmid['uid'] in ["PM141", "PM142", "PM143", "PM146", "PM147", "PM148", "PM150", "PM1", "PM144", "PM149", "PM145"]:
-			log = f"{plasmid['uid']}: {plasmid['name']}"
-			files = glob.glob(f"{settings['folder_path_gb']}/*{plasmid['name']}*.gb")
-			if len(files) > 0:
-				file_record = labii.upload(files[0], plasmid["projects"])
-				# find the files section
-				for section in plasmid["section_set"]:
-					if section["name"] == "Files":
-						data = {"data": [{'file': {'sid': file_record["sid"], 'name': f'{file_record["uid"]}: {file_record["name"]}'}, 'should_hide_preview': False, 'should_hide_column_data': True}]}
-						labii.Section.modify(
-							section["sid"],
-							data
-						)
-						log = f"{log} SUCCESS: uploaded {plasmid['name']}"
-						should_break = True
-						break
-			else:
-				log = f"{log} FAILED: not found the *.gb file ({plasmid['name']})"
-			print(log)
-
-def main():
+	labii = ChunkedUploadLabiiObject(labii)
+	if upload_cache is not None:
+		labii = CachedLabiiObject(labii, upload_cache)
+	writer = None if batch_size <= 1 else BatchWriter(labii.Section, "modify", batch_size=batch_size, max_delay=batch_delay, bulk=bulk)
+	upload_gb_files_to_plasmids(labii, settings, journal=journal, writer=writer, match="name", skip=skip if skip is not None else ["PM141", "PM142", "PM143", "PM146", "PM147", "PM148", "PM150", "PM1", "PM144", "PM149", "PM145"])
+	close_batch_writer(writer, journal)
+
+def parse_arguments(argv=None):
+	""" return the command line arguments, of argv if provided """
+	parser = argparse.ArgumentParser(description="Upload the *.gb files exported from Benchling to the Labii plasmids.")
+	parser.add_argument("--match", choices=list(GB_KEY_FINDERS), default="name", help="find the *.gb file of a plasmid by its name, or by the seq id of its benchling link column, default name")
+	parser.add_argument("--skip", nargs="*", default=None, help="the uids of the plasmids not migrated")
+	add_common_arguments(parser)
+	return parser.parse_args(argv)
+
+def main(argv=None):
 	""" Depending on the configuration of your Labii plasmid table, the methods for migrating your *gb files will vary. You have the flexibility to select or adapt the functions according to your specific requirements. """
-	upload_gb_as_file_based_on_name()
+	args = parse_arguments(argv)
+	open_metrics(args)
+	upload_cache = None if args.no_upload_cache else UploadCache(args.upload_cache)
+	client = open_client(args)
+	with MigrationJournal(args.journal) as journal:
+		upload = upload_gb_as_file_based_on_benchling_link if args.match == "benchling_link" else upload_gb_as_file_based_on_name
+		upload(
+			journal=journal,
+			upload_cache=upload_cache,
+			batch_size=args.batch_size,
+			batch_delay=args.batch_delay,
+			bulk=False if args.no_bulk else None,
+			client=client,
+			skip=args.skip
+		)
+		journal.report_errors()
+	print(client.report())
+	close_metrics(args)
+	if upload_cache is not None:
+		print(upload_cache.report())
+		upload_cache.close()
 
 
 if __name__ == "__main__":
@@ -1,56 +1,159 @@
 """
 The `migrate_excel_sheet_as_entry.py` function offers a powerful solution for seamlessly converting each sheet within a provided Excel file into individual experiment entries.
+openpyxl and pandas are imported by the code that reads the workbook, so that the script starts quickly.
 """
 import re
 import os
+import io
+import csv
 import datetime
-import pandas as pd
-from labii_sdk.sdk import LabiiObject
-from migrate_file_as_entry import collect_labii_settings, upload_file_as_labii_entry
+import argparse
+import requests
+from labii_upload import upload_fileobj
+from migration_journal import MigrationJournal
+from labii_batch import is_success
+from migration_metrics import metrics, profiler
+from migrate_file_as_entry import collect_labii_settings, upload_file_as_labii_entry, create_labii_entry, format_response, request_error, add_common_arguments, open_upload_cache, open_client, open_labii, open_metrics, close_metrics
 
-def main():
+def parse_arguments(argv=None):
+	""" return the command line arguments, of argv if provided """
+	parser = argparse.ArgumentParser(description="Import each sheet of an excel file as a Labii entry.")
+	parser.add_argument("--stream", action="store_true", help="stream the rows of each sheet into an in memory file instead of loading the sheet with pandas and writing it to disk (xlsx only)")
+	parser.add_argument("--sheet-format", choices=["xlsx", "csv"], default="xlsx", help="the format of the uploaded sheets with --stream, default xlsx")
+	add_common_arguments(parser)
+	return parser.parse_args(argv)
+
+def sheet_timestamp(sheet_name, file_path):
+	""" return the timestamp of the sheet, from a mmddyy date in the sheet name or the modified time of the file """
+	timestamps = re.findall(r'\d{6}', sheet_name)
+	if len(timestamps) > 0:
+		datetime_obj = datetime.datetime.strptime(timestamps[0], '%m%d%y')
+		return datetime_obj.timestamp()
+	return os.path.getmtime(file_path)
+
+def stream_sheet(worksheet, sheet_format="xlsx"):
+	"""
+		return an in memory file with the rows of the worksheet
+		- worksheet, a sheet of a workbook opened with read_only=True, the rows are read one at a time
+		- sheet_format, xlsx (written with a write only workbook) or csv
+	"""
+	import openpyxl#pylint: disable=import-outside-toplevel
+	buffer = io.BytesIO()
+	if sheet_format == "csv":
+		text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+		writer = csv.writer(text)
+		for row in worksheet.iter_rows(values_only=True):
+			writer.writerow(["" if value is None else value for value in row])
+		text.flush()
+		text.detach()
+	else:
+		workbook = openpyxl.Workbook(write_only=True)
+		sheet = workbook.create_sheet(worksheet.title)
+		for row in worksheet.iter_rows(values_only=True):
+			sheet.append(row)
+		workbook.save(buffer)
+	buffer.seek(0)
+	return buffer
+
+def upload_sheet_as_labii_entry(labii, worksheet, file_name, timestamp, settings, sheet_format="xlsx", journal=None, journal_key=None):
+	""" stream the worksheet into a file, upload it and create an entry, return the response of the entry """
+	print(f"Processing {file_name}...")
+	workspaces = [{"sid": settings["labii_project_sid"]}]
+	def upload():
+		with metrics.timer("stream_sheet"):
+			fileobj = stream_sheet(worksheet, sheet_format)
+		with metrics.timer("upload"):
+			try:
+				return upload_fileobj(labii, fileobj, file_name, workspaces)
+			except requests.exceptions.RequestException as error:
+				return request_error(error)
+	file_record = upload() if journal is None else journal.uploaded(journal_key, file_name, upload)
+	if not is_success(file_record):
+		error = f"Error: file not uploaded ({file_name}): {file_record}"
+		if journal is not None:
+			journal.record_error(journal_key, error)
+		print(error)
+		return error
+	try:
+		response = create_labii_entry(labii, os.path.splitext(file_name)[0], [file_record], timestamp, settings)
+	except requests.exceptions.RequestException as error:
+		response = request_error(error)
+	if journal is not None:
+		journal.record_entry(journal_key, response)
+	print(format_response(response))
+	return response
+
+def run_job(labii, settings, journal, args):
+	"""
+		migrate each sheet of the workbook settings["file_path"] as an entry
+		- args, the arguments of parse_arguments, for example --stream
+		- used by main and by the jobs of migration_runner, with a labii object already logged in
+	"""
+	if args.stream:
+		import openpyxl#pylint: disable=import-outside-toplevel
+		# stream each sheet into an in memory file
+		workbook = openpyxl.load_workbook(settings["file_path"], read_only=True, data_only=True)
+		index = 1
+		for sheet_name in workbook.sheetnames:
+			print(f"{index}/{len(workbook.sheetnames)}...")
+			index += 1
+			journal_key = f"{os.path.abspath(settings['file_path'])}#{sheet_name}"
+			if journal.is_done(journal_key):
+				print(f"Skipped {sheet_name}, already migrated")
+				continue
+			file_name = os.path.basename(settings["file_path"]).replace(".xlsx", f" - {sheet_name}.{args.sheet_format}")
+			timestamp = sheet_timestamp(sheet_name, settings["file_path"])
+			with profiler.profile(file_name), metrics.timer("item"):
+				upload_sheet_as_labii_entry(labii, workbook[sheet_name], file_name, timestamp, settings, sheet_format=args.sheet_format, journal=journal, journal_key=journal_key)
+		workbook.close()
+	else:
+		import pandas as pd#pylint: disable=import-outside-toplevel
+		# get excels
+		xls = pd.ExcelFile(settings["file_path"])
+		index = 1
+		for sheet_name in xls.sheet_names:
+			print(f"{index}/{len(xls.sheet_names)}...")
+			index += 1
+			journal_key = f"{os.path.abspath(settings['file_path'])}#{sheet_name}"
+			if journal.is_done(journal_key):
+				print(f"Skipped {sheet_name}, already migrated")
+				continue
+			with profiler.profile(sheet_name), metrics.timer("item"):
+				with metrics.timer("parse"):
+					sheet_df = xls.parse(sheet_name)
+				new_excel_file_path = settings["file_path"].replace(".xlsx", f" - {sheet_name}.xlsx")
+				with metrics.timer("write_sheet"):
+					sheet_df.to_excel(new_excel_file_path, index=False)
+				# time stamps
+				# use the modified time if no time stamp
+				timestamp = sheet_timestamp(sheet_name, settings["file_path"])
+				upload_file_as_labii_entry(labii, new_excel_file_path, settings, timestamp=timestamp, journal=journal, journal_key=journal_key)
+				# remove
+				os.remove(new_excel_file_path)
+
+def main(argv=None):
 	""" separate one excel file into multiple files based on sheet name """
+	args = parse_arguments(argv)
+	open_metrics(args)
 	# collect the settings
 	settings = collect_labii_settings()
 	settings["file_path"] = input("Provide the full path of the excel file. ")
-	debug = True
-	if debug:
-		settings["labii_base_url"] = "http://127.0.0.1:8000"
-		settings["labii_organization_sid"] = "TWZ30a40x24bcV16afkpu"
-		settings["labii_project_sid"] = "HKNQ0a40x271cJOTY49di"
-		settings["labii_table_entry_sid"] = "69be0a40xfff68chmrwBG"
-		settings["labii_table_file_sid"] = "58ad0a40xfff57bglqvAF"
-		settings["file_path"] = "xxx.xlsx"
 	print(settings)
 	settings["confirm"] = input("Enter to confirm the provide settings is correct. ")
 	# init the labii sdk
-	labii = LabiiObject(
-		base_url=settings["labii_base_url"],
-		organization__sid=settings["labii_organization_sid"]
-	)
+	client = open_client(args)
+	labii = open_labii(settings, client)
 	labii.api.login()
-	# get excels
-	xls = pd.ExcelFile(settings["file_path"])
-	index = 1
-	for sheet_name in xls.sheet_names:
-		print(f"{index}/{len(xls.sheet_names)}...")
-		index += 1
-		sheet_df = xls.parse(sheet_name)
-		new_excel_file_path = settings["file_path"].replace(".xlsx", f" - {sheet_name}.xlsx")
-		sheet_df.to_excel(new_excel_file_path, index=False)
-		# time stamps
-		# use the modified time if no time stamp
-		timestamps = re.findall(r'\d{6}', sheet_name)
-		timestamp = ""
-		if len(timestamps) > 0:
-			datetime_obj = datetime.datetime.strptime(timestamps[0], '%m%d%y')
-			timestamp = datetime_obj.timestamp()
-		else:
-			timestamp = os.path.getmtime(settings["file_path"])
-		upload_file_as_labii_entry(labii, new_excel_file_path, settings, timestamp=timestamp)
-		# remove
-		file_escape = new_excel_file_path.replace(' ', '\ ')#pylint: disable=anomalous-backslash-in-string
-		os.system(f"rm {file_escape}")
+	labii, cache = open_upload_cache(labii, args)
+	journal = MigrationJournal(args.journal)
+	run_job(labii, settings, journal, args)
+	journal.report_errors()
+	journal.close()
+	print(client.report())
+	close_metrics(args)
+	if cache is not None:
+		print(cache.report())
+		cache.close()
 
 if __name__ == "__main__":
 	main()
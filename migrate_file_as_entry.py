@@ -11,10 +11,22 @@ Support folder structure 2 (each folder -> one experiment entry):
 		...
 """
 import os
-import shlex
 import glob
 import datetime
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from labii_sdk.sdk import LabiiObject
+from migration_pool import ordered_map
+from migration_pipeline import Pipeline, Stage
+from directory_scan import scan_sources
+from migration_plan import load_plan, ready_entries, plan_sources
+from migration_metrics import metrics, profiler, DEFAULT_PROFILE_DIR
+from migration_journal import MigrationJournal, DEFAULT_JOURNAL_PATH
+from upload_cache import UploadCache, CachedLabiiObject, DEFAULT_UPLOAD_CACHE_PATH
+from labii_batch import BatchWriter, is_success
+from labii_upload import ChunkedUploadLabiiObject
+from labii_client import AdaptiveClient, AdaptiveAPIObject
 
 def collect_labii_settings(skip=[]):
 	""" return labii related settings """
@@ -30,84 +42,350 @@ def collect_labii_settings(skip=[]):
 	settings["labii_table_file_sid"] = input("What is your Labii file table sid (Settings -> Tables -> Entry -> SID)? ")
 	return settings
 
-def upload_file_as_labii_entry(labii, current_file, settings, timestamp=""):
-	""" upload file and create entry """
-	file_name = os.path.basename(current_file)
-	print(f"Processing {file_name}...")
-	# create a file record
-	file_records = []
-	if os.path.isdir(current_file):
-		attachments = glob.glob(f"{current_file}/*")
-		for attachment in attachments:
-			file_record = labii.upload(attachment, [{"sid": settings["labii_project_sid"]}])
-			file_records.append(file_record)
-		# get modified time
-		if timestamp == "":
-			timestamp = os.path.getmtime(attachments[0])
-	else:
-		file_record = labii.upload(current_file, [{"sid": settings["labii_project_sid"]}])
-		file_records.append(file_record)
-		# get modified time
-		if timestamp == "":
-			timestamp = os.path.getmtime(current_file)
+def request_error(error):
+	""" return the error of an item whose api request failed after its retries, the item is recorded as failed and the run goes on """
+	return f"Error: api request failed ({type(error).__name__}: {error})"
+
+def upload_attachments(labii, attachments, settings, executor=None, journal=None, journal_key=None):
+	""" upload the attachments, return the file records in the same order as the attachments, the error instead of the file record of an attachment not uploaded """
+	workspaces = [{"sid": settings["labii_project_sid"]}]
+	def upload(attachment):
+		try:
+			if journal is None:
+				return labii.upload(attachment, workspaces)
+			return journal.upload(labii, journal_key, attachment, workspaces)
+		except requests.exceptions.RequestException as error:
+			return request_error(error)
+	if executor is None:
+		return [upload(attachment) for attachment in attachments]
+	futures = [executor.submit(upload, attachment) for attachment in attachments]
+	return [future.result() for future in futures]
+
+def labii_entry_data(entry_name, file_records, timestamp, settings):
+	""" return the data of an entry with a day label of the timestamp and the files """
 	last_modified_time = datetime.datetime.fromtimestamp(timestamp)
 	formatted_time = last_modified_time.strftime("%A, %Y-%m-%d")
-	# create a entry
-	entry_name = os.path.splitext(file_name)[0]
 	data = f"""<div class="labii-day"><span class="labii-day-label">{formatted_time}</span></div>"""
 	for file_record in file_records:
 		data = f"""{data}<section class="labii-file" sid="{file_record['sid']}" name="{file_record['uid']}: {file_record['name']}" version="{file_record['version']['sid']}" should_hide_preview="false"></section>"""
 	data = f"{data}<p>&nbsp;</p>"
-	response = labii.Record.create(
-		{
-			"name": entry_name,
-			"projects": [{"sid": settings["labii_project_sid"]}],
-			"data": data
-		},
-		query=f"table__sid={settings['labii_table_entry_sid']}"
-	)
+	return {
+		"name": entry_name,
+		"projects": [{"sid": settings["labii_project_sid"]}],
+		"data": data
+	}
+
+def create_labii_entry(labii, entry_name, file_records, timestamp, settings, sid=None):
+	""" create an entry with a day label of the timestamp and the files, or update the entry sid, return the response """
+	data = labii_entry_data(entry_name, file_records, timestamp, settings)
+	if sid is not None:
+		with metrics.timer("modify"):
+			return labii.Record.modify(sid, data)
+	with metrics.timer("create"):
+		return labii.Record.create(data, query=f"table__sid={settings['labii_table_entry_sid']}")
+
+def upload_file_as_labii_entry(labii, current_file, settings, timestamp="", executor=None, verbose=True, journal=None, journal_key=None, writer=None, delta=False, source=None):
+	"""
+		upload file and create entry, return the response of the entry
+		- executor, upload the attachments in the thread pool if provided
+		- verbose, print the progress
+		- journal, a MigrationJournal to skip the entry if created and the attachments already uploaded
+		- journal_key, the key of the entry in the journal, default to the absolute path of current_file
+		- writer, a BatchWriter of the entries, the entry is created with its batch and the Future of the response is returned
+		- delta, skip the entry if its source did not change since it was created, and update the entry if it changed, see MigrationJournal.changed
+		- source, the SourceItem of current_file from scan_sources, its attachments and fingerprint are used instead of listing the folder and reading the stat again
+	"""
+	file_name = os.path.basename(current_file)
+	entry = None
+	if journal is not None:
+		if journal_key is None:
+			journal_key = os.path.abspath(current_file)
+		if delta:
+			journal.changed(journal_key, current_file, fingerprint=None if source is None else (source.mtime_ns, source.size))
+		if journal.is_done(journal_key):
+			if verbose:
+				print(f"Skipped {file_name}, already migrated")
+			return journal.get(journal_key, "entry")
+		journal.ensure_hash(journal_key, current_file)
+		# the entry of a changed source is updated
+		entry = journal.get(journal_key, "entry")
+	if verbose:
+		print(f"Processing {file_name}...")
+	# create a file record
+	if source is not None:
+		attachments = source.attachments
+	elif os.path.isdir(current_file):
+		attachments = glob.glob(f"{current_file}/*")
+	else:
+		attachments = [current_file]
+	file_records, error = upload_source_files(labii, current_file, attachments, settings, executor=executor, journal=journal, journal_key=journal_key)
+	if error is not None:
+		return error
+	return create_source_entry(labii, current_file, attachments, file_records, settings, timestamp=timestamp, entry=entry, journal=journal, journal_key=journal_key, writer=writer, verbose=verbose)
+
+def upload_source_files(labii, current_file, attachments, settings, executor=None, journal=None, journal_key=None):
+	""" upload the attachments of the source current_file, return (file records, None), or (None, error) if a file was not uploaded, the error is recorded in the journal """
+	file_records = upload_attachments(labii, attachments, settings, executor=executor, journal=journal, journal_key=journal_key)
+	failed = [os.path.basename(attachment) for attachment, file_record in zip(attachments, file_records) if not is_success(file_record)]
+	if len(failed) > 0:
+		# the entry is created by the next run, with the files already uploaded
+		error = f"Error: files not uploaded ({', '.join(failed)})"
+		if journal is not None:
+			journal.record_error(journal_key, error)
+		print(f"{os.path.basename(current_file)}: {error}")
+		return None, error
+	return file_records, None
+
+def create_source_entry(labii, current_file, attachments, file_records, settings, timestamp="", entry=None, journal=None, journal_key=None, writer=None, verbose=True):
+	"""
+		create the entry of the source current_file with its uploaded files, or update the entry already created for it, return the response
+		- entry, the entry of the source in the journal, updated instead of creating one
+		- writer, a BatchWriter of the entries, the entry is created with its batch and the Future of the response is returned
+	"""
+	# get modified time
+	if timestamp == "":
+		timestamp = os.path.getmtime(attachments[0])
+	entry_name = os.path.splitext(os.path.basename(current_file))[0]
+	if writer is not None and entry is None:
+		def created(source, response):
+			if journal is not None:
+				journal.record_entry(journal_key, response)
+			if verbose:
+				print(f"{os.path.basename(source)}: {format_response(response)}")
+		return writer.add(current_file, labii_entry_data(entry_name, file_records, timestamp, settings), callback=created)
+	try:
+		response = create_labii_entry(labii, entry_name, file_records, timestamp, settings, sid=None if entry is None else entry["sid"])
+	except requests.exceptions.RequestException as error:
+		response = request_error(error)
+	if journal is not None:
+		journal.record_entry(journal_key, response)
+	if verbose:
+		print(format_response(response))
+	return response
+
+def format_response(response):
+	""" return the log of a created entry """
 	if "uid" in response:
-		print(f"{response['uid']}: {response['name']}")
+		return f"{response['uid']}: {response['name']}"
+	return str(response)
+
+def add_common_arguments(parser):
+	""" add the command line arguments shared by the migration scripts """
+	parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH, help=f"the journal of the migration, default {DEFAULT_JOURNAL_PATH}")
+	parser.add_argument("--upload-cache", default=DEFAULT_UPLOAD_CACHE_PATH, help=f"the cache of the uploaded files, files with the same content are only uploaded once, default {DEFAULT_UPLOAD_CACHE_PATH}")
+	parser.add_argument("--no-upload-cache", action="store_true", help="upload every file, even if the same content was uploaded before")
+	parser.add_argument("--chunked-upload-threshold", type=float, default=256, help="the files larger than this size in MB are uploaded in chunks with bounded memory, default 256")
+	parser.add_argument("--chunk-size", type=float, default=8, help="the size in MB of the chunks of the large files, default 8")
+	parser.add_argument("--batch-size", type=int, default=1, help="number of entries created, or sections modified, per batch, default 1 to send each one on its own")
+	parser.add_argument("--batch-delay", type=float, default=2.0, help="seconds after which a batch is sent even if it is not full, default 2")
+	parser.add_argument("--no-bulk", action="store_true", help="send the batches as single requests, without trying the bulk endpoint")
+	parser.add_argument("--rate", type=float, default=0, help="maximum api requests per second sent to the Labii server, default 0 for no limit")
+	parser.add_argument("--max-concurrency", "--max-per-host", dest="max_concurrency", type=int, default=16, help="maximum concurrent api requests sent to the Labii server, the limit adapts below it to the latency and errors of the server, default 16")
+	parser.add_argument("--retries", type=int, default=5, help="number of times a throttled (429) or failed (5xx) api request is sent again, default 5")
+	parser.add_argument("--metrics", default=None, help="write the timings of each stage, bytes, retries and queue depths to this file at the end of the run, in the Prometheus text format if it ends with .prom, else JSON")
+	parser.add_argument("--profile-sample", type=float, default=0, help="part of the items profiled with cProfile and tracemalloc, for example 0.01, default 0")
+	parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR, help=f"the folder of the profiles, default {DEFAULT_PROFILE_DIR}")
+	return parser
+
+def add_pipeline_arguments(parser):
+	""" add the arguments of the staged pipeline to the parser """
+	parser.add_argument("--pipeline", action="store_true", help="migrate the items in stages connected by bounded queues, each stage with its own workers, instead of one item after another; the utilization of each stage is printed at the end to tune the workers")
+	parser.add_argument("--read-workers", type=int, default=2, help="number of threads reading and hashing the sources in the pipeline, default 2")
+	parser.add_argument("--upload-workers", type=int, default=8, help="number of threads uploading the files in the pipeline, default 8")
+	parser.add_argument("--create-workers", type=int, default=4, help="number of threads creating the entries in the pipeline, default 4")
+	parser.add_argument("--queue-size", type=int, default=16, help="the most items waiting before each stage of the pipeline, a stage waits when the next one is full, default 16")
+
+def open_client(args):
+	""" return the AdaptiveClient of the api requests for the --rate, --max-concurrency and --retries arguments """
+	return AdaptiveClient(rate=args.rate or None, max_concurrency=args.max_concurrency, retries=args.retries)
+
+def open_labii(settings, client):
+	""" return the LabiiObject of the settings, sending its api requests through the AdaptiveClient; with settings["labii_api_key"] no login is needed """
+	api = AdaptiveAPIObject(client, base_url=settings["labii_base_url"], organization__sid=settings["labii_organization_sid"], api_key=settings.get("labii_api_key"))
+	return LabiiObject(
+		base_url=settings["labii_base_url"],
+		organization__sid=settings["labii_organization_sid"],
+		api=api
+	)
+
+def open_metrics(args):
+	""" enable the metrics for --metrics and the profiler for --profile-sample """
+	metrics.enabled = args.metrics is not None
+	profiler.sample = args.profile_sample
+	profiler.folder = args.profile_dir
+
+def close_metrics(args):
+	""" print the timings of the stages and write the metrics to --metrics """
+	if args.metrics is not None:
+		print(metrics.report())
+		metrics.write(args.metrics)
+		print(f"Metrics written to {args.metrics}")
+	if profiler.profiled > 0:
+		print(f"{profiler.profiled} items profiled in {profiler.folder}")
+
+def open_batch_writer(resource, method, args, query=""):
+	""" return the BatchWriter of the resource for the --batch-size, --batch-delay and --no-bulk arguments, None if the items are not batched """
+	if args.batch_size <= 1:
+		return None
+	return BatchWriter(resource, method, query=query, batch_size=args.batch_size, max_delay=args.batch_delay, bulk=False if args.no_bulk else None)
+
+def close_batch_writer(writer, journal=None):
+	""" send the remaining items of the writer, print the summary and the items that failed, unless they are recorded in the journal """
+	if writer is None:
+		return
+	writer.close()
+	print(writer.report())
+	if journal is None:
+		for source, response in writer.errors:
+			print(f"Failed: {source}: {response}")
+
+def open_upload_cache(labii, args):
+	""" return (labii, cache), labii uploads the large files in chunks, and through the cache unless --no-upload-cache """
+	labii = ChunkedUploadLabiiObject(labii, threshold=args.chunked_upload_threshold * 1024 * 1024, chunk_size=int(args.chunk_size * 1024 * 1024))
+	if args.no_upload_cache:
+		return labii, None
+	cache = UploadCache(args.upload_cache)
+	return CachedLabiiObject(labii, cache), cache
+
+def parse_arguments(argv=None):
+	""" return the command line arguments, of argv if provided """
+	parser = argparse.ArgumentParser(description="Import each file or folder as a Labii entry.")
+	parser.add_argument("--workers", type=int, default=1, help="number of files to migrate at the same time, default 1")
+	parser.add_argument("--delta", action="store_true", help="only migrate the files new or changed since the last run, the entries of the changed files are updated")
+	parser.add_argument("--scan-workers", type=int, default=8, help="number of folders listed at the same time, the files are migrated while the folder is scanned, default 8")
+	parser.add_argument("--plan", default=None, help="migrate the files and folders of the plan written by migration_plan.py files, in its order, instead of scanning the folder")
+	add_common_arguments(parser)
+	add_pipeline_arguments(parser)
+	return parser.parse_args(argv)
+
+def pending_sources(sources, journal, skipped, delta=False):
+	"""
+		yield the sources not migrated yet, the number of sources already in the journal is counted in skipped[0]
+		- delta, the sources changed since their entry was created are yielded again, see MigrationJournal.changed
+	"""
+	for source in sources:
+		if "/migrated" in source.path:
+			continue
+		journal_key = os.path.abspath(source.path)
+		if delta:
+			journal.changed(journal_key, source.path, fingerprint=(source.mtime_ns, source.size))
+		if journal.is_done(journal_key):
+			skipped[0] += 1
+			continue
+		yield source
+
+def migrate_files_in_pool(labii, sources, settings, workers, journal, writer=None, delta=False):
+	"""
+		upload the files and create the entries with a pool of threads
+		- sources, the SourceItem of the files and folders, for example the stream of scan_sources, migrated while they are yielded
+		- the attachments of each entry keep their order
+		- the files already in the journal are skipped, the progress is reported in the order of sources
+		- writer, a BatchWriter of the entries, the entries are created with their batch and reported when their batch is sent
+		- delta, the files changed since their entry was created are migrated again and their entry updated
+	"""
+	skipped = [0]
+	with ThreadPoolExecutor(max_workers=workers) as upload_executor:
+		def migrate(source):
+			with profiler.profile(source.path), metrics.timer("item"):
+				return upload_file_as_labii_entry(labii, source.path, settings, executor=upload_executor, verbose=writer is not None, journal=journal, writer=writer, source=source)
+		index = 1
+		for source, response in ordered_map(migrate, pending_sources(sources, journal, skipped, delta), workers=workers):
+			if writer is None:
+				print(f"{index} {os.path.basename(source.path)}: {format_response(response)}")
+			index += 1
+	print(f"Skipped {skipped[0]} files, already migrated")
+
+def migrate_files_in_pipeline(labii, sources, settings, journal, args, writer=None):
+	"""
+		migrate the sources in a Pipeline: read (hash the source) -> upload (its attachments) -> create (its entry, recorded in the journal)
+		- sources, the SourceItem of the files and folders, for example the stream of scan_sources, the scan is the producer of the pipeline
+		- args, --read-workers, --upload-workers and --create-workers threads run each stage, at most --queue-size items wait before each stage, --delta
+		- writer, a BatchWriter of the entries
+		The entries are not created in the order of the sources. The utilization of each stage is printed at the end.
+	"""
+	skipped = [0]
+	def read(item):
+		with metrics.timer("read"):
+			journal.ensure_hash(item["journal_key"], item["path"])
+		# the entry of a changed source is updated
+		item["entry"] = journal.get(item["journal_key"], "entry")
+		return item
+	def upload(item):
+		with metrics.timer("upload_source"):
+			item["file_records"], error = upload_source_files(labii, item["path"], item["source"].attachments, settings, journal=journal, journal_key=item["journal_key"])
+		return None if error is not None else item
+	def create(item):
+		with metrics.timer("create_source"):
+			create_source_entry(labii, item["path"], item["source"].attachments, item.pop("file_records"), settings, entry=item["entry"], journal=journal, journal_key=item["journal_key"], writer=writer)
+		return item
+	def failed(item, stage, error):
+		journal.record_error(item["journal_key"], f"Error: {stage}: {error}")
+		print(f"{os.path.basename(item['path'])}: Error: {stage}: {error}")
+	pipeline = Pipeline([
+		Stage("read", read, args.read_workers),
+		Stage("upload", upload, args.upload_workers),
+		Stage("create", create, args.create_workers)
+	], queue_size=args.queue_size)
+	items = ({"path": source.path, "source": source, "journal_key": os.path.abspath(source.path)} for source in pending_sources(sources, journal, skipped, args.delta))
+	pipeline.run(items, on_error=failed)
+	print(f"Skipped {skipped[0]} files, already migrated")
+	print(pipeline.report())
+
+def run_job(labii, settings, journal, args):
+	"""
+		migrate each file and folder of settings["folder_path"] as an entry, the files are migrated while the folder is scanned
+		- args, the arguments of parse_arguments, for example --workers and --delta
+		- the sources of --plan are migrated instead, in its order, without scanning the folder
+		- used by main and by the jobs of migration_runner, with a labii object already logged in
+	"""
+	if args.plan:
+		sources = plan_sources(ready_entries(load_plan(args.plan, "files"), journal))
 	else:
-		print(response)
+		sources = scan_sources(settings["folder_path"], workers=args.scan_workers)
+	writer = open_batch_writer(labii.Record, "create", args, query=f"table__sid={settings['labii_table_entry_sid']}")
+	if args.pipeline:
+		labii.get_file_table()
+		migrate_files_in_pipeline(labii, sources, settings, journal, args, writer=writer)
+	elif args.workers > 1:
+		labii.get_file_table()
+		migrate_files_in_pool(labii, sources, settings, args.workers, journal, writer=writer, delta=args.delta)
+	else:
+		index = 1
+		for source in sources:
+			print(f"{index} {os.path.basename(source.path)}...")
+			index += 1
+			if not "/migrated" in source.path:
+				with profiler.profile(source.path), metrics.timer("item"):
+					upload_file_as_labii_entry(labii, source.path, settings, timestamp="", journal=journal, writer=writer, delta=args.delta, source=source)
+	close_batch_writer(writer, journal)
 
-def main():
+def main(argv=None):
 	""" import file or folder to labii entry """
+	args = parse_arguments(argv)
+	open_metrics(args)
 	# collect the settings
 	settings = collect_labii_settings()
-	settings["folder_path"] = input("Provide the full path of folder that contains the files to be uploaed. ")
-	debug = True
-	if debug:
-		settings["labii_base_url"] = "http://127.0.0.1:8000"
-		settings["labii_organization_sid"] = "TWZ30a40x24bcV16afkpu"
-		settings["labii_project_sid"] = "HKNQ0a40x271cJOTY49di"
-		settings["labii_table_entry_sid"] = "69be0a40xfff68chmrwBG"
-		settings["labii_table_file_sid"] = "58ad0a40xfff57bglqvAF"
-		settings["folder_path"] = "xxx/"
-	settings["folder_path"] = settings["folder_path"].rstrip("/")
-	settings["folder_path_escape"] = shlex.quote(settings["folder_path"])
+	if args.plan:
+		settings["folder_path"] = load_plan(args.plan, "files")["folder"]
+	else:
+		settings["folder_path"] = input("Provide the full path of folder that contains the files to be uploaed. ")
+		settings["folder_path"] = settings["folder_path"].rstrip("/")
 	print(settings)
 	settings["confirm"] = input("Enter to confirm the provide settings is correct. ")
-	# collect the files
-	files = glob.glob(f"{settings['folder_path']}/*")
 	# init the labii sdk
-	labii = LabiiObject(
-		base_url=settings["labii_base_url"],
-		organization__sid=settings["labii_organization_sid"]
-	)
+	client = open_client(args)
+	labii = open_labii(settings, client)
 	labii.api.login()
-	# create a migrated folder
-	if not os.path.isdir(f"{settings['folder_path']}/migrated/"):
-		os.system(f"mkdir -p {settings['folder_path_escape']}/migrated/")
-	# process the files
-	index = 1
-	for current_file in files:
-		print(f"{index}/{len(files)}...")
-		index += 1
-		if not "/migrated" in current_file:
-			upload_file_as_labii_entry(labii, current_file, settings, timestamp="")
-			current_file_escape = shlex.quote(current_file)
-			os.system(f"mv {current_file_escape} {settings['folder_path_escape']}/migrated/")
+	labii, cache = open_upload_cache(labii, args)
+	# process the files, the migrated files are recorded in the journal
+	with MigrationJournal(args.journal) as journal:
+		run_job(labii, settings, journal, args)
+		journal.report_errors()
+	print(client.report())
+	close_metrics(args)
+	if cache is not None:
+		print(cache.report())
+		cache.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
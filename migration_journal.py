@@ -0,0 +1,219 @@
+"""
+The `migration_journal.py` module keeps track of the migration progress in a local SQLite journal, instead of moving the migrated files into a "migrated" folder.
+Each step of a source item is appended to the journal as it completes: the content hash, each uploaded file record and the created entry. When a migration is restarted, the finished items are skipped and only the missing steps of the other items are retried.
+The journal also keeps a manifest of the fingerprints (mtime, size and content hash) of the migrated sources, so that a delta run only migrates the sources that are new or changed since their entry was created.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from directory_scan import folder_stat
+
+DEFAULT_JOURNAL_PATH = "labii_migration.sqlite"
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+	""" return the sha256 of the file, read in chunks """
+	sha256 = hashlib.sha256()
+	with open(file_path, "rb") as file:
+		for chunk in iter(lambda: file.read(chunk_size), b""):
+			sha256.update(chunk)
+	return sha256.hexdigest()
+
+def path_sha256(path):
+	""" return the sha256 of a file, or of the names and content of the files of a folder """
+	if not os.path.isdir(path):
+		return file_sha256(path)
+	sha256 = hashlib.sha256()
+	for name in sorted(os.listdir(path)):
+		child = os.path.join(path, name)
+		sha256.update(name.encode("utf-8"))
+		sha256.update(path_sha256(child).encode("utf-8"))
+	return sha256.hexdigest()
+
+def source_fingerprint(path):
+	""" return (mtime in ns, size) of a file, or the latest mtime and the total size of a folder and its content, see folder_stat """
+	if os.path.isdir(path):
+		return folder_stat(path)[:2]
+	stat = os.stat(path)
+	return stat.st_mtime_ns, stat.st_size
+
+class MigrationJournal:
+	"""
+		Append only journal of the migration steps, stored in SQLite with WAL
+		- key, the source item, for example the file path
+		- step, one of "hash", "upload", "entry", "changed" and "error"; "changed" marks a source changed since its entry, the key is not done until a later entry
+		- name, the attachment of an "upload" step
+		- value, the json data of the step, null to clear the step
+		The fingerprints of the sources are kept in a separate table, one row per key, see changed.
+		Safe to share between threads.
+	"""
+
+	def __init__(self, path=DEFAULT_JOURNAL_PATH):
+		self.path = path
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute("PRAGMA synchronous=NORMAL")
+		self.connection.execute("""
+			CREATE TABLE IF NOT EXISTS events (
+				id INTEGER PRIMARY KEY AUTOINCREMENT,
+				key TEXT NOT NULL,
+				step TEXT NOT NULL,
+				name TEXT NOT NULL DEFAULT '',
+				value TEXT,
+				created REAL NOT NULL
+			)
+		""")
+		self.connection.execute("CREATE INDEX IF NOT EXISTS events_key_step ON events (key, step, name)")
+		self.connection.execute("""
+			CREATE TABLE IF NOT EXISTS fingerprints (
+				key TEXT PRIMARY KEY,
+				mtime INTEGER NOT NULL,
+				size INTEGER NOT NULL,
+				sha256 TEXT
+			)
+		""")
+		# the fingerprints of the migrated sources, compared without a query
+		self.fingerprints = {key: (mtime, size, sha256) for key, mtime, size, sha256 in self.connection.execute("SELECT key, mtime, size, sha256 FROM fingerprints")}
+		self.pending_fingerprints = {} # key -> (mtime, size) of the sources being migrated, saved with their entry
+		# the finished items, to skip them without a query, an entry recorded before the source changed does not count
+		self.done = {key for (key,) in self.connection.execute("""
+			SELECT key FROM events WHERE step IN ('entry', 'changed') GROUP BY key
+			HAVING MAX(CASE WHEN step = 'entry' THEN id ELSE 0 END) > MAX(CASE WHEN step = 'changed' THEN id ELSE 0 END)
+		""")}
+		self.errors = [] # (key, error) of the items that failed in this run
+
+	def close(self):
+		""" close the journal """
+		with self.lock:
+			self.connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def record(self, key, step, value=None, name=""):
+		""" append a step of the key """
+		with self.lock:
+			self.connection.execute(
+				"INSERT INTO events (key, step, name, value, created) VALUES (?, ?, ?, ?, ?)",
+				(key, step, name, json.dumps(value), time.time())
+			)
+			if step == "entry":
+				self.done.add(key)
+
+	def get(self, key, step, name=""):
+		""" return the value of the latest step of the key, None if the step is not recorded """
+		with self.lock:
+			row = self.connection.execute(
+				"SELECT value FROM events WHERE key = ? AND step = ? AND name = ? ORDER BY id DESC LIMIT 1",
+				(key, step, name)
+			).fetchone()
+		return None if row is None else json.loads(row[0])
+
+	def is_done(self, key):
+		""" return True if the entry of the key is created """
+		return key in self.done
+
+	def ensure_hash(self, key, path):
+		""" record the content hash of the key if not recorded, return the hash """
+		sha256 = self.get(key, "hash")
+		if sha256 is None:
+			sha256 = path_sha256(path)
+			self.record(key, "hash", sha256)
+		return sha256
+
+	def save_fingerprint(self, key, mtime, size, sha256):
+		""" save the fingerprint of the source of the key """
+		with self.lock:
+			self.connection.execute(
+				"INSERT OR REPLACE INTO fingerprints (key, mtime, size, sha256) VALUES (?, ?, ?, ?)",
+				(key, mtime, size, sha256)
+			)
+			self.fingerprints[key] = (mtime, size, sha256)
+
+	def changed(self, key, path, fingerprint=None):
+		"""
+			return True if the source path of the key is new or changed since its entry was created, for a delta migration
+			- the mtime and size are compared with the manifest first, the content hash is only computed when they changed
+			- a changed source is not done anymore and its uploads are cleared, so that it is migrated again; its entry is kept, to be updated instead of created
+			- the fingerprint is saved with the next entry of the key, see record_entry
+			- fingerprint, the (mtime, size) of the source if known, for example from scan_sources, read with source_fingerprint if None
+		"""
+		mtime, size = source_fingerprint(path) if fingerprint is None else fingerprint
+		recorded = self.fingerprints.get(key)
+		if recorded is not None and recorded[:2] == (mtime, size):
+			return False
+		if not self.is_done(key):
+			with self.lock:
+				self.pending_fingerprints[key] = (mtime, size)
+			return True
+		sha256 = path_sha256(path)
+		# the sources migrated before the manifest are compared with the hash of their journal
+		if sha256 == (recorded[2] if recorded is not None else self.get(key, "hash")):
+			self.save_fingerprint(key, mtime, size, sha256)
+			return False
+		self.invalidate(key, sha256)
+		with self.lock:
+			self.pending_fingerprints[key] = (mtime, size)
+		return True
+
+	def invalidate(self, key, sha256):
+		"""
+			clear the uploads and the hash of the key, the key is not done anymore and its entry is kept
+			- the change is recorded first, so that the key stays not done if the run stops before its next entry; the new hash and the fingerprint are saved with the entry, see record_entry
+		"""
+		self.record(key, "changed", sha256)
+		with self.lock:
+			names = [name for (name,) in self.connection.execute("SELECT DISTINCT name FROM events WHERE key = ? AND step = 'upload'", (key,))]
+		for name in names:
+			self.record(key, "upload", None, name=name)
+		self.record(key, "hash", None)
+		with self.lock:
+			self.done.discard(key)
+
+	def upload(self, labii, key, file_path, workspaces):
+		""" upload the file unless it was uploaded for the key, return the file record """
+		return self.uploaded(key, file_path, lambda: labii.upload(file_path, workspaces))
+
+	def uploaded(self, key, name, upload):
+		""" return the file record of the name uploaded for the key, call upload() to get it if not recorded """
+		file_record = self.get(key, "upload", name=name)
+		if file_record is None:
+			file_record = upload()
+			if isinstance(file_record, dict) and "sid" in file_record:
+				self.record(key, "upload", {
+					"sid": file_record["sid"],
+					"uid": file_record["uid"],
+					"name": file_record["name"],
+					"version": {"sid": file_record["version"]["sid"]}
+				}, name=name)
+		return file_record
+
+	def record_entry(self, key, response):
+		""" record the created entry of the key if the response is a record, else record the response as the error of the key """
+		if isinstance(response, dict) and "uid" in response:
+			self.record(key, "entry", {"sid": response.get("sid"), "uid": response["uid"], "name": response["name"]})
+			with self.lock:
+				fingerprint = self.pending_fingerprints.pop(key, None)
+			if fingerprint is not None:
+				self.save_fingerprint(key, *fingerprint, self.get(key, "hash"))
+		else:
+			self.record_error(key, response)
+
+	def record_error(self, key, error):
+		""" record that the key failed, the key is retried by the next run """
+		self.record(key, "error", str(error))
+		with self.lock:
+			self.errors.append((key, str(error)))
+
+	def report_errors(self):
+		""" print the items that failed in this run """
+		for key, error in self.errors:
+			print(f"Failed: {key}: {error}")
+		if len(self.errors) > 0:
+			print(f"{len(self.errors)} items failed, run the migration again to retry them")
@@ -0,0 +1,237 @@
+"""
+The `migration_metrics.py` module measures where the time of a migration run goes: the duration of each stage of each item (parse, each transform rule, upload, create, modify), the bytes sent, the retries and the depth of the queues.
+The measures are collected by the module level `metrics`, disabled by default so that the calls cost nothing, and exported at the end of the run as JSON or as a Prometheus textfile, with percentiles.
+`profiler` profiles a sample of the items with cProfile and tracemalloc when enabled.
+Usage:
+	metrics.enabled = True
+	with metrics.timer("upload"):
+		...
+	metrics.count("upload.bytes", size)
+	metrics.write("metrics.json") # or metrics.prom
+"""
+import os
+import re
+import json
+import time
+import random
+import cProfile
+import threading
+import tracemalloc
+import contextlib
+
+PERCENTILES = (50, 90, 99)
+DEFAULT_PROFILE_DIR = "labii_profiles"
+
+class Series:
+	"""
+		The samples of a stage or a gauge: exact count, total and max, and a reservoir of samples for the percentiles
+		- reservoir_size, the most samples kept, the samples are replaced at random once it is full so that the reservoir stays a uniform sample
+	"""
+
+	def __init__(self, reservoir_size=10000, rng=None):
+		self.count = 0
+		self.total = 0.0
+		self.max = None
+		self.last = None
+		self.samples = []
+		self.reservoir_size = reservoir_size
+		self.random = rng if rng is not None else random.Random(0)
+
+	def add(self, value):
+		""" add a sample """
+		self.count += 1
+		self.total += value
+		self.max = value if self.max is None else max(self.max, value)
+		self.last = value
+		if len(self.samples) < self.reservoir_size:
+			self.samples.append(value)
+		else:
+			index = self.random.randrange(self.count)
+			if index < self.reservoir_size:
+				self.samples[index] = value
+
+	def summary(self):
+		""" return the count, total, mean, max, last and percentiles of the samples """
+		# numpy is only imported when the metrics are reported
+		import numpy as np#pylint: disable=import-outside-toplevel
+		percentiles = np.percentile(self.samples, PERCENTILES) if len(self.samples) > 0 else [None] * len(PERCENTILES)
+		result = {
+			"count": self.count,
+			"total": self.total,
+			"mean": self.total / self.count if self.count > 0 else None,
+			"max": self.max,
+			"last": self.last
+		}
+		for percentile, value in zip(PERCENTILES, percentiles):
+			result[f"p{percentile}"] = None if value is None else float(value)
+		return result
+
+class Metrics:
+	"""
+		Registry of the measures of a run
+		- timer(stage), context manager measuring the seconds of a stage of an item
+		- observe(stage, seconds), add a duration measured elsewhere
+		- count(name, value), add value to a counter, for example the bytes sent or the retries
+		- gauge(name, value), add a sample of a level, for example the depth of a queue
+		Nothing is recorded while enabled is False. Safe to share between threads.
+	"""
+
+	def __init__(self, enabled=False, reservoir_size=10000):
+		self.enabled = enabled
+		self.reservoir_size = reservoir_size
+		self.stages = {} # name -> Series of seconds
+		self.gauges = {} # name -> Series
+		self.counters = {} # name -> value
+		self.started = time.time()
+		self.random = random.Random(0)
+		self.lock = threading.Lock()
+
+	def reset(self):
+		""" remove all the measures """
+		with self.lock:
+			self.stages = {}
+			self.gauges = {}
+			self.counters = {}
+			self.started = time.time()
+
+	@contextlib.contextmanager
+	def timer(self, stage):
+		""" measure the seconds of the block as a sample of the stage """
+		if not self.enabled:
+			yield
+			return
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(stage, time.perf_counter() - start)
+
+	def add(self, series, name, value):
+		""" add a sample to the series of the name """
+		with self.lock:
+			if not name in series:
+				series[name] = Series(self.reservoir_size, self.random)
+			series[name].add(value)
+
+	def observe(self, stage, seconds):
+		""" add a duration of the stage """
+		if self.enabled:
+			self.add(self.stages, stage, seconds)
+
+	def observe_all(self, stage_seconds):
+		""" add the durations of a dict {stage: seconds}, for example measured in a worker process """
+		for stage, seconds in stage_seconds.items():
+			self.observe(stage, seconds)
+
+	def gauge(self, name, value):
+		""" add a sample of the level """
+		if self.enabled:
+			self.add(self.gauges, name, value)
+
+	def count(self, name, value=1):
+		""" add value to the counter """
+		if self.enabled:
+			with self.lock:
+				self.counters[name] = self.counters.get(name, 0) + value
+
+	def summary(self):
+		""" return the measures as a dict """
+		with self.lock:
+			return {
+				"started": self.started,
+				"seconds": time.time() - self.started,
+				"stages": {name: series.summary() for name, series in sorted(self.stages.items())},
+				"gauges": {name: series.summary() for name, series in sorted(self.gauges.items())},
+				"counters": dict(sorted(self.counters.items()))
+			}
+
+	def to_prometheus(self, prefix="labii_migration"):
+		""" return the measures in the Prometheus text format, for the textfile collector of the node exporter """
+		summary = self.summary()
+		lines = [f"# TYPE {prefix}_stage_seconds summary"]
+		for name, stage in summary["stages"].items():
+			for percentile in PERCENTILES:
+				lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{percentile / 100}"}} {stage[f"p{percentile}"]}')
+			lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["total"]}')
+			lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+		for name, value in summary["counters"].items():
+			metric = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+			lines.append(f"# TYPE {metric} counter")
+			lines.append(f"{metric} {value}")
+		lines.append(f"# TYPE {prefix}_gauge gauge")
+		for name, gauge in summary["gauges"].items():
+			for statistic in ("last", "max", "mean", "p90"):
+				lines.append(f'{prefix}_gauge{{name="{name}",statistic="{statistic}"}} {gauge[statistic]}')
+		lines.append(f"# TYPE {prefix}_run_seconds gauge")
+		lines.append(f"{prefix}_run_seconds {summary['seconds']}")
+		return "\n".join(lines) + "\n"
+
+	def write(self, path):
+		""" write the measures to the path, in the Prometheus text format if the path ends with .prom, else as JSON; the file is replaced at once """
+		if path.endswith(".prom"):
+			content = self.to_prometheus()
+		else:
+			content = json.dumps(self.summary(), indent=2)
+		temporary_path = f"{path}.tmp"
+		with open(temporary_path, "w", encoding="utf-8") as file:
+			file.write(content)
+		os.replace(temporary_path, path)
+
+	def report(self):
+		""" return the summary of the stages as text, one line per stage """
+		lines = []
+		for name, stage in self.summary()["stages"].items():
+			lines.append(f"{name}: {stage['count']} x, total {stage['total']:.2f}s, p50 {stage['p50'] * 1000:.1f}ms, p90 {stage['p90'] * 1000:.1f}ms, p99 {stage['p99'] * 1000:.1f}ms")
+		return "\n".join(lines)
+
+class ItemProfiler:
+	"""
+		Profile a sample of the items with cProfile and tracemalloc
+		- sample, the part of the items profiled, 0 to profile none
+		- folder, the profiles are written there: {number}_{item}.prof for pstats or snakeviz, and {number}_{item}.txt with the peak memory and the top allocations
+		Only one item is profiled at a time, the items of the other threads are not profiled meanwhile.
+	"""
+
+	def __init__(self, sample=0.0, folder=DEFAULT_PROFILE_DIR, top=20, seed=0):
+		self.sample = sample
+		self.folder = folder
+		self.top = top
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.profiled = 0
+
+	@contextlib.contextmanager
+	def profile(self, name):
+		""" profile the block if the item is in the sample """
+		if self.sample <= 0 or self.random.random() >= self.sample or not self.lock.acquire(blocking=False):
+			yield
+			return
+		try:
+			os.makedirs(self.folder, exist_ok=True)
+			file_name = re.sub(r"[^\w.-]", "_", os.path.basename(str(name)))
+			path = os.path.join(self.folder, f"{self.profiled + 1:04d}_{file_name}")
+			tracing = tracemalloc.is_tracing()
+			if not tracing:
+				tracemalloc.start()
+			tracemalloc.reset_peak()
+			profile = cProfile.Profile()
+			profile.enable()
+			try:
+				yield
+			finally:
+				profile.disable()
+				profile.dump_stats(f"{path}.prof")
+				_, peak = tracemalloc.get_traced_memory()
+				statistics = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+				if not tracing:
+					tracemalloc.stop()
+				with open(f"{path}.txt", "w", encoding="utf-8") as file:
+					file.write(f"{name}\npeak traced memory: {peak / 1024 / 1024:.1f} MB\n")
+					for statistic in statistics:
+						file.write(f"{statistic}\n")
+				self.profiled += 1
+		finally:
+			self.lock.release()
+
+metrics = Metrics()
+profiler = ItemProfiler()
@@ -0,0 +1,137 @@
+"""
+The `migration_pipeline.py` module runs the items of a migration through stages connected by bounded queues, for example read -> transform -> upload -> create.
+Each stage has its own threads. A stage waits when the queue of the next stage is full, so a slow api holds back the reading instead of piling up items in memory, and the items read ahead keep a slow stage busy.
+The time each stage spends working, waiting for items and waiting for the next stage is measured, to tune the number of workers of each stage.
+Usage:
+	pipeline = Pipeline([Stage("read", read, workers=2), Stage("upload", upload, workers=8)], queue_size=16)
+	pipeline.run(items, on_error=lambda item, stage, error: print(item, stage, error))
+	print(pipeline.report())
+"""
+import time
+import queue
+import threading
+from migration_metrics import metrics
+
+_DONE = object()
+
+class Stage:
+	"""
+		A stage of a Pipeline
+		- function(item), return the item for the next stage, or None to drop the item, for example an item skipped or failed
+		- workers, the number of threads of the stage
+		- stats, the items passed on and failed, and the seconds working (busy), waiting for an item (starved) and waiting for room in the queue of the next stage (blocked), summed over the workers
+	"""
+
+	def __init__(self, name, function, workers=1):
+		self.name = name
+		self.function = function
+		self.workers = max(1, workers)
+		self.stats = {"items": 0, "errors": 0, "busy": 0.0, "starved": 0.0, "blocked": 0.0}
+		self.lock = threading.Lock()
+
+	def add(self, name, value):
+		""" add value to the statistic """
+		with self.lock:
+			self.stats[name] += value
+
+class Pipeline:
+	"""
+		Run items through stages, each stage in its own threads, connected by bounded queues
+		- stages, the list of Stage, an item goes through them in order
+		- queue_size, the most items waiting before each stage
+		The items do not keep their order. An exception of a stage drops the item and is passed to on_error, the other items go on.
+	"""
+
+	def __init__(self, stages, queue_size=16):
+		self.stages = stages
+		self.queue_size = queue_size
+		self.seconds = 0.0
+		self.fed = 0
+		self.completed = 0
+
+	def run(self, items, on_error=None):
+		""" put the items into the first stage, from this thread, and wait for all of them to go through the stages, return the number of items out of the last stage """
+		queues = [queue.Queue(self.queue_size) for _ in self.stages]
+		finished = [0] * len(self.stages)
+		lock = threading.Lock()
+
+		def work(index):
+			stage = self.stages[index]
+			inbox = queues[index]
+			outbox = queues[index + 1] if index + 1 < len(queues) else None
+			while True:
+				start = time.perf_counter()
+				item = inbox.get()
+				stage.add("starved", time.perf_counter() - start)
+				if item is _DONE:
+					break
+				start = time.perf_counter()
+				try:
+					result = stage.function(item)
+				except Exception as error:#pylint: disable=broad-exception-caught
+					result = None
+					stage.add("errors", 1)
+					if on_error is not None:
+						try:
+							on_error(item, stage.name, error)
+						except Exception as callback_error:#pylint: disable=broad-exception-caught
+							print(f"Error: {stage.name}: {error}, then {callback_error}")
+				stage.add("busy", time.perf_counter() - start)
+				if result is None:
+					continue
+				stage.add("items", 1)
+				if outbox is None:
+					with lock:
+						self.completed += 1
+					continue
+				start = time.perf_counter()
+				outbox.put(result)
+				stage.add("blocked", time.perf_counter() - start)
+				metrics.gauge(f"queue.{self.stages[index + 1].name}", outbox.qsize())
+			# the last worker of the stage closes the next stage
+			with lock:
+				finished[index] += 1
+				last = finished[index] == stage.workers
+			if last and outbox is not None:
+				for _ in range(self.stages[index + 1].workers):
+					outbox.put(_DONE)
+
+		start = time.perf_counter()
+		threads = []
+		for index, stage in enumerate(self.stages):
+			for worker in range(stage.workers):
+				thread = threading.Thread(target=work, args=(index,), name=f"{stage.name}-{worker}", daemon=True)
+				thread.start()
+				threads.append(thread)
+		try:
+			for item in items:
+				queues[0].put(item)
+				self.fed += 1
+				metrics.gauge(f"queue.{self.stages[0].name}", queues[0].qsize())
+		finally:
+			for _ in range(self.stages[0].workers):
+				queues[0].put(_DONE)
+			for thread in threads:
+				thread.join()
+			self.seconds = time.perf_counter() - start
+		for stage in self.stages:
+			metrics.gauge(f"pipeline.{stage.name}.utilization", self.utilization(stage))
+		return self.completed
+
+	def utilization(self, stage):
+		""" return the part of the time the workers of the stage were working """
+		if self.seconds <= 0:
+			return 0.0
+		return stage.stats["busy"] / (stage.workers * self.seconds)
+
+	def report(self):
+		"""
+			return the summary of each stage
+			- a stage busy most of the time is the bottleneck, give it more workers if it waits on the network or the disk
+			- a stage waiting for the next stage most of the time has more workers than needed
+		"""
+		lines = [f"Pipeline: {self.fed} items in, {self.completed} out in {self.seconds:.1f}s"]
+		for stage in self.stages:
+			total = stage.workers * self.seconds if self.seconds > 0 else 1
+			lines.append(f"{stage.name}: {stage.workers} workers, {stage.stats['items']} items, {stage.stats['errors']} failed, busy {self.utilization(stage):.0%}, waiting for items {stage.stats['starved'] / total:.0%}, waiting for the next stage {stage.stats['blocked'] / total:.0%}")
+		return "\n".join(lines)
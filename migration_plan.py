@@ -0,0 +1,327 @@
+"""
+The `migration_plan.py` module plans a migration before it runs: it lists the entries of the source folder, resolves the attachments of each entry, checks that they exist and totals the entries, files and bytes, without uploading anything.
+The attachments of a Benchling entry are found from the names of its file items, with the naming of the export (`etr_x name.ext`, then `etr_x name 2.ext` for the second file with the same name), without parsing the entry into a soup.
+The duration is estimated with a throughput model, calibrated with the metrics of an earlier run (`--metrics metrics.json`) on the same network and server.
+The plan is written to a JSON file in the order the entries are migrated; `--plan plan.json` of `migrate_file_as_entry.py` and `migrate_benchling_entries.py` then migrates the entries of the plan without listing the folder again, and the entries with a missing attachment are recorded as errors before the run starts.
+Usage:
+	python migration_plan.py benchling "/data/benchling export" --output plan.json --calibrate metrics.json
+	python migrate_benchling_entries.py --plan plan.json
+"""
+import os
+import sys
+import glob
+import json
+import datetime
+import argparse
+from html.parser import HTMLParser
+from directory_scan import scan_sources, SourceItem
+from migration_pool import ordered_map
+
+KINDS = ["files", "benchling"]
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+# the elements dropped by the transform of the Benchling entries, their file items are not uploaded
+DROPPED_ELEMENTS = [("div", "mediocre-item is-text"), ("div", "mediocre-item is-code"), ("div", "mediocre-tableEditable-fillerTableWrapper"), ("style", None)]
+
+def entry_file_path(current_file, file_name, name_index):
+	"""
+		return the path of the file item file_name of the Benchling entry current_file, etr_x.html -> "etr_x {name}{ext}", or "etr_x {name} {n}{ext}" for the n-th file item with the same name
+		- name_index, the number of file items of each name so far in the entry, updated
+	"""
+	name_index[file_name] = name_index.get(file_name, 0) + 1
+	if name_index[file_name] > 1:
+		name_parts = os.path.splitext(file_name)
+		return current_file.replace(".html", f" {name_parts[0]} {name_index[file_name]}{name_parts[1]}")
+	return current_file.replace(".html", f" {file_name}")
+
+def classes_match(classes, class_):
+	""" return True if the list of classes matches class_, the same rule as html_transform.class_matches without importing bs4 """
+	return class_ is None or class_ in classes or " ".join(classes) == class_
+
+def close_tag(stack, tag):
+	""" close the tag and the tags opened inside it, nothing if the tag is not open """
+	if tag in stack:
+		while stack.pop() != tag:
+			pass
+
+class AttachmentScanner(HTMLParser):
+	"""
+		Find the names of the file items (div.mediocre-item with a div.note-itemName) of a Benchling entry, in the order of the document, without building a soup
+		- the file items inside the elements dropped by the transform are skipped, see DROPPED_ELEMENTS
+		- names, the stripped text of the first name of each file item
+	"""
+
+	def __init__(self):
+		super().__init__(convert_charrefs=True)
+		self.names = []
+		self.dropped = [] # the open tags of a dropped element
+		self.item = [] # the open tags of a file item
+		self.name_depth = None # the depth of the name in the file item while it is read
+		self.name_found = False
+		self.text = []
+
+	def handle_starttag(self, tag, attrs):
+		if tag in VOID_TAGS:
+			return
+		if len(self.dropped) > 0:
+			self.dropped.append(tag)
+		elif len(self.item) > 0:
+			self.item.append(tag)
+			if self.name_depth is None and not self.name_found and tag == "div" and classes_match((dict(attrs).get("class") or "").split(), "note-itemName"):
+				self.name_depth = len(self.item)
+		elif tag in ("div", "style"):
+			classes = (dict(attrs).get("class") or "").split()
+			if any(tag == name and classes_match(classes, class_) for name, class_ in DROPPED_ELEMENTS):
+				self.dropped.append(tag)
+			elif tag == "div" and classes_match(classes, "mediocre-item"):
+				self.item.append(tag)
+				self.name_found = False
+
+	def handle_endtag(self, tag):
+		if len(self.dropped) > 0:
+			close_tag(self.dropped, tag)
+			return
+		close_tag(self.item, tag)
+		if self.name_depth is not None and len(self.item) < self.name_depth:
+			self.names.append("".join(self.text).strip())
+			self.name_depth = None
+			self.name_found = True
+			self.text = []
+
+	def handle_data(self, data):
+		if self.name_depth is not None:
+			self.text.append(data)
+
+def entry_attachment_names(current_file, chunk_size=1024 * 1024):
+	""" return the names of the file items of the Benchling entry, read in chunks """
+	scanner = AttachmentScanner()
+	with open(current_file, "r", encoding="utf-8") as file:
+		for chunk in iter(lambda: file.read(chunk_size), ""):
+			scanner.feed(chunk)
+	scanner.close()
+	return scanner.names
+
+def plan_files(paths):
+	""" return (files, missing) of the paths, files as {"name", "path", "size"} """
+	files, missing = [], []
+	for path in paths:
+		try:
+			files.append({"name": os.path.basename(path), "path": path, "size": os.path.getsize(path)})
+		except OSError:
+			missing.append(path)
+	return files, missing
+
+def plan_benchling_entry(current_file):
+	""" return the plan of a Benchling entry: its path, size, attachments and missing attachments """
+	name_index = {}
+	paths = [entry_file_path(current_file, name, name_index) for name in entry_attachment_names(current_file)]
+	files, missing = plan_files(paths)
+	return {"path": current_file, "size": os.path.getsize(current_file), "files": files, "missing": missing}
+
+def plan_source(source):
+	""" return the plan of a SourceItem of migrate_file_as_entry, a file or a folder and its files """
+	files, missing = plan_files(source.attachments)
+	return {"path": source.path, "size": source.size, "mtime_ns": source.mtime_ns, "files": files, "missing": missing}
+
+def build_plan(kind, folder, workers=8, order="path"):
+	"""
+		return the plan of the migration of the folder
+		- kind, "files" for migrate_file_as_entry or "benchling" for migrate_benchling_entries
+		- workers, the number of threads listing the folder and reading the entries
+		- order, the order of the entries in the plan, "path", or "size" for the largest first so that a large entry does not run alone at the end
+	"""
+	if not kind in KINDS:
+		raise ValueError(f"Error: the kind of plan must be one of {', '.join(KINDS)}!")
+	folder = folder.rstrip("/")
+	if kind == "benchling":
+		paths = sorted(path for path in glob.glob(f"{folder}/*.html") if not "/migrated" in path and "etr_" in path)
+		entries = [entry for _, entry in ordered_map(plan_benchling_entry, paths, workers=workers)]
+	else:
+		sources = sorted((source for source in scan_sources(folder, workers=workers) if not "/migrated" in source.path), key=lambda source: source.path)
+		entries = [plan_source(source) for source in sources]
+	if order == "size":
+		entries.sort(key=lambda entry: -(entry["size"] if kind == "benchling" else 0) - sum(file["size"] for file in entry["files"]))
+	return {
+		"kind": kind,
+		"folder": folder,
+		"created": datetime.datetime.now().isoformat(timespec="seconds"),
+		"entries": entries,
+		"totals": plan_totals(kind, entries)
+	}
+
+def plan_totals(kind, entries):
+	""" return the number of entries and files, the bytes uploaded, the bytes transformed and the missing files of the entries """
+	return {
+		"entries": len(entries),
+		"files": sum(len(entry["files"]) for entry in entries),
+		"bytes": sum(file["size"] for entry in entries for file in entry["files"]),
+		"source_bytes": sum(entry["size"] for entry in entries) if kind == "benchling" else 0,
+		"missing": sum(len(entry["missing"]) for entry in entries),
+		"entries_missing_files": sum(1 for entry in entries if len(entry["missing"]) > 0)
+	}
+
+def write_plan(plan, path):
+	""" write the plan to the JSON file, the file is replaced at once """
+	temporary_path = f"{path}.tmp"
+	with open(temporary_path, "w", encoding="utf-8") as file:
+		json.dump(plan, file, indent=1)
+	os.replace(temporary_path, path)
+
+def load_plan(path, kind):
+	""" return the plan of the JSON file, raise ValueError if it is not a plan of the kind """
+	with open(path, "r", encoding="utf-8") as file:
+		plan = json.load(file)
+	if not isinstance(plan, dict) or not "entries" in plan:
+		raise ValueError(f"Error: {path} is not a migration plan!")
+	if plan.get("kind") != kind:
+		raise ValueError(f"Error: the plan {path} is a {plan.get('kind')} plan, not a {kind} plan!")
+	return plan
+
+def ready_entries(plan, journal):
+	"""
+		return the entries of the plan whose attachments all exist, in the order of the plan
+		- the entries with a missing attachment are recorded as errors in the journal, the next run migrates them once the files are found
+	"""
+	entries = []
+	for entry in plan["entries"]:
+		if len(entry["missing"]) > 0:
+			error = f"Error: files not found ({', '.join(os.path.basename(path) for path in entry['missing'])})"
+			journal.record_error(os.path.abspath(entry["path"]), error)
+			print(f"{os.path.basename(entry['path'])}: {error}")
+		else:
+			entries.append(entry)
+	return entries
+
+def plan_sources(entries):
+	""" return the SourceItem of the entries of a files plan, as listed by scan_sources """
+	return [SourceItem(entry["path"], [file["path"] for file in entry["files"]], entry["mtime_ns"], entry["size"]) for entry in entries]
+
+class ThroughputModel:
+	"""
+		Estimate the duration of a migration from the totals of its plan
+		- create_seconds, the seconds to create an entry
+		- upload_seconds, the seconds of the round trips to upload a file, whatever its size
+		- upload_bytes_per_second, the speed of an upload once started
+		- transform_bytes_per_second, the speed of the parse and transform of the Benchling entries by one process
+		The defaults are rough; calibrate the model with the metrics of an earlier run, with from_metrics.
+	"""
+
+	def __init__(self, create_seconds=0.3, upload_seconds=0.5, upload_bytes_per_second=10 * 1024 * 1024, transform_bytes_per_second=2 * 1024 * 1024):
+		self.create_seconds = create_seconds
+		self.upload_seconds = upload_seconds
+		self.upload_bytes_per_second = upload_bytes_per_second
+		self.transform_bytes_per_second = transform_bytes_per_second
+		self.calibrated = []
+
+	@classmethod
+	def from_metrics(cls, path):
+		"""
+			return the model calibrated with the JSON file written by --metrics of a migrate script
+			- the create time is the mean of the create stage
+			- the round trips of an upload are the mean post and patch api requests, the rest of the upload stage is the transfer of the bytes, if at least 1 MB was uploaded
+			- the transform speed is the source bytes over the parse, transform, serialize and stream stages
+			The values missing in the metrics keep their defaults.
+		"""
+		if path.endswith(".prom"):
+			raise ValueError(f"Error: calibrate with the JSON metrics, not {path}!")
+		with open(path, "r", encoding="utf-8") as file:
+			summary = json.load(file)
+		model = cls()
+		stages, counters = summary.get("stages", {}), summary.get("counters", {})
+		def mean(name):
+			stage = stages.get(name)
+			return stage["total"] / stage["count"] if stage is not None and stage["count"] > 0 else None
+		if mean("create") is not None:
+			model.create_seconds = mean("create")
+			model.calibrated.append("create")
+		upload = stages.get("upload")
+		if upload is not None and upload["count"] > 0 and counters.get("upload.bytes", 0) > 0:
+			round_trips = sum(value for value in (mean("api.post"), mean("api.patch")) if value is not None)
+			model.upload_seconds = min(round_trips, upload["total"] / upload["count"]) if round_trips > 0 else upload["total"] / upload["count"] / 2
+			model.calibrated.append("upload")
+			# a few small files do not measure the speed
+			if counters["upload.bytes"] >= 1024 * 1024:
+				transfer = max(upload["total"] - upload["count"] * model.upload_seconds, upload["total"] * 0.1)
+				model.upload_bytes_per_second = counters["upload.bytes"] / transfer
+		transform = sum(stages[name]["total"] for name in ("parse", "transform", "serialize", "stream") if name in stages)
+		if transform > 0 and counters.get("source.bytes", 0) > 0:
+			model.transform_bytes_per_second = counters["source.bytes"] / transform
+			model.calibrated.append("transform")
+		return model
+
+	def estimate(self, totals, upload_workers=1, create_workers=1, processes=1, pipeline=False):
+		"""
+			return the estimated seconds of each stage and the total, for the totals of a plan
+			- the stages run one after another for each entry, or at the same time with pipeline, then the slowest stage is the duration
+		"""
+		seconds = {
+			"transform": totals["source_bytes"] / self.transform_bytes_per_second / max(1, processes),
+			"upload": (totals["files"] * self.upload_seconds + totals["bytes"] / self.upload_bytes_per_second) / max(1, upload_workers),
+			"create": totals["entries"] * self.create_seconds / max(1, create_workers)
+		}
+		seconds["total"] = max(seconds.values()) if pipeline else sum(seconds.values())
+		return seconds
+
+	def report(self):
+		""" return the values of the model """
+		calibrated = f"calibrated: {', '.join(self.calibrated)}" if len(self.calibrated) > 0 else "not calibrated"
+		return f"Model ({calibrated}): create {self.create_seconds * 1000:.0f}ms, upload {self.upload_seconds * 1000:.0f}ms + {self.upload_bytes_per_second / 1024 / 1024:.1f} MB/s, transform {self.transform_bytes_per_second / 1024 / 1024:.1f} MB/s"
+
+def format_seconds(seconds):
+	""" return the seconds as 1h 02m 03s """
+	seconds = int(round(seconds))
+	hours, minutes = seconds // 3600, seconds % 3600 // 60
+	if hours > 0:
+		return f"{hours}h {minutes:02d}m {seconds % 60:02d}s"
+	if minutes > 0:
+		return f"{minutes}m {seconds % 60:02d}s"
+	return f"{seconds}s"
+
+def report_plan(plan, estimate, limit=20):
+	""" return the summary of the plan and of its estimate, with the first limit missing files """
+	totals = plan["totals"]
+	lines = [f"Plan of {plan['folder']}: {totals['entries']} entries, {totals['files']} files, {totals['bytes'] / 1024 / 1024:.1f} MB to upload" + (f", {totals['source_bytes'] / 1024 / 1024:.1f} MB of entries to transform" if plan["kind"] == "benchling" else "")]
+	if totals["missing"] > 0:
+		lines.append(f"Missing: {totals['missing']} files of {totals['entries_missing_files']} entries, these entries are skipped by the run")
+		missing = [path for entry in plan["entries"] for path in entry["missing"]]
+		lines.extend(f"  {path}" for path in missing[:limit])
+		if len(missing) > limit:
+			lines.append(f"  and {len(missing) - limit} more")
+	lines.append(f"Estimate: {format_seconds(estimate['total'])} (transform {format_seconds(estimate['transform'])}, upload {format_seconds(estimate['upload'])}, create {format_seconds(estimate['create'])})")
+	return "\n".join(lines)
+
+def parse_arguments(argv=None):
+	""" return the command line arguments, of argv if provided """
+	parser = argparse.ArgumentParser(description="Plan a migration without uploading: check the attachments of the entries, total the files and bytes and estimate the duration.")
+	parser.add_argument("kind", choices=KINDS, help="files for migrate_file_as_entry, benchling for migrate_benchling_entries")
+	parser.add_argument("folder", help="the folder to migrate")
+	parser.add_argument("--output", default=None, help="write the plan to this JSON file, to run the migration from it with --plan")
+	parser.add_argument("--order", choices=["path", "size"], default="path", help="the order of the entries, size for the largest first, default path")
+	parser.add_argument("--calibrate", default=None, help="the JSON file written by --metrics of an earlier run, to calibrate the estimate")
+	parser.add_argument("--scan-workers", type=int, default=8, help="number of threads listing the folder and reading the entries, default 8")
+	parser.add_argument("--workers", type=int, default=1, help="the --workers of the run, to estimate its duration, default 1")
+	parser.add_argument("--processes", type=int, default=1, help="the --processes of the Benchling run, default 1")
+	parser.add_argument("--pipeline", action="store_true", help="estimate the run with --pipeline, with --upload-workers and --create-workers")
+	parser.add_argument("--upload-workers", type=int, default=8, help="the --upload-workers of the pipeline, default 8")
+	parser.add_argument("--create-workers", type=int, default=4, help="the --create-workers of the pipeline, default 4")
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	""" plan the migration of the folder, exit with 1 if an attachment is missing """
+	args = parse_arguments(argv)
+	plan = build_plan(args.kind, args.folder, workers=args.scan_workers, order=args.order)
+	model = ThroughputModel.from_metrics(args.calibrate) if args.calibrate else ThroughputModel()
+	if args.pipeline:
+		estimate = model.estimate(plan["totals"], args.upload_workers, args.create_workers, args.processes, pipeline=True)
+	else:
+		estimate = model.estimate(plan["totals"], args.workers, args.workers, args.processes)
+	plan["estimate"] = estimate
+	print(model.report())
+	print(report_plan(plan, estimate))
+	if args.output:
+		write_plan(plan, args.output)
+		print(f"Plan written to {args.output}")
+	if plan["totals"]["missing"] > 0:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
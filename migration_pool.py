@@ -0,0 +1,35 @@
+"""
+The `migration_pool.py` module provides the helpers to run a migration with a pool of worker threads: a bounded ordered map so that results and progress are reported in the same order as the input.
+The api requests of the workers, the uploads included, are capped by the shared AdaptiveClient of `labii_client.py`.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from migration_metrics import metrics
+
+def ordered_map(function, items, workers=4, executor=None):
+	"""
+		call function(item) for each item in a pool of threads, yield (item, result) in the order of items
+		- at most 2 x workers items are submitted ahead of the one being yielded, so a long list does not create all the futures at once
+		- the exception of an item is raised when the item is yielded
+	"""
+	should_shutdown = executor is None
+	if executor is None:
+		executor = ThreadPoolExecutor(max_workers=workers)
+	try:
+		pending = collections.deque()
+		iterator = iter(items)
+		for item in iterator:
+			pending.append((item, executor.submit(function, item)))
+			if len(pending) >= 2 * workers:
+				break
+		while len(pending) > 0:
+			metrics.gauge("queue.ordered_map", len(pending))
+			item, future = pending.popleft()
+			result = future.result()
+			for next_item in iterator:
+				pending.append((next_item, executor.submit(function, next_item)))
+				break
+			yield item, result
+	finally:
+		if should_shutdown:
+			executor.shutdown(wait=True, cancel_futures=True)
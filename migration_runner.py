@@ -0,0 +1,207 @@
+"""
+The `migration_runner.py` module runs the migration jobs of a config file in one process, without prompts, for migrations of many projects.
+The jobs share one login, one api client, so the concurrency budget of the requests is global, one journal and one upload cache; several jobs run at the same time.
+Usage:
+	python manage.py migrate --config jobs.yaml
+	python migration_runner.py --config jobs.yaml --check
+The config file, YAML or JSON (YAML is indented with spaces):
+	labii:
+	  base_url: https://www.labii.dev
+	  organization_sid: TWZ30a40x24bcV16afkpu
+	  email: me@example.com # the password is read from the environment variable LABII_PASSWORD, or api_key_env: LABII_API_KEY
+	parallel_jobs: 4 # the jobs run at the same time, default 1
+	options: # the options of the migrate scripts for all the jobs, for example max-concurrency, the most concurrent api requests of all the jobs
+	  max-concurrency: 16
+	  batch-size: 20
+	defaults: # the settings of all the jobs
+	  project_sid: HKNQ0a40x271cJOTY49di
+	  table_entry_sid: 69be0a40xfff68chmrwBG
+	  table_file_sid: 58ad0a40xfff57bglqvAF
+	jobs:
+	  - type: files # migrate_file_as_entry, or excel, benchling, plasmids
+	    folder: /data/project 1
+	    workers: 4 # the options of the migrate script for this job
+	  - type: excel
+	    file: /data/project 2/results.xlsx
+	    project_sid: GJMP0a40x160bINSX38ch
+	    stream: true
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from migration_journal import MigrationJournal
+from migration_metrics import metrics
+from migrate_file_as_entry import open_client, open_labii, open_metrics, close_metrics, open_upload_cache
+
+JOB_MODULES = {
+	"files": "migrate_file_as_entry",
+	"excel": "migrate_excel_sheet_as_entry",
+	"benchling": "migrate_benchling_entries",
+	"plasmids": "migrate_benchling_plasminds"
+}
+# the settings of a job in the config -> the settings of the migrate scripts
+SETTING_NAMES = {
+	"project_sid": "labii_project_sid",
+	"table_entry_sid": "labii_table_entry_sid",
+	"table_file_sid": "labii_table_file_sid",
+	"table_plasmid_sid": "labii_table_plasmid_sid",
+	"column_benchling_sid": "labii_column_benchling_sid",
+	"folder": "folder_path",
+	"file": "file_path",
+	"folder_gb": "folder_path_gb"
+}
+REQUIRED_SETTINGS = {
+	"files": ["project_sid", "table_entry_sid", "table_file_sid", "folder"],
+	"excel": ["project_sid", "table_entry_sid", "table_file_sid", "file"],
+	"benchling": ["project_sid", "table_entry_sid", "table_file_sid", "folder"],
+	"plasmids": ["table_file_sid", "table_plasmid_sid", "folder_gb"]
+}
+# the options that are shared by all the jobs, they are only read from the options of the config
+GLOBAL_OPTIONS = ["journal", "upload_cache", "no_upload_cache", "chunked_upload_threshold", "chunk_size", "rate", "max_concurrency", "retries", "metrics", "profile_sample", "profile_dir"]
+
+def load_config(path):
+	""" return the config of the YAML or JSON file """
+	with open(path, "r", encoding="utf-8") as file:
+		if path.endswith(".json"):
+			config = json.load(file)
+		else:
+			try:
+				import yaml#pylint: disable=import-outside-toplevel
+			except ImportError as error:
+				raise ValueError(f"Error: PyYAML is required to read {path}, pip install pyyaml or use a JSON config!") from error
+			config = yaml.safe_load(file)
+	if not isinstance(config, dict):
+		raise ValueError(f"Error: the config {path} is not a mapping!")
+	labii = config.get("labii") or {}
+	for name in ("base_url", "organization_sid"):
+		if not name in labii:
+			raise ValueError(f"Error: labii.{name} is missing in the config {path}!")
+	if not isinstance(config.get("jobs"), list) or len(config["jobs"]) == 0:
+		raise ValueError(f"Error: no jobs in the config {path}!")
+	return config
+
+def option_name(name):
+	""" return the attribute of the argument of a config option, for example max-concurrency -> max_concurrency """
+	return name.replace("-", "_")
+
+def prepare_job(config, job, index):
+	"""
+		return (name, module name, settings, args) of a job of the config
+		- the args are the defaults of the migrate script, updated with the options of the config and of the job
+		- raise ValueError if the job is not valid, before any job is run
+	"""
+	job = dict(job)
+	job_type = job.pop("type", None)
+	if not job_type in JOB_MODULES:
+		raise ValueError(f"Error: the type of job {index + 1} must be one of {', '.join(JOB_MODULES)}!")
+	name = str(job.pop("name", f"{index + 1} {job_type}"))
+	settings = {
+		"labii_base_url": config["labii"]["base_url"],
+		"labii_organization_sid": config["labii"]["organization_sid"]
+	}
+	values = dict(config.get("defaults") or {})
+	options = {}
+	for key, value in job.items():
+		if key in SETTING_NAMES:
+			values[key] = value
+		else:
+			options[option_name(key)] = value
+	for key in REQUIRED_SETTINGS[job_type]:
+		if values.get(key) in (None, ""):
+			raise ValueError(f"Error: the setting {key} of the job {name} is missing!")
+	for key, value in values.items():
+		if not key in SETTING_NAMES:
+			raise ValueError(f"Error: unknown setting {key} in the defaults!")
+		settings[SETTING_NAMES[key]] = str(value).rstrip("/") if key.startswith("folder") else value
+	args = importlib.import_module(JOB_MODULES[job_type]).parse_arguments([])
+	for source, values in (("options", {option_name(key): value for key, value in (config.get("options") or {}).items()}), (f"job {name}", options)):
+		for key, value in values.items():
+			if not hasattr(args, key):
+				raise ValueError(f"Error: unknown option {key} in {source}!")
+			if source != "options" and key in GLOBAL_OPTIONS:
+				raise ValueError(f"Error: the option {key} is shared by all the jobs, set it in the options of the config!")
+			setattr(args, key, value)
+	return name, JOB_MODULES[job_type], settings, args
+
+def login(labii, config):
+	""" log in once for all the jobs, with the api key of labii.api_key_env, or labii.email and the password of labii.password_env (default LABII_PASSWORD) """
+	credentials = config["labii"]
+	if credentials.get("api_key_env"):
+		labii.api.api_key = os.environ.get(credentials["api_key_env"])
+		if not labii.api.api_key:
+			raise ValueError(f"Error: the environment variable {credentials['api_key_env']} is not set!")
+		return
+	password = os.environ.get(credentials.get("password_env", "LABII_PASSWORD"))
+	if not credentials.get("email") or not password:
+		raise ValueError(f"Error: labii.email and the environment variable {credentials.get('password_env', 'LABII_PASSWORD')} are required to log in!")
+	labii.api.login(email=credentials["email"], password=password)
+
+def run_job(labii, journal, job):
+	""" run a prepared job, return (name, seconds, error), error is None if the job finished """
+	name, module_name, settings, args = job
+	print(f"Job {name}: started")
+	start = time.perf_counter()
+	try:
+		with metrics.timer(f"job.{module_name}"):
+			importlib.import_module(module_name).run_job(labii, settings, journal, args)
+		error = None
+	except Exception as exception:#pylint: disable=broad-exception-caught
+		# a failed job does not stop the other jobs, its items are retried by the next run
+		error = f"{type(exception).__name__}: {exception}"
+	seconds = time.perf_counter() - start
+	print(f"Job {name}: {'finished' if error is None else f'FAILED ({error})'} in {seconds:.1f}s")
+	return name, seconds, error
+
+def run_config(config):
+	""" run the jobs of the config, return the list of (name, seconds, error) of the jobs in the order they finished """
+	jobs = [prepare_job(config, job, index) for index, job in enumerate(config["jobs"])]
+	# the shared objects use the options of the config, the same in the args of all the jobs
+	args = jobs[0][3]
+	open_metrics(args)
+	client = open_client(args)
+	labii = open_labii({"labii_base_url": config["labii"]["base_url"], "labii_organization_sid": config["labii"]["organization_sid"]}, client)
+	login(labii, config)
+	labii, cache = open_upload_cache(labii, args)
+	results = []
+	with MigrationJournal(args.journal) as journal:
+		with ThreadPoolExecutor(max_workers=max(1, int(config.get("parallel_jobs", 1)))) as executor:
+			futures = [executor.submit(run_job, labii, journal, job) for job in jobs]
+			for future in as_completed(futures):
+				results.append(future.result())
+		journal.report_errors()
+	failed = [name for name, _, error in results if error is not None]
+	print(f"Jobs: {len(results) - len(failed)} finished, {len(failed)} failed{': ' + ', '.join(failed) if len(failed) > 0 else ''}")
+	print(client.report())
+	close_metrics(args)
+	if cache is not None:
+		print(cache.report())
+		cache.close()
+	return results
+
+def parse_arguments(argv=None):
+	""" return the command line arguments, of argv if provided """
+	parser = argparse.ArgumentParser(description="Run the migration jobs of a config file without prompts.")
+	parser.add_argument("--config", required=True, help="the YAML or JSON file of the jobs")
+	parser.add_argument("--check", action="store_true", help="check the config and print the jobs, without running them")
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	""" run the jobs of the config """
+	args = parse_arguments(argv)
+	config = load_config(args.config)
+	if args.check:
+		for index, job in enumerate(config["jobs"]):
+			name, module_name, settings, _ = prepare_job(config, job, index)
+			print(f"{name}: {module_name} {settings}")
+		print(f"Checked {len(config['jobs'])} jobs")
+		return
+	results = run_config(config)
+	if any(error is not None for _, _, error in results):
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
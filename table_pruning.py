@@ -0,0 +1,115 @@
+"""
+The `table_pruning.py` module removes the empty rows and the trailing empty columns of big tables.
+The emptiness of the cells of a table is read into a boolean matrix in one pass over its rows, the rows and columns to remove are computed on the matrix with NumPy, then removed in bulk.
+The tables with merged cells (colspan or rowspan) are not pruned, as their cells are not aligned in columns.
+NumPy and bs4 are imported by the first table pruned.
+"""
+
+MIN_ROWS = 500 # only the tables with more rows are pruned
+
+def row_cells(row):
+	""" return the td cells of a row """
+	# only the tags have a name, the strings have None
+	return [child for child in row.contents if child.name == 'td']
+
+def has_spans(cells):
+	""" return True if one of the cells spans several columns or rows """
+	# most cells have no attributes
+	return any(cell.attrs and (cell.attrs.get("colspan", "1") != "1" or cell.attrs.get("rowspan", "1") != "1") for cell in cells)
+
+def empty_cells(cells):
+	""" return for each cell True if it has no text, same as not any(cell.stripped_strings) """
+	from bs4 import NavigableString#pylint: disable=import-outside-toplevel
+	flags = []
+	for cell in cells:
+		contents = cell.contents
+		if len(contents) == 0:
+			flags.append(True)
+		# most cells only have a string
+		elif len(contents) == 1 and type(contents[0]) is NavigableString:#pylint: disable=unidiomatic-typecheck
+			flags.append(not contents[0].strip())
+		else:
+			flags.append(next(cell.stripped_strings, None) is None)
+	return flags
+
+def empty_matrix(rows_flags):
+	""" return the boolean matrix of the empty cells from the flags of each row, the missing cells of the short rows are empty """
+	import numpy as np#pylint: disable=import-outside-toplevel
+	columns = max([1] + [len(flags) for flags in rows_flags])
+	matrix = np.ones((len(rows_flags), columns), dtype=bool)
+	for index, flags in enumerate(rows_flags):
+		matrix[index, :len(flags)] = flags
+	return matrix
+
+def plan_pruning(empty, min_rows=MIN_ROWS, spans=False):
+	"""
+		return (rows to delete, number of columns to keep) of a table from its matrix of empty cells
+		- a row is deleted if all its cells but the first one, the row label, are empty
+		- the trailing columns empty in all the kept rows are deleted, the first column is kept
+		- spans, the table has merged cells, nothing is deleted
+	"""
+	import numpy as np#pylint: disable=import-outside-toplevel
+	if len(empty) <= min_rows or spans:
+		return np.zeros(len(empty), dtype=bool), empty.shape[1]
+	delete = empty[:, 1:].all(axis=1)
+	kept_columns = ~empty[~delete].all(axis=0)
+	kept_columns[0] = True
+	return delete, int(np.flatnonzero(kept_columns)[-1]) + 1
+
+def group_rows_by_table(rows):
+	""" return {id of the table: [rows]} of the rows grouped by their closest table, in the order of the rows """
+	tables = {}
+	for row in rows:
+		table = row.parent
+		while table is not None and table.name != 'table':
+			table = table.parent
+		tables.setdefault(id(table), []).append(row)
+	return tables
+
+def extract_all(elements, max_extract=32):
+	"""
+		remove the elements from the tree
+		- extract() looks up the index of each element in its parent, removing thousands of rows one by one is quadratic
+		- so above max_extract elements of a parent, all its children are extracted, the first one is found at once, and the kept ones appended again
+	"""
+	parents = {}
+	for element in elements:
+		if element.parent is not None:
+			parents.setdefault(id(element.parent), (element.parent, set()))[1].add(id(element))
+	for parent, element_ids in parents.values():
+		if len(element_ids) <= max_extract:
+			for child in [child for child in parent.contents if id(child) in element_ids]:
+				child.extract()
+			continue
+		kept = [child for child in parent.contents if not id(child) in element_ids]
+		parent.clear()
+		parent.extend(kept)
+
+def table_stats(empty, delete, keep, spans=False):
+	""" return the statistics of the pruning of a table """
+	return {
+		"rows": empty.shape[0],
+		"columns": empty.shape[1],
+		"deleted_rows": int(delete.sum()),
+		"deleted_columns": empty.shape[1] - keep,
+		"spans": spans
+	}
+
+def prune_table(rows, min_rows=MIN_ROWS):
+	""" remove the empty rows and the trailing empty columns of the rows of a table, return the statistics of the table """
+	cells = [row_cells(row) for row in rows]
+	empty = empty_matrix([empty_cells(row) for row in cells])
+	spans = any(has_spans(row) for row in cells)
+	delete, keep = plan_pruning(empty, min_rows, spans)
+	removed = []
+	for row, row_cells_, deleted in zip(rows, cells, delete):
+		if deleted:
+			removed.append(row)
+		else:
+			removed.extend(row_cells_[keep:])
+	extract_all(removed)
+	return table_stats(empty, delete, keep, spans)
+
+def prune_tables(rows, min_rows=MIN_ROWS):
+	""" prune the tables of the rows with more than min_rows rows, return the list of the statistics of each table """
+	return [prune_table(table_rows, min_rows) for table_rows in group_rows_by_table(rows).values()]
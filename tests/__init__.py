@@ -0,0 +1,3 @@
+"""
+The tests of the migration, run with `python manage.py test` or `python -m unittest discover tests` from the root of the repository.
+"""
@@ -0,0 +1,115 @@
+"""
+Test the BatchWriter against a FakeLabiiServer: the detection of the bulk endpoint, the batches of creates and modifies, and the failed bulk batches.
+"""
+import io
+import json
+import time
+import unittest
+import contextlib
+from fake_labii import FakeLabiiServer
+from labii_batch import BatchWriter, is_success
+from labii_client import AdaptiveClient
+from migrate_file_as_entry import open_labii
+
+TABLE_SID = "testentry0a40xtable"
+
+def open_fake_labii(server):
+	""" return the logged in labii object of the server """
+	labii = open_labii({"labii_base_url": server.base_url, "labii_organization_sid": server.organization__sid}, AdaptiveClient(backoff=0.01))
+	labii.api.login(email="test@labii.com", password="test")
+	return labii
+
+def entries(server):
+	""" return the names of the entries created in the server """
+	return sorted(record["name"] for record in server.records.values() if record["table"]["sid"] == TABLE_SID)
+
+class BatchWriterTest(unittest.TestCase):
+	""" BatchWriter """
+
+	def setUp(self):
+		# the writer prints the bulk detection and the errors
+		stack = contextlib.ExitStack()
+		stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+		self.addCleanup(stack.close)
+
+	def create(self, labii, count, batch_size=5):
+		""" create count entries in batches, return the writer and the responses """
+		with BatchWriter(labii.Record, "create", query=f"table__sid={TABLE_SID}", batch_size=batch_size, max_delay=60) as writer:
+			futures = [writer.add(f"source {index}", {"name": f"entry {index:02d}", "projects": []}) for index in range(count)]
+		return writer, [future.result() for future in futures]
+
+	def test_bulk_create(self):
+		""" a server with the bulk endpoint receives one request per batch """
+		with FakeLabiiServer(bulk=True) as server:
+			writer, responses = self.create(open_fake_labii(server), 12)
+			self.assertTrue(writer.bulk)
+			self.assertTrue(all(is_success(response) for response in responses))
+			self.assertEqual(entries(server), [f"entry {index:02d}" for index in range(12)])
+			self.assertEqual(server.stats["requests"].get("record_bulk_create"), 3)
+			self.assertNotIn("record_create", server.stats["requests"])
+			self.assertEqual(writer.errors, [])
+
+	def test_bulk_not_supported(self):
+		""" a 400, 404 or 405 to the first bulk request sends the batches as single requests """
+		for status in (400, 404, 405):
+			with self.subTest(status=status), FakeLabiiServer(bulk=True) as server:
+				route = server.route
+				def no_bulk(method, path, body, headers, route=route, status=status):
+					if isinstance(json.loads(body or b"{}"), list):
+						return status, {"detail": "Not supported."}
+					return route(method, path, body, headers)
+				server.route = no_bulk
+				writer, responses = self.create(open_fake_labii(server), 12)
+				self.assertIs(writer.bulk, False)
+				self.assertEqual(writer.stats["bulk_requests"], 1)
+				self.assertEqual(writer.stats["single_requests"], 12)
+				self.assertTrue(all(is_success(response) for response in responses))
+				self.assertEqual(entries(server), [f"entry {index:02d}" for index in range(12)])
+
+	def test_modify_sections(self):
+		""" the modifies are sent in batches with the bulk endpoint, and as single requests without it """
+		for bulk in (True, False):
+			with self.subTest(bulk=bulk), FakeLabiiServer(bulk=bulk) as server:
+				labii = open_fake_labii(server)
+				with BatchWriter(labii.Section, "modify", batch_size=4, max_delay=60) as writer:
+					futures = [writer.add(f"plasmid {index}", {"data": [index]}, sid=f"SEC{index}") for index in range(10)]
+				self.assertTrue(all(future.result() for future in futures))
+				self.assertEqual(server.sections, {f"SEC{index}": {"data": [index]} for index in range(10)})
+				if bulk:
+					self.assertEqual(server.stats["requests"].get("section_bulk_modify"), 3)
+				else:
+					self.assertEqual(server.stats["requests"].get("section_modify"), 10)
+		with self.assertRaises(ValueError):
+			BatchWriter(labii.Section, "modify").add("plasmid", {"data": []})
+
+	def test_failed_bulk_not_sent_again(self):
+		""" once the bulk endpoint worked, the items of a failed bulk request are errors and are not sent again one by one """
+		with FakeLabiiServer(bulk=True) as server:
+			route = server.route
+			bulk_requests = []
+			def failing_bulk(method, path, body, headers):
+				if isinstance(json.loads(body or b"{}"), list):
+					bulk_requests.append(path)
+					if len(bulk_requests) == 2:
+						return 500, {"detail": "Server error."}
+				return route(method, path, body, headers)
+			server.route = failing_bulk
+			writer, responses = self.create(open_fake_labii(server), 12)
+			self.assertEqual(len(bulk_requests), 3)
+			self.assertNotIn("record_create", server.stats["requests"])
+			self.assertEqual(len(entries(server)), 7)
+			self.assertEqual([source for source, _ in writer.errors], [f"source {index}" for index in range(5, 10)])
+			self.assertEqual([is_success(response) for response in responses], [True] * 5 + [False] * 5 + [True] * 2)
+
+	def test_add_does_not_wait(self):
+		""" a full batch is sent by a thread of the writer, add returns before the response """
+		with FakeLabiiServer(bulk=True, latency=0.5) as server:
+			labii = open_fake_labii(server)
+			with BatchWriter(labii.Record, "create", query=f"table__sid={TABLE_SID}", batch_size=2, max_delay=60) as writer:
+				start = time.perf_counter()
+				futures = [writer.add(f"source {index}", {"name": f"entry {index}", "projects": []}) for index in range(4)]
+				self.assertLess(time.perf_counter() - start, 0.4)
+			self.assertTrue(all(is_success(future.result()) for future in futures))
+
+if __name__ == "__main__":
+	unittest.main()
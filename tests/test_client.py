@@ -0,0 +1,72 @@
+"""
+Test that a migration survives a throttled and failing server: the AdaptiveClient slows down, and an item whose request failed is recorded as an error without stopping the run.
+"""
+import io
+import os
+import time
+import tempfile
+import unittest
+import contextlib
+from benchmark import BENCH_SETTINGS, generate_file_tree
+from fake_labii import FakeLabiiServer
+from labii_client import AdaptiveClient
+from labii_upload import ChunkedUploadLabiiObject
+from migration_journal import MigrationJournal
+from directory_scan import scan_sources
+from migrate_file_as_entry import open_labii, migrate_files_in_pool
+
+def open_fake_labii(server, client):
+	""" return the settings and the logged in labii object of the server """
+	settings = dict(BENCH_SETTINGS, labii_base_url=server.base_url, labii_organization_sid=server.organization__sid)
+	labii = open_labii(settings, client)
+	labii.api.login(email="test@labii.com", password="test")
+	labii = ChunkedUploadLabiiObject(labii)
+	labii.get_file_table()
+	return settings, labii
+
+class FlakyServerTest(unittest.TestCase):
+	""" migrate_files_in_pool against a FakeLabiiServer that throttles and fails """
+
+	def test_throttled(self):
+		""" the run finishes with every file migrated, and the concurrency limit shrinks below its start """
+		files = 16
+		with tempfile.TemporaryDirectory() as folder:
+			source = os.path.join(folder, "source")
+			os.makedirs(source)
+			generate_file_tree(source, files=files, folders=0, size=1024)
+			with FakeLabiiServer(latency=0.01, capacity=2, failure_rate=0.2, seed=1) as server, MigrationJournal(os.path.join(folder, "journal.sqlite")) as journal:
+				client = AdaptiveClient(initial_concurrency=8, max_concurrency=8, retries=10, backoff=0.01, max_backoff=0.1)
+				settings, labii = open_fake_labii(server, client)
+				with contextlib.redirect_stdout(io.StringIO()):
+					migrate_files_in_pool(labii, scan_sources(source), settings, 8, journal)
+				self.assertEqual(journal.errors, [])
+				self.assertEqual(len(journal.done), files)
+				self.assertGreater(server.stats["throttled"], 0)
+				self.assertGreater(server.stats["failures"], 0)
+				self.assertGreater(client.stats["retries"], 0)
+				self.assertLess(client.limiter.limit, 8)
+
+	def test_request_error(self):
+		""" a create that times out is recorded as the error of its file, the other files are migrated """
+		with tempfile.TemporaryDirectory() as folder:
+			source = os.path.join(folder, "source")
+			os.makedirs(source)
+			generate_file_tree(source, files=6, folders=0, size=1024)
+			with FakeLabiiServer() as server, MigrationJournal(os.path.join(folder, "journal.sqlite")) as journal:
+				route = server.route
+				def slow_route(method, path, body, headers):
+					# the entry of file 3 is created too slowly, the POST is not sent again
+					if method == "POST" and b'"name":"file 3"' in (body or b""):
+						time.sleep(1.5)
+					return route(method, path, body, headers)
+				server.route = slow_route
+				client = AdaptiveClient(timeout=0.5, backoff=0.01)
+				settings, labii = open_fake_labii(server, client)
+				with contextlib.redirect_stdout(io.StringIO()):
+					migrate_files_in_pool(labii, scan_sources(source), settings, 2, journal)
+				self.assertEqual(len(journal.done), 5)
+				self.assertEqual([os.path.basename(key) for key, _ in journal.errors], ["file 3.dat"])
+				self.assertIn("api request failed", journal.errors[0][1])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,66 @@
+"""
+Test the scans of directory_scan.py against os.walk and glob, with hidden files and folders and links.
+"""
+import io
+import os
+import glob
+import tempfile
+import unittest
+import contextlib
+from directory_scan import scan_tree, scan_sources
+from migrate_benchling_plasminds import copy_gb_files
+
+class DirectoryScanTest(unittest.TestCase):
+	""" scan_tree, scan_sources and the index of copy_gb_files """
+
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()#pylint: disable=consider-using-with
+		self.source = os.path.join(self.folder.name, "source")
+		for path in ["a.gb", "b.txt", ".hidden.gb", "sub/c.gb", "sub/deep/d.gb", ".git/e.gb", "folder/f.gb", "outside/g.gb"]:
+			path = os.path.join(self.source if not path.startswith("outside") else self.folder.name, path)
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			with open(path, "w", encoding="utf-8") as file:
+				file.write(path)
+		# a link to a folder is not followed
+		os.symlink(os.path.join(self.folder.name, "outside"), os.path.join(self.source, "sub", "linked"))
+
+	def add_broken_link(self):
+		""" add a link to a missing file, listed by os.walk and glob """
+		os.symlink(os.path.join(self.folder.name, "missing.gb"), os.path.join(self.source, "sub", "broken.gb"))
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def test_scan_tree(self):
+		""" the same files as os.walk, hidden ones included """
+		self.add_broken_link()
+		expected = sorted(os.path.join(root, name) for root, _, files in os.walk(self.source) for name in files if name.endswith(".gb"))
+		self.assertIn(os.path.join(self.source, ".git", "e.gb"), expected)
+		for workers in (1, 4):
+			with self.subTest(workers=workers):
+				self.assertEqual(sorted(entry.path for entry in scan_tree(self.source, ".gb", workers=workers)), expected)
+
+	def test_scan_sources(self):
+		""" the same sources and attachments as glob on the folder """
+		self.add_broken_link()
+		expected = sorted(glob.glob(f"{self.source}/*"))
+		sources = sorted(scan_sources(self.source), key=lambda source: source.path)
+		self.assertEqual([source.path for source in sources], expected)
+		attachments = {os.path.basename(source.path): source.attachments for source in sources}
+		self.assertEqual(attachments["sub"], sorted(glob.glob(f"{self.source}/sub/*.*")))
+
+	def test_copy_gb_files(self):
+		""" the index of the files where they are finds the same files as the index of the copied files """
+		with contextlib.redirect_stdout(io.StringIO()):
+			copied = copy_gb_files(self.source, os.path.join(self.folder.name, "copied"), mode="copy")
+		indexed = copy_gb_files(self.source, mode="index")
+		for key in ["", "a", "e", "hidden", "d"]:
+			with self.subTest(key=key):
+				self.assertEqual(
+					sorted(os.path.basename(path) for path in indexed.find(key)),
+					sorted(os.path.basename(path) for path in copied.find(key))
+				)
+		self.assertEqual(sorted(os.path.basename(path) for path in copied.find("")), ["a.gb", "c.gb", "d.gb", "e.gb", "f.gb"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,90 @@
+"""
+Test the delta migration of the journal: a source is migrated again once it changed, even if the run stopped before its new entry.
+"""
+import os
+import tempfile
+import unittest
+from migration_journal import MigrationJournal
+
+def migrate(journal, key, path, uid):
+	""" the steps of a migration of the source, the hash then the entry """
+	journal.ensure_hash(key, path)
+	journal.record_entry(key, {"sid": f"sid{uid}", "uid": uid, "name": os.path.basename(path)})
+
+class DeltaTest(unittest.TestCase):
+	""" MigrationJournal.changed and invalidate """
+
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()#pylint: disable=consider-using-with
+		self.journal_path = os.path.join(self.folder.name, "journal.sqlite")
+		self.path = os.path.join(self.folder.name, "source.txt")
+		self.key = os.path.abspath(self.path)
+		self.write("first")
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def write(self, content, mtime_ns=None):
+		""" write the source, with a new mtime """
+		with open(self.path, "w", encoding="utf-8") as file:
+			file.write(content)
+		stat = os.stat(self.path)
+		mtime_ns = stat.st_mtime_ns + 10 ** 9 if mtime_ns is None else mtime_ns
+		os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+	def test_new_and_unchanged(self):
+		""" a new source is changed, then unchanged once its entry is recorded, even with a new mtime and the same content """
+		with MigrationJournal(self.journal_path) as journal:
+			self.assertTrue(journal.changed(self.key, self.path))
+			migrate(journal, self.key, self.path, "EN1")
+			self.assertFalse(journal.changed(self.key, self.path))
+			self.write("first")
+			self.assertFalse(journal.changed(self.key, self.path))
+			self.assertTrue(journal.is_done(self.key))
+
+	def test_changed(self):
+		""" a changed source is not done, its uploads are cleared and its entry kept to be updated """
+		with MigrationJournal(self.journal_path) as journal:
+			journal.changed(self.key, self.path)
+			journal.ensure_hash(self.key, self.path)
+			journal.uploaded(self.key, "attachment", lambda: {"sid": "FI1", "uid": "FI1", "name": "attachment", "version": {"sid": "V1"}})
+			journal.record_entry(self.key, {"sid": "sidEN1", "uid": "EN1", "name": "source"})
+			self.write("second content")
+			self.assertTrue(journal.changed(self.key, self.path))
+			self.assertFalse(journal.is_done(self.key))
+			self.assertIsNone(journal.get(self.key, "upload", name="attachment"))
+			self.assertEqual(journal.get(self.key, "entry")["uid"], "EN1")
+
+	def test_changed_then_crash(self):
+		""" a source migrated before the manifest, changed, and the run stopped before its new entry: the next run migrates it again """
+		with MigrationJournal(self.journal_path) as journal:
+			# migrated without --delta, no fingerprint is saved
+			migrate(journal, self.key, self.path, "EN1")
+		self.write("second content")
+		with MigrationJournal(self.journal_path) as journal:
+			self.assertTrue(journal.changed(self.key, self.path))
+			# the run hashes the source again, then stops before the entry
+			journal.ensure_hash(self.key, self.path)
+		with MigrationJournal(self.journal_path) as journal:
+			self.assertFalse(journal.is_done(self.key))
+			self.assertTrue(journal.changed(self.key, self.path))
+			migrate(journal, self.key, self.path, "EN1")
+		with MigrationJournal(self.journal_path) as journal:
+			self.assertTrue(journal.is_done(self.key))
+			self.assertFalse(journal.changed(self.key, self.path))
+
+	def test_changed_with_manifest_then_crash(self):
+		""" a source of the manifest, changed, and the run stopped before its new entry: the next run migrates it again """
+		with MigrationJournal(self.journal_path) as journal:
+			journal.changed(self.key, self.path)
+			migrate(journal, self.key, self.path, "EN1")
+		self.write("second content")
+		with MigrationJournal(self.journal_path) as journal:
+			self.assertTrue(journal.changed(self.key, self.path))
+		with MigrationJournal(self.journal_path) as journal:
+			self.assertTrue(journal.changed(self.key, self.path))
+			migrate(journal, self.key, self.path, "EN1")
+			self.assertFalse(journal.changed(self.key, self.path))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,40 @@
+"""
+Test that the parsers of the Benchling entries, and the stream transform of the large entries, give the same entries.
+"""
+import io
+import tempfile
+import unittest
+import contextlib
+import migrate_benchling_entries as benchling
+from benchmark import generate_benchling_entry
+
+class ParserConformanceTest(unittest.TestCase):
+	""" check_parser_conformance on synthetic entries """
+
+	@classmethod
+	def setUpClass(cls):
+		cls.folder = tempfile.TemporaryDirectory()#pylint: disable=consider-using-with
+		cls.files = [generate_benchling_entry(cls.folder.name, str(index), days=3, items=10, tables=1, rows=50) for index in range(2)]
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.folder.cleanup()
+
+	def test_same_output(self):
+		""" every parser and the stream transform give the body html of html.parser """
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.assertEqual(benchling.check_parser_conformance(self.files), [])
+
+	def test_same_files(self):
+		""" every parser finds the same attachments, in the same order """
+		for current_file in self.files:
+			expected = benchling.prepare_entry(current_file)
+			self.assertGreater(len(expected[1]), 0)
+			self.assertIn("<table", expected[0])
+			for parser in benchling.PARSERS[1:]:
+				with self.subTest(parser=parser):
+					self.assertEqual(benchling.prepare_entry(current_file, parser=parser)[1], expected[1])
+			self.assertEqual(benchling.prepare_entry(current_file, stream_threshold=0)[1], expected[1])
+
+if __name__ == "__main__":
+	unittest.main()
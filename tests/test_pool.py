@@ -0,0 +1,102 @@
+"""
+Test the thread pool of the migration: the order of ordered_map, and migrate_files_in_pool against a FakeLabiiServer.
+"""
+import io
+import os
+import time
+import random
+import tempfile
+import unittest
+import contextlib
+from benchmark import BENCH_SETTINGS, generate_file_tree
+from fake_labii import FakeLabiiServer
+from labii_client import AdaptiveClient
+from labii_upload import ChunkedUploadLabiiObject
+from migration_journal import MigrationJournal
+from migration_pool import ordered_map
+from directory_scan import scan_sources
+from migrate_file_as_entry import open_labii, migrate_files_in_pool
+
+class OrderedMapTest(unittest.TestCase):
+	""" ordered_map """
+
+	def test_order(self):
+		""" the results are yielded in the order of the items, whatever the order they finish in """
+		generator = random.Random(0)
+		delays = [generator.uniform(0, 0.01) for _ in range(50)]
+		def work(index):
+			time.sleep(delays[index])
+			return index * 2
+		self.assertEqual(list(ordered_map(work, range(50), workers=8)), [(index, index * 2) for index in range(50)])
+
+	def test_bounded(self):
+		""" at most 2 x workers items are submitted ahead of the one being yielded """
+		consumed = [0]
+		def items():
+			for index in range(100):
+				consumed[0] += 1
+				yield index
+		for index, _ in ordered_map(lambda item: item, items(), workers=4):
+			self.assertLessEqual(consumed[0], index + 1 + 2 * 4)
+
+	def test_exception(self):
+		""" the exception of an item is raised when the item is yielded """
+		def work(index):
+			if index == 3:
+				raise ValueError("Error: item 3!")
+			return index
+		results = []
+		with self.assertRaises(ValueError):
+			for index, _ in ordered_map(work, range(10), workers=4):
+				results.append(index)
+		self.assertEqual(results, [0, 1, 2])
+
+class MigrateFilesInPoolTest(unittest.TestCase):
+	""" migrate_files_in_pool against a FakeLabiiServer """
+
+	def test_migrate(self):
+		""" every file and folder is migrated once, the progress is printed in order, and the concurrent requests stay under max_concurrency """
+		files, folders = 12, 3
+		with tempfile.TemporaryDirectory() as folder:
+			source = os.path.join(folder, "source")
+			os.makedirs(source)
+			generate_file_tree(source, files=files, folders=folders, size=4 * 1024)
+			with FakeLabiiServer(latency=0.005) as server, MigrationJournal(os.path.join(folder, "journal.sqlite")) as journal:
+				settings = dict(BENCH_SETTINGS, labii_base_url=server.base_url, labii_organization_sid=server.organization__sid)
+				client = AdaptiveClient(initial_concurrency=3, max_concurrency=3)
+				labii = open_labii(settings, client)
+				labii.api.login(email="test@labii.com", password="test")
+				labii = ChunkedUploadLabiiObject(labii)
+				labii.get_file_table()
+				output = io.StringIO()
+				with contextlib.redirect_stdout(output):
+					migrate_files_in_pool(labii, scan_sources(source), settings, 4, journal)
+				entries = [record for record in server.records.values() if record["table"]["sid"] == settings["labii_table_entry_sid"]]
+				self.assertEqual(len(journal.done), files + folders)
+				self.assertEqual(journal.errors, [])
+				self.assertEqual(len(entries), files + folders)
+				self.assertLessEqual(server.stats["max_concurrency"], 3)
+				self.assertGreater(server.stats["uploaded_bytes"], 0)
+				indexes = [int(line.split(" ")[0]) for line in output.getvalue().splitlines() if line[:1].isdigit()]
+				self.assertEqual(indexes, list(range(1, files + folders + 1)))
+
+	def test_skip_migrated(self):
+		""" a second run skips the files of the journal and creates no entry """
+		with tempfile.TemporaryDirectory() as folder:
+			source = os.path.join(folder, "source")
+			os.makedirs(source)
+			generate_file_tree(source, files=4, folders=1, size=1024)
+			with FakeLabiiServer() as server, MigrationJournal(os.path.join(folder, "journal.sqlite")) as journal:
+				settings = dict(BENCH_SETTINGS, labii_base_url=server.base_url, labii_organization_sid=server.organization__sid)
+				labii = ChunkedUploadLabiiObject(open_labii(settings, AdaptiveClient()))
+				labii.api.login(email="test@labii.com", password="test")
+				labii.get_file_table()
+				with contextlib.redirect_stdout(io.StringIO()):
+					migrate_files_in_pool(labii, scan_sources(source), settings, 2, journal)
+					records = len(server.records)
+					migrate_files_in_pool(labii, scan_sources(source), settings, 2, journal)
+				self.assertEqual(len(server.records), records)
+				self.assertEqual(len(journal.done), 5)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,31 @@
+"""
+Test that the entry points do not import their heavy modules at startup. The import time is measured by `benchmark.py startup --startup-budget`, not by the tests.
+"""
+import os
+import sys
+import json
+import subprocess
+import unittest
+from benchmark import STARTUP_ENTRY_POINTS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def imported_modules(module):
+	""" return the top level names of sys.modules after `import module` in a new interpreter """
+	code = f"import sys, json, {module}; print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}})))"
+	result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+	return json.loads(result.stdout.splitlines()[-1])
+
+class StartupTest(unittest.TestCase):
+	""" the modules imported by each entry point """
+
+	def test_entry_points(self):
+		""" no heavy module of STARTUP_ENTRY_POINTS is in sys.modules after the import of the entry point """
+		for module, heavy_modules in STARTUP_ENTRY_POINTS.items():
+			with self.subTest(module=module):
+				modules = imported_modules(module)
+				self.assertIn(module, modules)
+				self.assertEqual([name for name in heavy_modules if name in modules], [], f"{module} imports heavy modules at startup")
+
+if __name__ == "__main__":
+	unittest.main()
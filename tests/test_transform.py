@@ -0,0 +1,58 @@
+"""
+Test that the transform engine gives the output of the baseline transforms called one after another, also for the items inside other items.
+"""
+import io
+import os
+import tempfile
+import unittest
+import contextlib
+from bs4 import BeautifulSoup
+from benchmark import FakeLabii, transform_with_chain, transform_with_engine, generate_benchling_entry
+
+DAY = '<div class="daySeparator"><span class="daySeparator-date">Monday, 01/02/2023</span></div>'
+
+class TransformEngineTest(unittest.TestCase):
+	""" transform_entry against the baseline chain """
+
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()#pylint: disable=consider-using-with
+		self.current_file = os.path.join(self.folder.name, "etr_test.html")
+		with open(self.current_file.replace(".html", " data.csv"), "w", encoding="utf-8") as file:
+			file.write("a,b\n")
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def assert_same_output(self, html):
+		""" the engine and the chain give the same body """
+		results = [
+			transform(BeautifulSoup(html, 'html.parser'), FakeLabii(), self.current_file, {"labii_project_sid": "test"})
+			for transform in (transform_with_chain, transform_with_engine)
+		]
+		self.assertEqual(results[1], results[0])
+
+	def test_nested_items(self):
+		""" an item inside another item is transformed before the outer item reads its text """
+		documents = {
+			"day in text": f'<div class="mediocre-item is-text">Moved from {DAY}</div>',
+			"day in code": f'<div class="mediocre-item is-code"><pre>x</pre>{DAY}</div>',
+			"text in code": '<div class="mediocre-item is-code"><pre>x</pre><div class="mediocre-item is-text">  note  </div></div>',
+			"day in file": f'<div class="mediocre-item is-file"><div class="note-itemName">data.csv</div>{DAY}</div>',
+			"code in header": '<table><tr><td><div class="mediocre-tableEditable-axisCell-labelWrapper"><div class="mediocre-item is-code"> a </div><span>a</span></div></td></tr></table>',
+			"text in text": '<div class="mediocre-item is-text"> a <div class="mediocre-item is-text"> b </div></div>',
+		}
+		for name, body in documents.items():
+			with self.subTest(name=name):
+				self.assert_same_output(f"<html><body>{body}</body></html>")
+
+	def test_generated_entry(self):
+		""" a synthetic entry of the benchmark """
+		current_file = generate_benchling_entry(self.folder.name, "generated", days=2, items=6, rows=600)
+		with open(current_file, "r", encoding="utf-8") as file:
+			html = file.read()
+		self.current_file = current_file
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.assert_same_output(html)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,103 @@
+"""
+Test the uploads of labii_upload.py against a FakeLabiiServer: the chunks, their resume, the multipart fallback and the small files, with failures injected by the server.
+"""
+import io
+import os
+import hashlib
+import tempfile
+import unittest
+import contextlib
+from fake_labii import FakeLabiiServer
+from labii_client import AdaptiveClient
+from labii_upload import ChunkedUploadLabiiObject, FileChunks, create_file_record, put_chunks, upload_large_file
+from migrate_file_as_entry import open_labii
+
+WORKSPACES = [{"sid": "testproject0a40xprj"}]
+
+def open_fake_labii(server):
+	""" return the logged in labii object of the server, small files below 64 KB """
+	labii = open_labii({"labii_base_url": server.base_url, "labii_organization_sid": server.organization__sid}, AdaptiveClient(backoff=0.01))
+	labii.api.login(email="test@labii.com", password="test")
+	return ChunkedUploadLabiiObject(labii, threshold=64 * 1024, chunk_size=64 * 1024)
+
+class UploadTest(unittest.TestCase):
+	""" upload_large_file, put_chunks and the small files of ChunkedUploadLabiiObject """
+
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()#pylint: disable=consider-using-with
+		self.large = self.write("large.bin", 5 * 64 * 1024 + 17)
+		self.small = self.write("small.bin", 1000)
+		# the uploads print their progress
+		stack = contextlib.ExitStack()
+		stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+		self.addCleanup(stack.close)
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def write(self, name, size):
+		""" write a file of random bytes, return its path """
+		path = os.path.join(self.folder.name, name)
+		with open(path, "wb") as file:
+			file.write(os.urandom(size))
+		return path
+
+	def test_chunks_with_failures(self):
+		""" the chunks that failed are sent again, the server receives the whole file once """
+		with FakeLabiiServer(chunked=True, failure_rate=0.3, seed=2) as server:
+			labii = open_fake_labii(server)
+			file_record = upload_large_file(labii.labii, self.large, WORKSPACES, chunk_size=64 * 1024, backoff=0.01)
+			self.assertIsNotNone(file_record)
+			self.assertGreater(server.stats["failures"], 0)
+			self.assertEqual(server.uploads[file_record["sid"]], os.path.getsize(self.large))
+			with open(self.large, "rb") as file:
+				self.assertEqual(server.chunks[file_record["sid"]][1].hexdigest(), hashlib.sha256(file.read()).hexdigest())
+			self.assertEqual(server.stats["uploaded_bytes"], os.path.getsize(self.large))
+
+	def test_resume(self):
+		""" a chunk received before its request failed is not sent again, the upload resumes from the Range of the status probe """
+		with FakeLabiiServer(chunked=True) as server:
+			labii = open_fake_labii(server)
+			# the second chunk is received but its answer fails, then its 3 retries fail: the server is asked where to resume
+			failures = iter([None, "after", "before", "before", "before"])
+			server.inject_failure = lambda: next(failures, None)
+			size = os.path.getsize(self.large)
+			file_record, _ = create_file_record(labii, "large.bin", size, WORKSPACES)
+			stats = {"retries": 0, "resumed": 0}
+			headers = labii.api.get_headers(True)
+			headers["Content-Type"] = "application/octet-stream"
+			with FileChunks(self.large, chunk_size=64 * 1024) as chunks:
+				response = put_chunks(labii, file_record["presigned_post"]["url"], chunks, headers, 3, 0.01, stats)
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(stats["resumed"], 1)
+			self.assertEqual(server.uploads[file_record["sid"]], size)
+			self.assertEqual(server.stats["uploaded_bytes"], size)
+
+	def test_multipart_fallback(self):
+		""" a server without chunks receives the file in one multipart post """
+		with FakeLabiiServer(chunked=False, failure_rate=0.3, seed=1) as server:
+			labii = open_fake_labii(server)
+			file_record = upload_large_file(labii.labii, self.large, WORKSPACES, chunk_size=64 * 1024, backoff=0.01)
+			self.assertIsNotNone(file_record)
+			self.assertGreater(server.uploads[file_record["sid"]], os.path.getsize(self.large))
+			self.assertNotIn(file_record["sid"], server.chunks)
+
+	def test_small_file_with_failures(self):
+		""" a small file post that failed is sent again from the start of the file """
+		for seed in (1, 3):
+			with self.subTest(seed=seed), FakeLabiiServer(failure_rate=0.5, seed=seed) as server:
+				labii = open_fake_labii(server)
+				file_record = labii.upload(self.small, WORKSPACES)
+				self.assertIsNotNone(file_record)
+				self.assertGreater(server.stats["failures"], 0)
+				# the multipart body holds the whole file
+				self.assertGreater(server.uploads[file_record["sid"]], os.path.getsize(self.small))
+
+	def test_small_file_failed(self):
+		""" a small file that could not be posted returns None, not the file record """
+		with FakeLabiiServer(failure_rate=1.0) as server:
+			labii = open_fake_labii(server)
+			self.assertIsNone(labii.upload(self.small, WORKSPACES))
+
+if __name__ == "__main__":
+	unittest.main()
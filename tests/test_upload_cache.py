@@ -0,0 +1,133 @@
+"""
+Test the UploadCache: the reuse of the uploaded file records, their eviction, the locks of the keys and the failed uploads.
+"""
+import io
+import os
+import time
+import tempfile
+import threading
+import unittest
+import contextlib
+from upload_cache import UploadCache, CachedLabiiObject
+
+WORKSPACES = [{"sid": "testproject0a40xprj"}]
+
+class FakeUploader:
+	""" the upload of a LabiiObject, returns a new file record per call, or the response of a failed upload """
+
+	def __init__(self, failed=False, response=None, delay=0):
+		self.failed = failed
+		self.response = response
+		self.delay = delay
+		self.calls = []
+		self.lock = threading.Lock()
+
+	def upload(self, file_path, workspaces):#pylint: disable=unused-argument
+		""" return the file record of the upload """
+		time.sleep(self.delay)
+		with self.lock:
+			self.calls.append(os.path.basename(file_path))
+			uid = f"FI{len(self.calls)}"
+		if self.failed:
+			return self.response
+		return {"sid": f"sid{uid}", "uid": uid, "name": os.path.basename(file_path), "version": {"sid": f"V{uid}"}, "url": "ignored"}
+
+class UploadCacheTest(unittest.TestCase):
+	""" UploadCache and CachedLabiiObject """
+
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()#pylint: disable=consider-using-with
+		self.cache_path = os.path.join(self.folder.name, "cache.sqlite")
+		# the cache prints the reused files
+		stack = contextlib.ExitStack()
+		stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+		self.addCleanup(stack.close)
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def write(self, name, content):
+		""" write a file, return its path """
+		path = os.path.join(self.folder.name, name)
+		with open(path, "w", encoding="utf-8") as file:
+			file.write(content)
+		return path
+
+	def test_hits(self):
+		""" the same content is uploaded once, also by a later run, the other uploads reuse its file record """
+		first = self.write("first.txt", "same content")
+		second = self.write("second.txt", "same content")
+		uploader = FakeUploader()
+		with UploadCache(self.cache_path) as cache:
+			labii = CachedLabiiObject(uploader, cache)
+			file_record = labii.upload(first, WORKSPACES)
+			self.assertEqual(labii.upload(second, WORKSPACES), {key: file_record[key] for key in ("sid", "uid", "name", "version")})
+			self.assertEqual(cache.stats, {"hits": 1, "misses": 1, "uploaded_bytes": 12, "saved_bytes": 12})
+			# other workspaces are another key
+			labii.upload(second, [{"sid": "otherproject0a4prj"}])
+		with UploadCache(self.cache_path) as cache:
+			self.assertEqual(cache.upload(uploader, first, WORKSPACES)["uid"], "FI1")
+			self.assertEqual(cache.stats["hits"], 1)
+			self.assertIn("0.0 MB saved", cache.report())
+		self.assertEqual(uploader.calls, ["first.txt", "second.txt"])
+
+	def test_evict_count(self):
+		""" the least recently used records are evicted above max_entries """
+		paths = [self.write(f"file {index}.txt", f"content {index}") for index in range(4)]
+		uploader = FakeUploader()
+		with UploadCache(self.cache_path, max_entries=3) as cache:
+			for path in paths[:3]:
+				cache.upload(uploader, path, WORKSPACES)
+			# file 0 is used again, file 1 is now the least recently used
+			time.sleep(0.01)
+			cache.upload(uploader, paths[0], WORKSPACES)
+			cache.upload(uploader, paths[3], WORKSPACES)
+			self.assertEqual(cache.connection.execute("SELECT COUNT(*) FROM uploads").fetchone()[0], 3)
+			cache.upload(uploader, paths[1], WORKSPACES)
+			cache.upload(uploader, paths[0], WORKSPACES)
+		self.assertEqual(uploader.calls, ["file 0.txt", "file 1.txt", "file 2.txt", "file 3.txt", "file 1.txt"])
+
+	def test_evict_age(self):
+		""" the records older than max_age are not reused, and are removed by the next cache """
+		path = self.write("file.txt", "content")
+		uploader = FakeUploader()
+		with UploadCache(self.cache_path, max_age=3600) as cache:
+			cache.upload(uploader, path, WORKSPACES)
+			cache.connection.execute("UPDATE uploads SET created = ?", (time.time() - 7200,))
+			cache.upload(uploader, path, WORKSPACES)
+			self.assertEqual(cache.stats["hits"], 0)
+			cache.connection.execute("UPDATE uploads SET created = ?", (time.time() - 7200,))
+		with UploadCache(self.cache_path, max_age=3600) as cache:
+			self.assertEqual(cache.connection.execute("SELECT COUNT(*) FROM uploads").fetchone()[0], 0)
+		self.assertEqual(uploader.calls, ["file.txt", "file.txt"])
+
+	def test_key_locks(self):
+		""" threads uploading the same content upload it once, and the locks of the keys are removed after the uploads """
+		paths = [self.write(f"file {index}.txt", f"content {index % 2}") for index in range(8)]
+		uploader = FakeUploader(delay=0.05)
+		with UploadCache(self.cache_path) as cache:
+			threads = [threading.Thread(target=cache.upload, args=(uploader, path, WORKSPACES)) for path in paths]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			self.assertEqual(len(uploader.calls), 2)
+			self.assertEqual(cache.stats["hits"], 6)
+			self.assertEqual(cache.key_locks, {})
+
+	def test_failed_upload(self):
+		""" a failed upload is returned but not cached, the next upload of the content tries again """
+		path = self.write("file.txt", "content")
+		with UploadCache(self.cache_path) as cache:
+			for response in (None, "Error: failed to upload"):
+				with self.subTest(response=response):
+					uploader = FakeUploader(failed=True, response=response)
+					self.assertEqual(cache.upload(uploader, path, WORKSPACES), response)
+					self.assertEqual(cache.upload(uploader, path, WORKSPACES), response)
+					self.assertEqual(len(uploader.calls), 2)
+			self.assertEqual(cache.stats["hits"], 0)
+			self.assertEqual(cache.key_locks, {})
+			self.assertEqual(cache.upload(FakeUploader(), path, WORKSPACES)["uid"], "FI1")
+
+if __name__ == "__main__":
+	unittest.main()
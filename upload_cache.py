@@ -0,0 +1,159 @@
+"""
+The `upload_cache.py` module avoids uploading the same file content twice. The file records returned by `labii.upload` are kept in a persistent cache, keyed by the sha256 of the file content and the workspaces, and reused when a file with the same content is uploaded again.
+Usage:
+	labii = CachedLabiiObject(labii, UploadCache())
+	labii.upload(file_path, workspaces) # the file record of the cache if the content was uploaded before
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+from migration_journal import file_sha256
+
+DEFAULT_UPLOAD_CACHE_PATH = "labii_upload_cache.sqlite"
+
+class UploadCache:
+	"""
+		Persistent cache of the uploaded file records, stored in SQLite
+		- max_entries, the least recently used records are evicted above this number
+		- max_age, seconds after which a record is evicted, default 30 days
+		- stats, the hits, misses, uploaded and saved bytes of this run
+		Safe to share between threads, the same content is only uploaded once when requested by several threads.
+	"""
+
+	def __init__(self, path=DEFAULT_UPLOAD_CACHE_PATH, max_entries=100000, max_age=30 * 24 * 3600):
+		self.path = path
+		self.max_entries = max_entries
+		self.max_age = max_age
+		self.stats = {"hits": 0, "misses": 0, "uploaded_bytes": 0, "saved_bytes": 0}
+		self.lock = threading.Lock()
+		self.key_locks = {} # key -> [lock, number of threads holding or waiting for it]
+		self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute("""
+			CREATE TABLE IF NOT EXISTS uploads (
+				sha256 TEXT NOT NULL,
+				workspaces TEXT NOT NULL,
+				size INTEGER NOT NULL,
+				record TEXT NOT NULL,
+				created REAL NOT NULL,
+				last_used REAL NOT NULL,
+				hits INTEGER NOT NULL DEFAULT 0,
+				PRIMARY KEY (sha256, workspaces)
+			)
+		""")
+		self.connection.execute("CREATE INDEX IF NOT EXISTS uploads_last_used ON uploads (last_used)")
+		self.evict()
+
+	def close(self):
+		""" close the cache """
+		with self.lock:
+			self.connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def evict(self):
+		""" remove the records older than max_age and the least recently used records above max_entries """
+		with self.lock:
+			self.connection.execute("DELETE FROM uploads WHERE created < ?", (time.time() - self.max_age,))
+			count = self.connection.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+			if count > self.max_entries:
+				self.connection.execute(
+					"DELETE FROM uploads WHERE rowid IN (SELECT rowid FROM uploads ORDER BY last_used LIMIT ?)",
+					(count - self.max_entries,)
+				)
+
+	def get(self, sha256, workspaces):
+		""" return the cached file record, None if not cached or expired """
+		with self.lock:
+			row = self.connection.execute(
+				"SELECT record, created FROM uploads WHERE sha256 = ? AND workspaces = ?",
+				(sha256, workspaces)
+			).fetchone()
+			if row is None or row[1] < time.time() - self.max_age:
+				return None
+			self.connection.execute(
+				"UPDATE uploads SET last_used = ?, hits = hits + 1 WHERE sha256 = ? AND workspaces = ?",
+				(time.time(), sha256, workspaces)
+			)
+		return json.loads(row[0])
+
+	def put(self, sha256, workspaces, size, file_record):
+		""" cache the sid, uid, name and version of the file record """
+		record = {
+			"sid": file_record["sid"],
+			"uid": file_record["uid"],
+			"name": file_record["name"],
+			"version": {"sid": file_record["version"]["sid"]}
+		}
+		now = time.time()
+		with self.lock:
+			self.connection.execute(
+				"INSERT OR REPLACE INTO uploads (sha256, workspaces, size, record, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+				(sha256, workspaces, size, json.dumps(record), now, now)
+			)
+			count = self.connection.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+		if count > self.max_entries:
+			self.evict()
+
+	@contextlib.contextmanager
+	def key_lock(self, key):
+		""" hold the lock of a cache key, so that the same content is not uploaded by two threads; the lock is removed once no thread holds or waits for it """
+		with self.lock:
+			entry = self.key_locks.setdefault(key, [threading.Lock(), 0])
+			entry[1] += 1
+		try:
+			with entry[0]:
+				yield
+		finally:
+			with self.lock:
+				entry[1] -= 1
+				if entry[1] == 0:
+					del self.key_locks[key]
+
+	def upload(self, labii, file_path, workspaces):
+		""" return the cached file record of the file content, upload the file if not cached """
+		sha256 = file_sha256(file_path)
+		workspaces_key = ",".join(sorted(workspace["sid"] for workspace in workspaces))
+		size = os.path.getsize(file_path)
+		with self.key_lock((sha256, workspaces_key)):
+			file_record = self.get(sha256, workspaces_key)
+			if file_record is not None:
+				with self.lock:
+					self.stats["hits"] += 1
+					self.stats["saved_bytes"] += size
+				print(f"Reused {os.path.basename(file_path)} ({file_record['uid']}: {file_record['name']})")
+				return file_record
+			file_record = labii.upload(file_path, workspaces)
+			with self.lock:
+				self.stats["misses"] += 1
+				self.stats["uploaded_bytes"] += size
+			if isinstance(file_record, dict) and "sid" in file_record:
+				self.put(sha256, workspaces_key, size, file_record)
+			return file_record
+
+	def report(self):
+		""" return the summary of the cache for this run and in total """
+		with self.lock:
+			total_saved = self.connection.execute("SELECT COALESCE(SUM(hits * size), 0) FROM uploads").fetchone()[0]
+		return f"Upload cache: {self.stats['hits']} reused, {self.stats['misses']} uploaded, {self.stats['saved_bytes'] / 1024 / 1024:.1f} MB saved ({total_saved / 1024 / 1024:.1f} MB in total)"
+
+class CachedLabiiObject:
+	""" LabiiObject with the uploads going through an UploadCache, all other attributes are the ones of the LabiiObject """
+
+	def __init__(self, labii, cache):
+		self.labii = labii
+		self.cache = cache
+
+	def __getattr__(self, name):
+		return getattr(self.labii, name)
+
+	def upload(self, file_path, workspaces):
+		""" upload the file unless the same content was uploaded before, return the file record """
+		return self.cache.upload(self.labii, file_path, workspaces)